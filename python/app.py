@@ -6,16 +6,21 @@ import sys
 import threading
 import time
 import uuid
-from concurrent.futures import ThreadPoolExecutor
-from typing import List
+from typing import List, Optional
 
 import psutil
-from fastapi import Body, FastAPI
+from fastapi import Body, FastAPI, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.routing import APIRoute
 
 import monkey_patch_init
+from inference import metrics
 from inference.api_models import (
+    BatchProgressReq,
+    BatchProgressResp,
     ClearJobReq,
+    CreateBatchReq,
+    CreateBatchResp,
     CreateSongReq,
     CreateSongResp,
     DeviceOptionsResp,
@@ -23,41 +28,123 @@ from inference.api_models import (
     JobProgressReq,
     JobProgressResp,
     JobsResp,
+    STATUS,
     SetDeviceReq,
     ShutdownResp,
     StemmingModelsResp,
     StopJobReq,
     TorchDevice,
+    WarmupReq,
+    WarmupResp,
 )
+from inference.artifact_store import artifact_stores
+from inference.coalescing import JobCoalescer, follower_progress, job_directory, job_key
 from inference.config import config
+from inference.hashing import file_hashes
 from inference.inference_conf import stemming_models_list
-
+from inference.job_events import JobEventBroker
+from inference.job_store import FINISHED_STATUSES, JobStore, StopRequests
+from inference.job_timing import throughput_history
+from inference.model_pool import model_pool
+from inference.scheduler import JobScheduler, parse_stage_slots
+from inference.warmup import DEFAULT_PRELOAD_MODELS, warmup
+from inference.worker_pool import WorkerExited, WorkerPool
+from server_args import get_server_args
 
 app = FastAPI(
     title="Replay",
     version="1.0",
     description="Api for replay",
 )
-RUNNING_JOBS: dict[str, JobProgressResp] = {}
-STOP_JOBS: List[str] = []
-queue = asyncio.Queue()
 logger = logging.getLogger(__name__)
+server_args = get_server_args()
 
-
-executor = ThreadPoolExecutor(max_workers=1)
+DATA_DIR = server_args.data_dir or server_args.log_dir
+RUNNING_JOBS = JobStore(
+    os.path.join(DATA_DIR, "replay-jobs.sqlite3"),
+    retention_seconds=server_args.job_retention_hours * 60 * 60,
+)
+STOP_JOBS = StopRequests()
+# duplicate submissions of a job that is already queued or running follow that job instead of running again
+coalescer = JobCoalescer()
+queue = asyncio.Queue()
+JOBS_PAGE_SIZE = 200
+JOB_EVICTION_INTERVAL_SECONDS = 10 * 60
+job_event_broker = JobEventBroker(max_updates_per_second=server_args.progress_updates_per_second)
+RUNNING_JOBS.add_listener(job_event_broker.publish, job_event_broker.publish_removed)
+scheduler = JobScheduler(
+    max_jobs=server_args.max_jobs,
+    cpu_slots=server_args.cpu_slots,
+    device_slots=server_args.device_slots,
+    stage_slots=parse_stage_slots(server_args.stage_slots),
+)
+model_pool.configure(
+    ram_budget_bytes=server_args.model_ram_budget_mb << 20,
+    vram_budget_bytes=server_args.model_vram_budget_mb << 20,
+)
+# stage throughput measured by past jobs, for their ETAs
+THROUGHPUT_DB_PATH = os.path.join(DATA_DIR, "replay-throughput.sqlite3")
+throughput_history.configure(THROUGHPUT_DB_PATH)
+artifact_stores.configure(server_args.artifact_quota_mb << 20)
+# content hashes of songs and models by path, size and mtime, so a file is only read once to hash it
+HASHES_DB_PATH = os.path.join(DATA_DIR, "replay-hashes.sqlite3")
+file_hashes.configure(HASHES_DB_PATH)
+# started on startup when jobs run in worker processes (--job-workers > 0)
+worker_pool: Optional[WorkerPool] = None
+active_jobs = 0
+metrics.QUEUE_LENGTH.set_function(lambda: queue.qsize())
+metrics.ACTIVE_JOBS.set_function(lambda: active_jobs)
 
 
 async def process_queue():
-    while True:
-        body, job_id = await queue.get()
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(executor, run_inference, body, job_id)
+    loop = asyncio.get_event_loop()
+    job_slots = asyncio.Semaphore(scheduler.max_jobs)
+
+    def on_job_done(_):
+        global active_jobs
+        active_jobs -= 1
+        job_slots.release()
         queue.task_done()
 
+    global active_jobs
+    while True:
+        run, args = await queue.get()
+        # keep jobs in our fifo until a job thread is free, so stop/clear still apply to them
+        await job_slots.acquire()
+        active_jobs += 1
+        future = loop.run_in_executor(scheduler.executor, run, *args)
+        future.add_done_callback(on_job_done)
+
+
+async def evict_finished_jobs():
+    while True:
+        RUNNING_JOBS.evict_finished()
+        await asyncio.sleep(JOB_EVICTION_INTERVAL_SECONDS)
+
 
 @app.on_event("startup")
 async def startup_event():
+    global worker_pool
+    if server_args.job_workers > 0:
+        worker_pool = WorkerPool(
+            server_args.job_workers,
+            scheduler,
+            ram_budget_bytes=server_args.model_ram_budget_mb << 20,
+            vram_budget_bytes=server_args.model_vram_budget_mb << 20,
+            throughput_db_path=THROUGHPUT_DB_PATH,
+            artifact_quota_bytes=server_args.artifact_quota_mb << 20,
+            hashes_db_path=HASHES_DB_PATH,
+        )
+        warmup.load = worker_pool.preload
+    # anything still queued or running belonged to a server that died, run it again
+    for job_id, body in RUNNING_JOBS.take_interrupted():
+        logger.info(f"Re-queueing interrupted job {job_id}")
+        await queue.put((run_inference, (body, job_id)))
     asyncio.create_task(process_queue())
+    asyncio.create_task(evict_finished_jobs())
+    preload_models = [name.strip() for name in server_args.preload_models.split(",") if name.strip()]
+    if server_args.weights_dir and preload_models:
+        warmup.start(server_args.weights_dir, preload_models)
 
 
 @app.get("/", response_model=HealthResp)
@@ -65,8 +152,7 @@ async def index():
     return {"ok": True}
 
 
-@app.get("/device_options", response_model=DeviceOptionsResp)
-async def device_options():
+def available_devices() -> List[str]:
     import torch
 
     devices = ["cpu"]
@@ -74,6 +160,13 @@ async def device_options():
         devices.append("mps")
     if torch.cuda.is_available():
         devices.append("cuda")
+    return devices
+
+
+@app.get("/device_options", response_model=DeviceOptionsResp)
+async def device_options():
+    # the first call imports torch, which takes seconds; keep the event loop (and /health) responsive meanwhile
+    devices = await asyncio.get_event_loop().run_in_executor(None, available_devices)
     return DeviceOptionsResp(devices=devices)
 
 
@@ -85,31 +178,91 @@ async def set_device(body: SetDeviceReq = Body(...)):
 
 @app.get("/health", response_model=HealthResp)
 async def health():
-    return {"ok": True}
+    return HealthResp(ok=True, ready=warmup.ready)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text format: queue and job gauges, per-stage duration histograms, model pool and disk counters."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/warmup", response_model=WarmupResp)
+async def warmup_status():
+    return warmup.status()
+
+
+@app.post("/warmup", response_model=WarmupResp)
+async def start_warmup(body: WarmupReq = Body(...)):
+    """Preload models in the background; poll GET /warmup for per-model timings."""
+    warmup.start(body.weightsPath, body.models or DEFAULT_PRELOAD_MODELS)
+    return warmup.status()
 
 
 @app.post("/song_progress", response_model=JobProgressResp)
 async def song_progress(body: JobProgressReq = Body(...)):
     """Create the song."""
     jobId = body.jobId
-    if jobId not in RUNNING_JOBS:
+    progress = RUNNING_JOBS.get(jobId)
+    if progress is None:
         return JobProgressResp(status="unknown_job", message="Error: Job not found")
-    print("Health: ", RUNNING_JOBS[jobId])
-    return RUNNING_JOBS[jobId]
+    return progress
+
+
+@app.get("/job_events")
+async def job_events(jobId: Optional[str] = None, maxUpdatesPerSecond: Optional[float] = None):
+    """Stream job progress as server-sent events: a snapshot, then only the fields that changed."""
+    return StreamingResponse(
+        job_event_broker.stream(jobId, maxUpdatesPerSecond),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if worker_pool is not None:
+        worker_pool.shutdown()
 
 
-def run_inference(body: CreateSongReq, job_id: str):
+def publish_progress(job_id: str, progress: JobProgressResp):
+    """Set the progress of the job and of every job coalesced with it."""
+    for subscriber in coalescer.subscribers(job_id):
+        # a job cleared while running keeps going, but nobody wants its progress anymore
+        if subscriber not in RUNNING_JOBS:
+            continue
+        if subscriber == job_id:
+            RUNNING_JOBS.set(subscriber, progress)
+        else:
+            RUNNING_JOBS.set(subscriber, progress_for_follower(job_id, subscriber, progress))
+    if progress.status in FINISHED_STATUSES:
+        coalescer.finish(job_id)
+
+
+def progress_for_follower(primary: str, follower: str, progress: JobProgressResp) -> JobProgressResp:
+    """The primary's progress for a job coalesced with it, with the outputs in the follower's own directory."""
+    source, target = coalescer.directory(primary), coalescer.directory(follower)
+    if source is None or target is None:
+        return progress.model_copy(update={"jobId": follower})
+    return follower_progress(progress, follower, source, target)
+
+
+def run_inference(body: CreateSongReq, job_id: str, model=None):
     from inference.inference_manager import InferenceManager
 
     """Run the inference."""
-    # If we're no longer in the queue, exit
-    if job_id not in RUNNING_JOBS:
+    # If nobody is waiting for the result anymore, exit
+    if not any(subscriber in RUNNING_JOBS for subscriber in coalescer.subscribers(job_id)):
+        coalescer.finish(job_id)
+        return
+    if worker_pool is not None:
+        with worker_pool.reserve() as worker:
+            run_in_worker(worker, body, job_id)
         return
     try:
         # Callbacks for setting status/checking shutdown
         def set_status(status: JobProgressResp):
-            status.jobId = job_id
-            RUNNING_JOBS[job_id] = status
+            publish_progress(job_id, status)
 
         def check_stop_job():
             return job_id in STOP_JOBS
@@ -125,24 +278,87 @@ def run_inference(body: CreateSongReq, job_id: str):
             job_id=job_id,
             set_status=set_status,
             check_stop_job=check_stop_job,
+            scheduler=scheduler,
+            model=model,
         )
         inference_manager.infer()
     except Exception as e:
-        logger.info(f"Exception in run_inference {e}")
-
+        logger.error(f"Exception in run_inference {e}")
+        progress = (RUNNING_JOBS.get(job_id) or queued_progress(body, job_id)).model_copy()
+        if progress.status not in FINISHED_STATUSES:
+            # the job and the jobs coalesced with it would otherwise wait on it forever
+            progress.status = "errored"
+            progress.message = "Error"
+            progress.error = str(e)
+        publish_progress(job_id, progress)
+
+
+def run_in_worker(worker, body: CreateSongReq, job_id: str):
+    if job_id in STOP_JOBS:
+        progress = queued_progress(body, job_id)
+        progress.status = "stopped"
+        progress.message = "Stopped"
+        publish_progress(job_id, progress)
+        return
 
-@app.post("/create_song", response_model=CreateSongResp)
-async def create_song(body: CreateSongReq = Body(...)):
-    """Create the song."""
-    job_id = uuid.uuid4().hex
-    resp = CreateSongResp(jobId=job_id)
+    try:
+        worker.run_song(body, job_id, publish_progress)
+    except WorkerExited as e:
+        progress = (RUNNING_JOBS.get(job_id) or queued_progress(body, job_id)).model_copy()
+        if e.cancelled:
+            progress.status = "stopped"
+            progress.message = "Stopped"
+        else:
+            logger.error(f"Worker running job {job_id} crashed: {e}")
+            progress.status = "errored"
+            progress.message = "Error"
+            progress.error = f"The conversion process crashed (exit code {e.exitcode})"
+        publish_progress(job_id, progress)
+
+
+def run_batch(body: CreateBatchReq, job_ids: List[str]):
+    """Run every track of a batch against one loaded voice model."""
+    from inference.inference_manager import InferenceManager
 
+    tracks = [(job_id, song_req_for_track(body, path)) for job_id, path in zip(job_ids, body.songUrlOrFilePaths)]
+    if worker_pool is not None:
+        # the worker keeps the voice model warm between tracks
+        with worker_pool.reserve() as worker:
+            for job_id, track_body in tracks:
+                if job_id in RUNNING_JOBS:
+                    run_in_worker(worker, track_body, job_id)
+        return
+    model_entry = None
+    try:
+        if not (body.options and body.options.vocalsOnly):
+            try:
+                with scheduler.stage("rvc"):
+                    model_entry = InferenceManager.acquire_model(body.modelPath, body.modelId)
+            except Exception as e:
+                logger.info(f"Exception loading model for batch {e}")
+                for job_id, track_body in tracks:
+                    if job_id in RUNNING_JOBS:
+                        progress = queued_progress(track_body, job_id)
+                        progress.status = "errored"
+                        progress.message = "Error"
+                        progress.error = str(e)
+                        RUNNING_JOBS.set(job_id, progress)
+                return
+        model = model_entry.model if model_entry is not None else None
+        for job_id, track_body in tracks:
+            run_inference(track_body, job_id, model=model)
+    finally:
+        if model_entry is not None:
+            model_pool.release(model_entry)
+
+
+def queued_progress(body: CreateSongReq, job_id: str) -> JobProgressResp:
     track_name = ""
     if body.songUrlOrFilePath:
         basename = os.path.basename(body.songUrlOrFilePath)
         track_name = os.path.splitext(basename or "")[0]
 
-    RUNNING_JOBS[job_id] = JobProgressResp(
+    return JobProgressResp(
         status="queued",
         message="Waiting to start...",
         options=body.options,
@@ -152,39 +368,124 @@ async def create_song(body: CreateSongReq = Body(...)):
         trackName=track_name or "",
     )
 
-    await queue.put((body, job_id))
+
+def song_req_for_track(body: CreateBatchReq, song_url_or_file_path: str) -> CreateSongReq:
+    return CreateSongReq(
+        outputDirectory=body.outputDirectory,
+        modelPath=body.modelPath,
+        weightsPath=body.weightsPath,
+        modelId=body.modelId,
+        songUrlOrFilePath=song_url_or_file_path,
+        options=body.options,
+    )
+
+
+@app.post("/create_song", response_model=CreateSongResp)
+async def create_song(body: CreateSongReq = Body(...)):
+    """Create the song."""
+    job_id = uuid.uuid4().hex
+    resp = CreateSongResp(jobId=job_id)
+    RUNNING_JOBS.add(job_id, body, queued_progress(body, job_id))
+
+    try:
+        key = await asyncio.get_running_loop().run_in_executor(None, job_key, body)
+    except OSError as e:
+        logger.info(f"Not coalescing job {job_id}, unable to read its source: {e}")
+        key = None
+    primary = coalescer.join(key, job_id, job_directory(body, job_id)) if key is not None else None
+    if primary is not None:
+        logger.info(f"Job {job_id} is the same as job {primary}, following it")
+        progress = RUNNING_JOBS.get(primary)
+        if progress is not None:
+            RUNNING_JOBS.set(job_id, progress_for_follower(primary, job_id, progress))
+        return resp
+
+    await queue.put((run_inference, (body, job_id)))
     return resp
 
 
+@app.post("/create_batch", response_model=CreateBatchResp)
+async def create_batch(body: CreateBatchReq = Body(...)):
+    """Convert many songs with one voice model, loading the model once for the whole batch."""
+    batch_id = uuid.uuid4().hex
+    job_ids = []
+    for path in body.songUrlOrFilePaths:
+        job_id = uuid.uuid4().hex
+        track_body = song_req_for_track(body, path)
+        RUNNING_JOBS.add(job_id, track_body, queued_progress(track_body, job_id), batch_id)
+        job_ids.append(job_id)
+
+    await queue.put((run_batch, (body, job_ids)))
+    return CreateBatchResp(batchId=batch_id, jobIds=job_ids)
+
+
+@app.post("/batch_progress", response_model=BatchProgressResp)
+async def batch_progress(body: BatchProgressReq = Body(...)):
+    jobs_in_batch = RUNNING_JOBS.batch(body.batchId)
+    if not jobs_in_batch:
+        return BatchProgressResp(status="unknown_job", batchId=body.batchId)
+
+    finished = [job for job in jobs_in_batch if job.status in FINISHED_STATUSES]
+    if len(finished) == len(jobs_in_batch):
+        status = "completed" if any(job.status == "completed" for job in finished) else finished[-1].status
+    elif finished or any(job.status == "processing" for job in jobs_in_batch):
+        status = "processing"
+    else:
+        status = "queued"
+    return BatchProgressResp(
+        status=status,
+        batchId=body.batchId,
+        completedTracks=len(finished),
+        totalTracks=len(jobs_in_batch),
+        jobs=jobs_in_batch,
+    )
+
+
 @app.post("/clear_job")
 async def clear_job(body: ClearJobReq = Body(...)):
-    if body.jobId in RUNNING_JOBS:
-        del RUNNING_JOBS[body.jobId]
-    # remove from STOP_JOBS list
-    if body.jobId in STOP_JOBS:
-        STOP_JOBS.remove(body.jobId)
+    # the work goes on for any other job coalesced with this one
+    coalescer.leave(body.jobId)
+    RUNNING_JOBS.remove(body.jobId)
+    # remove from STOP_JOBS
+    STOP_JOBS.discard(body.jobId)
     return {}
 
 
 @app.post("/stop_job")
 async def stop_job(body: StopJobReq = Body(...)):
-    if body.jobId in RUNNING_JOBS:
-        STOP_JOBS.append(body.jobId)
+    if body.jobId not in RUNNING_JOBS:
+        return {}
+    # only stop the work once no other job coalesced with this one is following it
+    orphan = coalescer.leave(body.jobId)
+    if orphan != body.jobId:
+        # the job no longer gets the work's progress, so it won't see the work stop
+        progress = RUNNING_JOBS.get(body.jobId)
+        if progress is not None and progress.status not in FINISHED_STATUSES:
+            RUNNING_JOBS.set(body.jobId, progress.model_copy(update={"status": "stopped", "message": "Stopped"}))
+    if orphan is None:
+        return {}
+    STOP_JOBS.add(orphan)
+    if worker_pool is not None:
+        worker_pool.cancel(orphan)
     return {}
 
 
 @app.get("/jobs", response_model=JobsResp)
-async def jobs():
-    jobs_in_progress = []
-    for job_id, job in RUNNING_JOBS.items():
-        job.jobId = job_id
-        jobs_in_progress.append(job)
-    return JobsResp(jobs=jobs_in_progress)
+async def jobs(
+    status: Optional[List[STATUS]] = Query(default=None),
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=JOBS_PAGE_SIZE, ge=1, le=1000),
+):
+    return JobsResp(
+        jobs=RUNNING_JOBS.list(status, offset=offset, limit=limit),
+        total=RUNNING_JOBS.count(status),
+    )
 
 
 @app.get("/torch_device", response_model=TorchDevice)
 async def torch_device():
-    return TorchDevice(device=config.device)
+    device = await asyncio.get_event_loop().run_in_executor(None, lambda: config.device)
+    return TorchDevice(device=device)
 
 
 @app.get("/stemming_models", response_model=StemmingModelsResp)
@@ -148,6 +148,7 @@ def apply_model(
     pool=None,
     static_shifts=1,
     set_progress_bar=None,
+    cancel_token=None,
 ) -> th.Tensor:
     """
     Apply model to a given mixture.
@@ -165,6 +166,8 @@ def apply_model(
             execute the computation, otherwise `mix.device` is assumed.
             When `device` is different from `mix.device`, only local computations will
             be on `device`, while the entire tracks will be stored on `mix.device`.
+        cancel_token: if provided, checked before every chunk; its `raise_if_cancelled`
+            aborts the separation.
     """
 
     global fut_length
@@ -191,6 +194,7 @@ def apply_model(
         "segment": segment,
         "set_progress_bar": set_progress_bar,
         "static_shifts": static_shifts,
+        "cancel_token": cancel_token,
     }
     out: tp.Union[float, th.Tensor]
     if isinstance(model, BagOfModels):
@@ -205,6 +209,8 @@ def apply_model(
         prog_bar = 0
         current_model = 0  # (bag_num + 1)
         for sub_model, weight in zip(model.models, model.weights):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
             original_model_device = next(iter(sub_model.parameters())).device
             sub_model.to(device)
             fut_length += fut_length
@@ -233,6 +239,8 @@ def apply_model(
         padded_mix = mix.padded(length + 2 * max_shift)
         out = 0.0
         for _ in range(shifts):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
             offset = random.randint(0, max_shift)
             shifted = TensorChunk(padded_mix, offset, length + max_shift - offset)
             shifted_out = apply_model(model, shifted, **kwargs)
@@ -269,6 +277,10 @@ def apply_model(
             futures.append((future, offset))
             offset += segment_length
         for future, offset in futures:
+            if cancel_token is not None and cancel_token.cancelled:
+                for pending, _ in futures:
+                    pending.cancel()
+                cancel_token.raise_if_cancelled()
             if set_progress_bar:
                 fut_length = len(futures) * bag_num * static_shifts
                 prog_bar += 1
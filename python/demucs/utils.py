@@ -214,7 +214,7 @@ def tensor_chunk(tensor_or_chunk):
         return TensorChunk(tensor_or_chunk)
 
 
-def apply_model_v1(model, mix, shifts=None, split=False, progress=False, set_progress_bar=None):
+def apply_model_v1(model, mix, shifts=None, split=False, progress=False, set_progress_bar=None, cancel_token=None):
     """
     Apply model to a given mixture.
 
@@ -239,6 +239,8 @@ def apply_model_v1(model, mix, shifts=None, split=False, progress=False, set_pro
         offsets = range(0, length, shift)
         scale = 10
         for offset in offsets:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
             chunk = mix[..., offset : offset + shift]
             if set_progress_bar:
                 progress_value += 1
@@ -256,6 +258,8 @@ def apply_model_v1(model, mix, shifts=None, split=False, progress=False, set_pro
         random.shuffle(offsets)
         out = 0
         for offset in offsets[:shifts]:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
             shifted = mix[..., offset : offset + length + max_shift]
             if set_progress_bar:
                 shifted_out = apply_model_v1(model, shifted, set_progress_bar=set_progress_bar)
@@ -274,7 +278,15 @@ def apply_model_v1(model, mix, shifts=None, split=False, progress=False, set_pro
 
 
 def apply_model_v2(
-    model, mix, shifts=None, split=False, overlap=0.25, transition_power=1.0, progress=False, set_progress_bar=None
+    model,
+    mix,
+    shifts=None,
+    split=False,
+    overlap=0.25,
+    transition_power=1.0,
+    progress=False,
+    set_progress_bar=None,
+    cancel_token=None,
 ):
     """
     Apply model to a given mixture.
@@ -311,6 +323,8 @@ def apply_model_v2(
         # transition_power is 1.
         weight = (weight / weight.max()) ** transition_power
         for offset in offsets:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
             chunk = TensorChunk(mix, offset, segment)
             if set_progress_bar:
                 progress_value += 1
@@ -331,6 +345,8 @@ def apply_model_v2(
         padded_mix = mix.padded(length + 2 * max_shift)
         out = 0
         for _ in range(shifts):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
             offset = random.randint(0, max_shift)
             shifted = TensorChunk(padded_mix, offset, length + max_shift - offset)
 
@@ -457,6 +473,9 @@ class DummyPoolExecutor:
         def result(self):
             return self.func(*self.args, **self.kwargs)
 
+        def cancel(self):
+            return True
+
     def __init__(self, workers=0):
         pass
 
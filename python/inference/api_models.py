@@ -1,7 +1,7 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
-from typing import List, Literal, Optional
+from typing import Dict, List, Literal, Optional
 
 from pydantic import BaseModel, Field
 
@@ -10,6 +10,8 @@ from inference.uvr.constants import DEMUCS_ARCH_TYPE, MDX_ARCH_TYPE, VR_ARCH_TYP
 
 F0_METHODS = Literal["pm", "harvest", "crepe", "crepe-tiny", "mangio-crepe", "mangio-crepe-tiny", "rmvpe"]
 OUTPUT_FORMATS = Literal["wav", "mp3_192k", "mp3_320k"]
+# how index vectors are searched, see inference.retrieval
+INDEX_BACKENDS = Literal["auto", "ivf", "hnsw", "exact"]
 
 
 class CreateSongOptions(BaseModel):
@@ -23,6 +25,8 @@ class CreateSongOptions(BaseModel):
     f0Method: Optional[F0_METHODS] = Field(default="rmvpe")
     stemmingMethod: Optional[str] = Field(default="UVR-MDX-NET Voc FT")
     indexRatio: Optional[float] = Field(default=0.75)
+    indexBackend: Optional[INDEX_BACKENDS] = Field(default="auto")
+    indexNprobe: Optional[int] = Field(default=1)
     consonantProtection: Optional[float] = Field(default=0.35)
     outputFormat: Optional[OUTPUT_FORMATS] = Field(default="mp3_192k")
     volumeEnvelope: Optional[float] = Field(default=1.0)
@@ -37,6 +41,24 @@ class CreateSongReq(BaseModel):
     options: Optional[CreateSongOptions] = Field(default=None)
 
 
+class CreateBatchReq(BaseModel):
+    outputDirectory: str
+    modelPath: str
+    weightsPath: str
+    modelId: Optional[str] = Field(default=None)
+    songUrlOrFilePaths: List[str] = Field(default=...)
+    options: Optional[CreateSongOptions] = Field(default=None)
+
+
+class CreateBatchResp(BaseModel):
+    batchId: str
+    jobIds: List[str] = Field(default=...)
+
+
+class BatchProgressReq(BaseModel):
+    batchId: str
+
+
 class ClearJobReq(BaseModel):
     jobId: str
 
@@ -63,6 +85,8 @@ class JobProgressResp(BaseModel):
     error: Optional[str] = Field(default=None)
     elapsedSeconds: Optional[int] = Field(default=None)
     remainingSeconds: Optional[int] = Field(default=None)
+    # wall-clock seconds per stage so far; segmentation, hubert, f0 and synthesizer are the parts of conversion
+    stageSeconds: Optional[Dict[str, float]] = Field(default=None)
     outputFilepath: Optional[str] = Field(default=None)
     inputFilepath: Optional[str] = Field(default=None)  # this could be the converted youtube path
     preDeechoVocalsFile: Optional[str] = Field(default=None)
@@ -72,11 +96,22 @@ class JobProgressResp(BaseModel):
     options: Optional[CreateSongOptions] = Field(default=None)
     modelId: Optional[str] = Field(default=None)
     songHash: Optional[str] = Field(default=None)
+    # blake2b of the song file, the key of its cached stems; songHash stays the md5 songs are grouped by
+    contentHash: Optional[str] = Field(default=None)
     trackName: Optional[str] = Field(default=None)
 
 
 class JobsResp(BaseModel):
     jobs: List[JobProgressResp] = Field(default=...)
+    total: Optional[int] = Field(default=None)
+
+
+class BatchProgressResp(BaseModel):
+    status: STATUS
+    batchId: Optional[str] = Field(default=None)
+    completedTracks: int = Field(default=0)
+    totalTracks: int = Field(default=0)
+    jobs: List[JobProgressResp] = Field(default=[])
 
 
 class ShutdownResp(BaseModel):
@@ -102,6 +137,31 @@ class StemmingModelsResp(BaseModel):
 
 class HealthResp(BaseModel):
     ok: bool = Field(default=True)
+    # false while a warm-up is loading models, e.g. the --preload-models ones after startup; true without one
+    ready: Optional[bool] = Field(default=None)
+
+
+WARMUP_STATUS = Literal["idle", "warming", "ready", "errored"]
+WARMUP_MODEL_STATUS = Literal["pending", "loading", "ready", "errored"]
+
+
+class WarmupReq(BaseModel):
+    weightsPath: str
+    models: Optional[List[str]] = Field(default=None)
+
+
+class WarmupModelStatus(BaseModel):
+    name: str
+    status: WARMUP_MODEL_STATUS = Field(default="pending")
+    loadSeconds: Optional[float] = Field(default=None)
+    error: Optional[str] = Field(default=None)
+
+
+class WarmupResp(BaseModel):
+    status: WARMUP_STATUS
+    weightsPath: Optional[str] = Field(default=None)
+    elapsedSeconds: Optional[float] = Field(default=None)
+    models: List[WarmupModelStatus] = Field(default=[])
 
 
 class DeviceOptionsResp(BaseModel):
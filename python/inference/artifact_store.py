@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# artifacts used this recently may still be read by a running job (in any worker), so they are never collected
+GC_GRACE_SECONDS = 6 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_last_access ON artifacts (last_access);
+"""
+
+
+def artifact_key(kind: str, *parts) -> str:
+    """Key of an artifact made from inputs identified by parts (content hashes, model hashes, settings)."""
+    digest = hashlib.sha1(kind.encode())
+    for part in parts:
+        digest.update(b"\0" + str(part).encode())
+    return f"{kind}-{digest.hexdigest()}"
+
+
+def disk_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for directory, _, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.path.getsize(os.path.join(directory, file))
+            except OSError:
+                pass
+    return size
+
+
+class ArtifactStore:
+    """Index of the cached files a job can reuse (stems, copies of originals, youtube downloads) under one output
+    directory, keyed by what they were made from.
+
+    Cache hits are answered from the index rather than by probing the disk. Once the artifacts take more than the
+    quota, the least recently used ones are deleted. The index is an SQLite file in the directory itself, shared by
+    the server and its worker processes.
+    """
+
+    def __init__(self, root: str, quota_bytes: int = 0):
+        self.root = os.path.abspath(root)
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self.db_path = os.path.join(self.root, "artifacts.sqlite3")
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._forget_missing()
+
+    def _forget_missing(self):
+        """Drop index entries whose files were deleted behind our back, so lookups can trust the index."""
+        with self._lock:
+            rows = self._db.execute("SELECT key, path FROM artifacts").fetchall()
+            missing = [(key,) for key, path in rows if not os.path.exists(path)]
+            if missing:
+                logger.info(f"Artifacts: forgetting {len(missing)} artifacts missing from {self.root}")
+                self._db.executemany("DELETE FROM artifacts WHERE key = ?", missing)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Path of the artifact, marking it as used, or None if it was never recorded or has been collected."""
+        with self._lock:
+            row = self._db.execute("SELECT path FROM artifacts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE artifacts SET last_access = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def record(self, key: str, kind: str, path: str):
+        """Add a finished artifact (a file or a directory) to the index, then collect old ones if over quota."""
+        now = time.time()
+        size = disk_size(path)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO artifacts (key, kind, path, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET path = excluded.path, size = excluded.size, "
+                "last_access = excluded.last_access",
+                (key, kind, os.path.abspath(path), size, now, now),
+            )
+        self.collect()
+
+    def refresh(self, key: str):
+        """Re-measure an artifact that grew after it was recorded, e.g. a stems directory that got previews."""
+        with self._lock:
+            row = self._db.execute("SELECT path FROM artifacts WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE artifacts SET size = ? WHERE key = ?", (disk_size(row[0]), key))
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+
+    def collect(self):
+        """Delete least recently used artifacts until the store fits its quota."""
+        if self.quota_bytes <= 0:
+            return
+        with self._lock:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+            if total <= self.quota_bytes:
+                return
+            candidates = self._db.execute(
+                "SELECT key, path, size FROM artifacts WHERE last_access < ? ORDER BY last_access",
+                (time.time() - GC_GRACE_SECONDS,),
+            ).fetchall()
+            for key, path, size in candidates:
+                if total <= self.quota_bytes:
+                    break
+                # drop the entry first, so nobody is handed a path that is being deleted
+                self._db.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        logger.error(f"Artifacts: unable to delete {path}: {e}")
+                total -= size
+                logger.info(f"Artifacts: collected {path} ({size >> 20}MB)")
+
+
+class ArtifactStores:
+    """One store per output directory, all sharing the configured quota."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stores: Dict[str, ArtifactStore] = {}
+        self.quota_bytes = 0
+
+    def configure(self, quota_bytes: int):
+        with self._lock:
+            self.quota_bytes = quota_bytes
+            for store in self._stores.values():
+                store.quota_bytes = quota_bytes
+
+    def get(self, root: str) -> ArtifactStore:
+        root = os.path.abspath(root)
+        with self._lock:
+            if root not in self._stores:
+                self._stores[root] = ArtifactStore(root, self.quota_bytes)
+            return self._stores[root]
+
+
+artifact_stores = ArtifactStores()
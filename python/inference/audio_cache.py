@@ -0,0 +1,133 @@
+import gc
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
+
+import ffmpeg
+import numpy as np
+
+from inference import metrics
+from inference.cancel import CancelToken, JobCancelled, communicate
+
+logger = logging.getLogger(__name__)
+
+# every file is decoded once at this rate, in stereo; other rates and mono are derived from it
+DECODE_SAMPLE_RATE = 44100
+DECODE_CHANNELS = 2
+
+ViewKey = Tuple[str, int, bool, str]  # path, sample rate, mono, resampler
+
+
+class AudioCache:
+    """Decoded audio of one job, shared by its stages, so each file is decoded once however many stages read it.
+
+    A file is decoded by ffmpeg to float32 stereo at 44.1kHz into a temporary file and memory-mapped. Other rates and
+    mono views are resampled from that and kept in memory. Arrays are (channels, samples), or (samples,) when mono,
+    and read-only: copy before changing them.
+    """
+
+    def __init__(self, cancel_token: Optional[CancelToken] = None, directory: Optional[str] = None):
+        self.cancel_token = cancel_token
+        self.directory = tempfile.mkdtemp(prefix="replay-audio-", dir=directory)
+        self._lock = threading.Lock()
+        self._decoded: Dict[Tuple[str, int, int], np.ndarray] = {}
+        self._views: Dict[ViewKey, np.ndarray] = {}
+        self._scratch_count = 0
+
+    @staticmethod
+    def _decode_key(path: str) -> Tuple[str, int, int]:
+        stat = os.stat(path)
+        # a file rewritten in place (same path, new stems) must not be served from the old decode
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+    def put(self, path: str, audio: np.ndarray):
+        """Remember the (channels, samples) 44.1kHz audio just written to path, so reading it doesn't decode it."""
+        if audio.ndim != 2 or audio.shape[0] != DECODE_CHANNELS:
+            return
+        audio = np.asarray(audio, dtype=np.float32)
+        audio.setflags(write=False)
+        with self._lock:
+            self._decoded[self._decode_key(path)] = audio
+
+    def _decode(self, path: str) -> np.ndarray:
+        decode_key = self._decode_key(path)
+        if decode_key in self._decoded:
+            return self._decoded[decode_key]
+        # a name of its own, a failed decode can't leave behind a file the next one trips over
+        fd, raw_path = tempfile.mkstemp(suffix=".f32", dir=self.directory)
+        os.close(fd)
+        try:
+            job = ffmpeg.input(path, threads=0).output(
+                raw_path, format="f32le", acodec="pcm_f32le", ac=DECODE_CHANNELS, ar=DECODE_SAMPLE_RATE
+            )
+            process = job.overwrite_output().run_async(cmd=["ffmpeg", "-nostdin"], pipe_stdout=True, pipe_stderr=True)
+            with metrics.time_stage("decode"):
+                out, err = communicate(process, self.cancel_token)
+            if process.returncode:
+                raise ffmpeg.Error("ffmpeg", out, err)
+        except JobCancelled:
+            self._discard(raw_path)
+            raise
+        except Exception as e:
+            self._discard(raw_path)
+            raise RuntimeError(f"Failed to load audio file {path}: {e}")
+        frames = os.path.getsize(raw_path) // (4 * DECODE_CHANNELS)
+        if frames == 0:
+            self._discard(raw_path)
+            raise RuntimeError(f"Failed to load audio file {path}: no audio decoded")
+        decoded = np.memmap(raw_path, dtype=np.float32, mode="r", shape=(frames, DECODE_CHANNELS)).T
+        self._decoded[decode_key] = decoded
+        return decoded
+
+    def get(
+        self, path: str, sr: int = DECODE_SAMPLE_RATE, mono: bool = False, res_type: str = "kaiser_best"
+    ) -> np.ndarray:
+        """The file's audio at the sample rate, decoding it on first use."""
+        with self._lock:
+            decoded = self._decode(path)
+            if sr == DECODE_SAMPLE_RATE and not mono:
+                return decoded
+            stat = os.stat(path)
+            view_key = (f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}", sr, mono, res_type)
+            if view_key not in self._views:
+                import librosa
+
+                audio = decoded.mean(axis=0, dtype=np.float32) if mono else np.asarray(decoded)
+                if sr != DECODE_SAMPLE_RATE:
+                    audio = librosa.resample(audio, orig_sr=DECODE_SAMPLE_RATE, target_sr=sr, res_type=res_type)
+                audio = np.ascontiguousarray(audio, dtype=np.float32)
+                audio.setflags(write=False)
+                self._views[view_key] = audio
+            return self._views[view_key]
+
+    def scratch(self, shape: Tuple[int, ...]) -> np.memmap:
+        """A zeroed, writable float32 array backed by a file of the cache, for results too big to want in memory."""
+        with self._lock:
+            self._scratch_count += 1
+            path = os.path.join(self.directory, f"scratch-{self._scratch_count}.f32")
+        return np.memmap(path, dtype=np.float32, mode="w+", shape=shape)
+
+    @staticmethod
+    def _discard(path: str):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.error(f"Unable to delete {path} of the audio cache: {e}")
+
+    def close(self):
+        """Delete the cache's files. Arrays it handed out must no longer be in use: windows can't delete a file that
+        is still memory-mapped."""
+        with self._lock:
+            # drop the memory maps before deleting the files behind them
+            self._decoded.clear()
+            self._views.clear()
+        # maps the stages were handed may only be kept alive by reference cycles by now, e.g. of a failed job's frames
+        gc.collect()
+
+        def log_failure(function, path, exc_info):
+            logger.error(f"Unable to delete {path} of the audio cache: {exc_info[1]}")
+
+        shutil.rmtree(self.directory, onerror=log_failure)
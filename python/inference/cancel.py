@@ -0,0 +1,53 @@
+import subprocess
+import threading
+from typing import Callable, Optional
+
+# how often a running subprocess is checked for cancellation
+PROCESS_POLL_SECONDS = 0.25
+
+
+class JobCancelled(RuntimeError):
+    def __init__(self):
+        super().__init__("Stopped")
+
+
+class CancelToken:
+    """Checked between chunks of long running work so a stopped job gives up the device within one chunk."""
+
+    def __init__(self, check: Optional[Callable[[], bool]] = None):
+        self._check = check
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self._check is not None and self._check():
+            self._event.set()
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+
+def raise_if_cancelled(cancel_token: Optional[CancelToken]):
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+
+def communicate(process: subprocess.Popen, cancel_token: Optional[CancelToken] = None, input=None):
+    """Popen.communicate that kills the process as soon as the token is cancelled."""
+    if cancel_token is None:
+        return process.communicate(input)
+    while True:
+        try:
+            return process.communicate(input, timeout=PROCESS_POLL_SECONDS)
+        except subprocess.TimeoutExpired:
+            # input has been written by the first call, it must not be passed again
+            input = None
+            if cancel_token.cancelled:
+                process.kill()
+                process.communicate()
+                raise JobCancelled()
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional, Set
+
+from inference.api_models import CreateSongOptions, CreateSongReq, JobProgressResp
+from inference.hashing import file_hashes
+
+logger = logging.getLogger(__name__)
+
+# progress fields that may point into the job's own directory, and are moved to a follower's
+OUTPUT_PATH_FIELDS = ("outputFilepath", "convertedVocalsPath", "originalVocalsPath", "preDeechoVocalsFile")
+
+
+def source_identity(song_url_or_file_path: str) -> str:
+    """Content hash of a local file, or the url itself for anything that has to be downloaded."""
+    path = song_url_or_file_path.strip()
+    if not os.path.isfile(path):
+        return f"url:{path}"
+    return f"blake2b:{file_hashes.digest(path)}"
+
+
+def normalized_options(options: Optional[CreateSongOptions]) -> Dict:
+    """Options with unset values replaced by what the pipeline would use, so equivalent requests compare equal."""
+    defaults = CreateSongOptions().model_dump()
+    normalized = {}
+    for name, value in (options or CreateSongOptions()).model_dump().items():
+        if value is None:
+            # pitches default to None, which the pipeline treats as no shift
+            value = defaults[name] if defaults[name] is not None else 0
+        normalized[name] = value
+    if not normalized["sampleMode"]:
+        normalized["sampleModeStartTime"] = 0
+    return normalized
+
+
+def job_key(body: CreateSongReq) -> str:
+    """Identical keys produce identical output: same source content, voice model and (normalized) options. Where the
+    output goes is left out, followers get a copy of it in their own directory."""
+    key = {
+        "source": source_identity(body.songUrlOrFilePath),
+        "modelId": body.modelId,
+        "modelPath": os.path.abspath(body.modelPath),
+        "weightsPath": os.path.abspath(body.weightsPath),
+        "options": normalized_options(body.options),
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def job_directory(body: CreateSongReq, job_id: str) -> str:
+    """Where the job writes its outputs, as the inference manager lays it out."""
+    return os.path.join(body.outputDirectory, job_id)
+
+
+def link_outputs(source: str, target: str):
+    """Give target the files of source, hard linked where the filesystem allows and copied elsewhere."""
+    for root, _, files in os.walk(source):
+        target_root = os.path.join(target, os.path.relpath(root, source))
+        os.makedirs(target_root, exist_ok=True)
+        for name in files:
+            target_path = os.path.join(target_root, name)
+            if os.path.exists(target_path):
+                continue
+            try:
+                os.link(os.path.join(root, name), target_path)
+            except OSError:
+                shutil.copy2(os.path.join(root, name), target_path)
+
+
+def follower_progress(progress: JobProgressResp, job_id: str, source: str, target: str) -> JobProgressResp:
+    """The progress of work running in the source directory, as seen by the job following it from target.
+
+    Outputs of the work are linked into target once it completes, and paths to them point there. Stems and
+    originals stay where the work put them, in its output directory's shared caches.
+    """
+    update = {"jobId": job_id}
+    if progress.status == "completed":
+        try:
+            link_outputs(source, target)
+        except OSError as e:
+            logger.error(f"Unable to copy the outputs of {source} to {target}: {e}")
+            return progress.model_copy(update={**update, "status": "errored", "message": "Error", "error": str(e)})
+    prefix = os.path.join(source, "")
+    for field in OUTPUT_PATH_FIELDS:
+        path = getattr(progress, field)
+        if path is not None and path.startswith(prefix):
+            update[field] = os.path.join(target, path[len(prefix) :])
+    return progress.model_copy(update=update)
+
+
+class JobGroup:
+    def __init__(self, key: str, primary: str):
+        self.key = key
+        # the job id the work actually runs under
+        self.primary = primary
+        # job ids that want the work's progress and result, including the primary unless it was stopped
+        self.subscribers: Set[str] = {primary}
+        # where each job of the group, primary included, wants its outputs
+        self.directories: Dict[str, str] = {}
+
+
+class JobCoalescer:
+    """Attaches duplicate submissions to the in-flight job doing the same work instead of queueing it again.
+
+    Stopping one job of a group only detaches it; the work itself is stopped once nobody is subscribed to it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups_by_key: Dict[str, JobGroup] = {}
+        self._groups_by_job: Dict[str, JobGroup] = {}
+
+    def join(self, key: str, job_id: str, directory: Optional[str] = None) -> Optional[str]:
+        """Subscribe the job to in-flight work with the same key and return that work's job id, or start a new group
+        led by this job and return None. directory is where the job wants its outputs."""
+        with self._lock:
+            group = self._groups_by_key.get(key)
+            primary = None
+            if group is None:
+                group = self._groups_by_key[key] = JobGroup(key, job_id)
+            else:
+                group.subscribers.add(job_id)
+                primary = group.primary
+            self._groups_by_job[job_id] = group
+            if directory is not None:
+                group.directories[job_id] = directory
+            return primary
+
+    def directory(self, job_id: str) -> Optional[str]:
+        with self._lock:
+            group = self._groups_by_job.get(job_id)
+            return group.directories.get(job_id) if group is not None else None
+
+    def subscribers(self, primary: str) -> List[str]:
+        """The job ids that should see progress of the work running as `primary`."""
+        with self._lock:
+            group = self._groups_by_job.get(primary)
+            if group is None or group.primary != primary:
+                return [primary]
+            return list(group.subscribers)
+
+    def leave(self, job_id: str) -> Optional[str]:
+        """Unsubscribe the job. Returns the primary job id if nobody is subscribed to its work anymore."""
+        with self._lock:
+            group = self._groups_by_job.get(job_id)
+            if group is None:
+                return job_id
+            others = group.subscribers - {job_id}
+            if job_id != group.primary:
+                group.subscribers.discard(job_id)
+                del self._groups_by_job[job_id]
+            elif others:
+                group.subscribers.discard(job_id)
+            # a primary stopped last stays subscribed, so it sees its work being stopped
+            if others:
+                return None
+            # the work is about to be stopped, new submissions must not attach to it
+            if self._groups_by_key.get(group.key) is group:
+                del self._groups_by_key[group.key]
+            return group.primary
+
+    def finish(self, primary: str):
+        """Forget the work once it is done, so later submissions run it again."""
+        with self._lock:
+            group = self._groups_by_job.get(primary)
+            if group is None or group.primary != primary:
+                return
+            if self._groups_by_key.get(group.key) is group:
+                del self._groups_by_key[group.key]
+            for job_id in [primary, *group.subscribers]:
+                self._groups_by_job.pop(job_id, None)
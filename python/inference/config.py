@@ -1,30 +1,25 @@
 import logging
 import os
-from typing import Literal
-
-import torch
+import threading
+from typing import List, Literal, Optional
 
 DEVICE = Literal["cpu", "cuda", "xla", "mps"]  # todo add xla
 logger = logging.getLogger(__name__)
 
 
 class Config:
-    device: DEVICE
+    """Runtime settings. Device detection imports torch, so it only happens the first time a device is needed,
+    which keeps torch out of the server process until a job or a device endpoint asks for it."""
 
     def __init__(self):
-        self.ort_providers = []
-        if torch.cuda.is_available():
-            self.device = "cuda"
-            self.ort_providers.append("CUDAExecutionProvider")
-        elif torch.backends.mps.is_available():
-            self.device = "mps"
-            self.ort_providers.append("CoreMLExecutionProvider")
-        else:
-            self.device = "cpu"
-        self.ort_providers.append("CPUExecutionProvider")
-        logger.info("Using device: %s" % self.device)
+        self._lock = threading.Lock()
+        self._detected = False
+        # the device picked by /set_device, if any; otherwise the best one available is detected
+        self.requested_device: Optional[DEVICE] = None
+        self._device: Optional[DEVICE] = None
+        self._ort_providers: List[str] = []
+        self._n_gpu = 0
         self.n_cpu = os.cpu_count()
-        self.n_gpu = torch.cuda.device_count() if torch.cuda.is_available() else 0
         self.gpu_name = None
         self.gpu_mem = None
         self.python_cmd = "python"
@@ -36,6 +31,57 @@ class Config:
         self.x_query = 6
         self.x_center = 38
         self.x_max = 41
+        # segments of the vocals converted in one batch, None for the device's default
+        self.requested_vc_batch_size: Optional[int] = None
+
+    def _detect(self):
+        with self._lock:
+            if self._detected:
+                return
+            import torch
+
+            self._ort_providers = []
+            if torch.cuda.is_available():
+                self._device = "cuda"
+                self._ort_providers.append("CUDAExecutionProvider")
+            elif torch.backends.mps.is_available():
+                self._device = "mps"
+                self._ort_providers.append("CoreMLExecutionProvider")
+            else:
+                self._device = "cpu"
+            self._ort_providers.append("CPUExecutionProvider")
+            logger.info("Using device: %s" % self._device)
+            self._n_gpu = torch.cuda.device_count() if torch.cuda.is_available() else 0
+            self._detected = True
+
+    @property
+    def device(self) -> DEVICE:
+        if self.requested_device is not None:
+            return self.requested_device
+        self._detect()
+        return self._device
+
+    @device.setter
+    def device(self, device: DEVICE):
+        self.requested_device = device
+
+    @property
+    def vc_batch_size(self) -> int:
+        if self.requested_vc_batch_size is not None:
+            return self.requested_vc_batch_size
+        # batches keep the cpu's matrix units busy; on a gpu the activations of a few long segments cost more memory
+        # than the batch saves
+        return 4 if self.device == "cpu" else 1
+
+    @property
+    def ort_providers(self) -> List[str]:
+        self._detect()
+        return self._ort_providers
+
+    @property
+    def n_gpu(self) -> int:
+        self._detect()
+        return self._n_gpu
 
 
 config = Config()
@@ -0,0 +1,96 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from typing import Literal, Optional
+
+logger = logging.getLogger(__name__)
+
+HASH_BLOCK_BYTES = 1 << 20
+
+ALGORITHM = Literal["blake2b", "md5"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT NOT NULL,
+    algorithm TEXT NOT NULL,
+    tail_bytes INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (path, algorithm, tail_bytes)
+);
+"""
+
+
+def new_hash(algorithm: ALGORITHM = "blake2b"):
+    return hashlib.blake2b(digest_size=16) if algorithm == "blake2b" else hashlib.md5()
+
+
+def bytes_digest(data: bytes, algorithm: ALGORITHM = "blake2b") -> str:
+    digest = new_hash(algorithm)
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def stream_digest(path: str, algorithm: ALGORITHM = "blake2b", tail_bytes: int = 0) -> str:
+    """Hash the file in fixed size blocks, never holding more than a block in memory. With tail_bytes, only the end
+    of the file is hashed (all of it if it is shorter)."""
+    digest = new_hash(algorithm)
+    with open(path, "rb") as f:
+        if tail_bytes and os.fstat(f.fileno()).st_size > tail_bytes:
+            f.seek(-tail_bytes, os.SEEK_END)
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileHashes:
+    """Content hashes of files, remembered by (path, size, mtime) so hashing a file again costs a stat call.
+
+    The memo is an SQLite file shared by the server and its worker processes; a file that changed in place gets a
+    new size or mtime and is hashed again.
+    """
+
+    def __init__(self, db_path: str = ":memory:"):
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.configure(db_path)
+
+    def configure(self, db_path: str):
+        with self._lock:
+            if db_path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self.db_path = db_path
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5)
+            if db_path != ":memory:":
+                self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+
+    def digest(self, path: str, algorithm: ALGORITHM = "blake2b", tail_bytes: int = 0) -> str:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        memo_key = (path, algorithm, tail_bytes)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime_ns, digest FROM file_hashes WHERE path = ? AND algorithm = ? AND tail_bytes = ?",
+                memo_key,
+            ).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        digest = stream_digest(path, algorithm, tail_bytes)
+        try:
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO file_hashes (path, algorithm, tail_bytes, size, mtime_ns, digest) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (*memo_key, stat.st_size, stat.st_mtime_ns, digest),
+                )
+        except sqlite3.Error as e:
+            # the hash is still right, it just gets computed again next time
+            logger.error(f"Unable to remember the hash of {path}: {e}")
+        return digest
+
+
+file_hashes = FileHashes()
@@ -1,9 +1,8 @@
 import os
-from threading import Lock
+from contextlib import contextmanager
 
 from inference.config import config
-
-HUBERT_LOCK = Lock()
+from inference.model_pool import model_pool
 
 
 class HubertModel:
@@ -12,19 +11,34 @@ class HubertModel:
     ):
         self.hubert_model = None
 
-    def load_model(self, weights_path: str):
+    def load_model(self, model_path: str):
         from fairseq import checkpoint_utils
 
-        with HUBERT_LOCK:
-            if self.hubert_model is not None:
-                return
-
-            models, _, _ = checkpoint_utils.load_model_ensemble_and_task(
-                [os.path.join(weights_path, "hubert_base.pt")],
-            )
-            model = models[0].to(config.device)
-            self.hubert_model = model.float()
-            self.hubert_model.eval()
+        models, _, _ = checkpoint_utils.load_model_ensemble_and_task(
+            [model_path],
+        )
+        model = models[0].to(config.device)
+        model = model.float()
+        model.eval()
+        return model
+
+    def unload_model(self, model):
+        if self.hubert_model is model:
+            self.hubert_model = None
+
+    @contextmanager
+    def use(self, weights_path: str):
+        """Hold the pooled hubert model for the duration of the block."""
+        model_path = os.path.join(weights_path, "hubert_base.pt")
+        with model_pool.use(
+            "hubert",
+            model_path,
+            lambda: self.load_model(model_path),
+            device=config.device,
+            on_evict=self.unload_model,
+        ) as model:
+            self.hubert_model = model
+            yield model
 
 
 hubert_model = HubertModel()
@@ -1,5 +1,4 @@
 import gc
-import hashlib
 import logging
 import os
 import re
@@ -7,54 +6,79 @@ import shutil
 import threading
 import time
 import traceback
+from contextlib import nullcontext
 from shutil import which
-from typing import Optional
+from typing import Optional, Set
 
 import numpy as np
 import torch
 import yt_dlp
-from pydub import AudioSegment
 from scipy.io import wavfile
 
+from inference import metrics
 from inference.api_models import CreateSongOptions, JobProgressResp, STATUS
+from inference.artifact_store import artifact_key, artifact_stores
+from inference.audio_cache import AudioCache
 from inference.args import parse_args
-from inference.utils import find_pth_and_index_files, load_audio
+from inference.cancel import CancelToken, JobCancelled
+from inference.hashing import file_hashes
+from inference.job_timing import JobTimings
+from inference.model_pool import PoolEntry, model_pool
+from inference.pitch_shift import shifted_file
+from inference.previews import preview_encoder
+from inference.scheduler import JobScheduler
+from inference.utils import ENCODER_OPTIONS, audio_duration, encode_audio, extract_clip, find_pth_and_index_files
 import librosa
 
 logger = logging.getLogger(__name__)
 
+DEECHO_MODEL = "UVR-DeEcho-DeReverb by FoxJoy"
+SAMPLE_SECONDS = 30
+# rate of the stems, and so of the mix and the final track
+MIX_SAMPLE_RATE = 44100
+
 
 class InferenceManager:
     def set_track_values(self, track_on_disk):
         self.source_audio_path = track_on_disk
         self.track_name = os.path.splitext(os.path.basename(self.source_audio_path))[0]
+        os.makedirs(self.originals_directory, exist_ok=True)
         if self.sample_mode_30s:
-            logger.info("Sample mode: Trimming audio to 30s")
+            logger.info(f"Sample mode: Trimming audio to {SAMPLE_SECONDS}s")
             sample_rate = 44100
-            audio_data: np.ndarray = load_audio(self.source_audio_path, sample_rate)
-            start = sample_rate * (self.sample_mode_start_time or 0)
-            end = start + (sample_rate * 30)
-            audio_data = audio_data[start:end]
-            # these md5s dont match, not a huge deal but it means we do a bit of extra work
-            # might be worth looking into in the future
-            self.track_md5 = hashlib.md5(audio_data.tobytes()).hexdigest()
-            sample_file = os.path.join(
-                self.originals_directory,
-                f"sample_{self.track_md5}.wav",
-            )
-            wavfile.write(sample_file, sample_rate, audio_data)
-            self.source_audio_path = sample_file
-
-        self.track_md5 = hashlib.md5(open(self.source_audio_path, "rb").read()).hexdigest()
+            start = self.sample_mode_start_time or 0
+            # keyed by the file and window it is cut from, so sampling the same song again skips decoding it
+            source_hash = file_hashes.digest(self.source_audio_path)
+            sample_key = artifact_key("sample", source_hash, start, SAMPLE_SECONDS)
+            sample_file = self.artifacts.lookup(sample_key)
+            if sample_file is None:
+                sample_file = os.path.join(self.originals_directory, f"{sample_key}.wav")
+                # ffmpeg seeks to the window, rather than us decoding the whole song and slicing it
+                with self.stage("decode"), self.timings.track("decode"), metrics.time_stage("decode"):
+                    extract_clip(
+                        self.source_audio_path, sample_file, start, SAMPLE_SECONDS, sample_rate, self.cancel_token
+                    )
+                self.artifacts.record(sample_key, "sample", sample_file)
+            # the sample is a local copy already
+            self.track_hash = file_hashes.digest(sample_file)
+            self.song_hash = file_hashes.digest(sample_file, "md5")
+            self.source_audio_path = self.originals_file = sample_file
+            return
+
+        self.track_hash = file_hashes.digest(self.source_audio_path)
+        # songs and their originals have always been named by the md5 of the file, existing libraries rely on it
+        self.song_hash = file_hashes.digest(self.source_audio_path, "md5")
         # make a copy of the source file locally to always be able to play it
-        os.makedirs(self.originals_directory, exist_ok=True)
         extension = os.path.splitext(self.source_audio_path)[1]
         self.originals_file = os.path.join(
             self.originals_directory,
-            f"{self.track_md5}{extension}",
+            f"{self.song_hash}{extension}",
         )
-        if not os.path.exists(self.originals_file):
-            shutil.copyfile(self.source_audio_path, self.originals_file)
+        original_key = artifact_key("original", self.track_hash, extension)
+        if self.artifacts.lookup(original_key) is None:
+            if os.path.abspath(self.source_audio_path) != os.path.abspath(self.originals_file):
+                shutil.copyfile(self.source_audio_path, self.originals_file)
+            self.artifacts.record(original_key, "original", self.originals_file)
         self.source_audio_path = self.originals_file
 
     def __init__(
@@ -68,20 +92,35 @@ class InferenceManager:
         job_id: str = None,
         set_status=None,
         check_stop_job=None,
+        scheduler: Optional[JobScheduler] = None,
+        model=None,
     ):
-        self.track_md5: Optional[str] = None
+        # content hash keying cached stems and artifacts
+        self.track_hash: Optional[str] = None
+        # md5 of the song file, what the app groups songs by
+        self.song_hash: Optional[str] = None
         self.track_name: Optional[str] = None
         self.source_audio_path: str = source_audio_path
         self.last_progress_resp: Optional[JobProgressResp] = None
         self.status: STATUS = "processing"
         self.set_status = set_status if set_status else lambda x: logger.info(x)
         self.check_stop_job = check_stop_job if check_stop_job else lambda: False
+        # checked by the separation and conversion loops between chunks, and while ffmpeg runs
+        self.cancel_token = CancelToken(self.check_stop_job)
+        self.scheduler = scheduler
+        from inference.config import config
+
+        self.timings = JobTimings(config.device)
         self.run_thread: Optional[threading.Thread] = None
+        # audio decoded by one stage and read by the next, for the duration of infer()
+        self.audio_cache: Optional[AudioCache] = None
         self.instrumentals_file: Optional[str] = None
         self.vocals_file: Optional[str] = None
         self.pre_deecho_vocals_file: Optional[str] = None
         self.converted_vocals_file = None
-        self.model = None
+        # a model passed in is held by the caller (e.g. a batch); otherwise we borrow one from the pool
+        self.model = model
+        self.model_entry: Optional[PoolEntry] = None
         self.job_id = job_id
         self.originals_file = None
         self.joined_track = None
@@ -112,6 +151,8 @@ class InferenceManager:
         # ensure output dir exists
         os.makedirs(self.output_directory, exist_ok=True)
         self.stems_directory = os.path.join(output_directory, "stems")
+        # stems, originals and youtube downloads are reused across jobs, and collected when over quota
+        self.artifacts = artifact_stores.get(output_directory)
         self.yt_cache = os.path.join(output_directory, "yt-cache")
 
         self.originals_directory = os.path.join(output_directory, "originals")
@@ -126,12 +167,26 @@ class InferenceManager:
         logger.info(f"F0 method: {self.f0_method}")
         logger.info(f"Output path: {self.output_directory}")
 
-        self.elapsed_seconds = None
         self.error: Optional[Exception] = None
-        self.remaining_seconds = None
         self.output_filepath = None
-
-    def find_model(self, models_path: str, model_name: str):
+        # wavs whose preview was encoded along with them, create_preview_tracks leaves them be
+        self.inline_previews: Set[str] = set()
+
+    def stage(self, name: str):
+        """Context manager that holds the scheduler's resource slot for a pipeline stage."""
+        if self.scheduler is None:
+            return nullcontext()
+        # jobs that started earlier go first, and a stopped job gives up its place in line
+        return self.scheduler.stage(name, priority=self.timings.started_at, cancel_token=self.cancel_token)
+
+    def exclusive(self, key: str):
+        """Context manager that keeps other jobs from doing the same work at the same time, in any worker."""
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.exclusive(key, cancel_token=self.cancel_token)
+
+    @staticmethod
+    def find_model(models_path: str, model_name: str):
         from inference.rvc_model import RVCModel
 
         model_dir = os.path.join(models_path, model_name)
@@ -139,8 +194,31 @@ class InferenceManager:
         model = RVCModel(model_name, pth_files, index_files)
         return model
 
+    @staticmethod
+    def acquire_model(models_path: str, model_name: str) -> PoolEntry:
+        """Borrow the voice model from the model pool, loading it if it isn't warm. Release the entry when done."""
+        from inference.config import config
+
+        return model_pool.acquire(
+            "rvc",
+            os.path.join(models_path, model_name),
+            lambda: InferenceManager.find_model(models_path, model_name),
+            device=config.device,
+            on_evict=lambda model: model.clearMemory(),
+        )
+
+    def release_model(self):
+        if self.model_entry is not None:
+            model_pool.release(self.model_entry)
+            self.model_entry = None
+
     def load_model(self):
-        self.model = self.find_model(self.models_path, self.model_name)
+        if self.model is not None:
+            logger.info(f"Using already loaded model {self.model_name}")
+            return
+        with self.stage("rvc"):
+            self.model_entry = self.acquire_model(self.models_path, self.model_name)
+            self.model = self.model_entry.model
         if self.model is None:
             logger.info(f"Unable to load model {self.model_name}")
             runtime_error = RuntimeError(f"Unable to load model {self.model_name}")
@@ -161,43 +239,50 @@ class InferenceManager:
             def update_status(msg):
                 self.check_and_update_status(f"Separating track... {msg}")
 
-            self.vocals_file, self.instrumentals_file = Stemmer.separate_track(
-                self.source_audio_path,
-                self.stems_directory,
-                self.weights_path,
-                self.stemming_model,
-                update_status,
-            )
+            # a job separating the same song with the same model goes first, this one then reuses its stems
+            separation_key = Stemmer.stems_key(self.weights_path, self.stemming_model, self.track_hash)
+            timing = self.timings.track("separation", self.stemming_model)
+            with self.exclusive(separation_key), self.stage("separation"), timing as timed:
+                self.vocals_file, self.instrumentals_file, cached = Stemmer.separate_track(
+                    self.source_audio_path,
+                    self.stems_directory,
+                    self.weights_path,
+                    self.stemming_model,
+                    update_status,
+                    self.cancel_token,
+                    source_identity=self.track_hash,
+                    store=self.artifacts,
+                    audio_cache=self.audio_cache,
+                )
+                # stems left by an earlier job don't tell us anything about throughput
+                timed["cached"] = cached
             elapsed_time = time.time() - start_time
             logger.info(f"UVR: Separation complete. Elapsed time: {elapsed_time}")
             if self.options.deEchoDeReverb:
                 self.check_and_update_status("De-Echoing input file")
-                md5_vocals = hashlib.md5(open(self.vocals_file, "rb").read()).hexdigest()
-                vocal_copies_dir = os.path.join(
-                    self.stems_directory,
-                    "vocals_copies",
-                )
-                # ensure dirs exist
-                os.makedirs(vocal_copies_dir, exist_ok=True)
-                md5_vocals_file = os.path.join(
-                    vocal_copies_dir,
-                    f"{md5_vocals}.wav",
-                )
-                if not os.path.exists(md5_vocals_file):
-                    shutil.copyfile(self.vocals_file, md5_vocals_file)
                 self.pre_deecho_vocals_file = self.vocals_file
 
                 def update_status_deecho(msg):
                     self.check_and_update_status(f"De-echoing track... {msg}")
 
                 self.check_and_update_status("De-Echoing input file")
-                self.vocals_file, echo_and_reverb_file = Stemmer.separate_track(
-                    md5_vocals_file,
-                    self.stems_directory,
-                    self.weights_path,
-                    "UVR-DeEcho-DeReverb by FoxJoy",
-                    update_status_deecho,
-                )
+                # the vocals are identified by the stems key they were made under, no need to hash them
+                deecho_key = Stemmer.stems_key(self.weights_path, DEECHO_MODEL, separation_key)
+                timing = self.timings.track("deecho", DEECHO_MODEL)
+                with self.exclusive(deecho_key), self.stage("separation"), timing as timed:
+                    self.vocals_file, echo_and_reverb_file, cached = Stemmer.separate_track(
+                        self.pre_deecho_vocals_file,
+                        self.stems_directory,
+                        self.weights_path,
+                        DEECHO_MODEL,
+                        update_status_deecho,
+                        self.cancel_token,
+                        metrics_stage="deecho",
+                        source_identity=separation_key,
+                        store=self.artifacts,
+                        audio_cache=self.audio_cache,
+                    )
+                    timed["cached"] = cached
                 # we might want to merge the echo and reverb back into the instrumentals? or run the model on it? idk
                 elapsed_time = time.time() - start_time
                 logger.info(f"De-echo complete. Elapsed time: {elapsed_time}")
@@ -205,111 +290,108 @@ class InferenceManager:
         logger.info("UVR: Track separation complete.")
         logger.info("---------------------------------")
 
-    def pitch_shift(self, audio: AudioSegment, pitch: int):
-        # Check if audio is stereo
-        is_stereo = audio.channels == 2
-
-        # Split stereo to mono if necessary
-        if is_stereo:
-            audio_channels = audio.split_to_mono()
-        else:
-            audio_channels = [audio]
-
-        shifted_channels = []
-
-        for channel in audio_channels:
-            # Convert the audio samples of the channel to a NumPy array
-            samples = np.array(channel.get_array_of_samples())
-            samples_float = samples.astype(np.float32) / np.iinfo(samples.dtype).max
-
-            # Use librosa to perform the pitch shift
-            y_shifted = librosa.effects.pitch_shift(samples_float, sr=audio.frame_rate, n_steps=float(pitch))
-
-            # Convert the floating-point values back to the original data type
-            int_samples = np.array(y_shifted * np.iinfo(samples.dtype).max, dtype=samples.dtype)
-
-            # Create a new AudioSegment object with the modified samples for the channel
-            shifted_channel = AudioSegment(
-                int_samples.tobytes(),
-                frame_rate=audio.frame_rate,
-                sample_width=audio.sample_width,
-                channels=1,
+    def join_track(self, vocals: np.ndarray, sr: int):
+        """Mix the converted vocals over the instrumentals in float32, at the instrumentals' sample rate."""
+        logger.info("Rejoining the track...")
+        if np.issubdtype(vocals.dtype, np.integer):
+            vocals = vocals.astype(np.float32) / -np.iinfo(vocals.dtype).min
+        if sr != MIX_SAMPLE_RATE:
+            vocals = librosa.resample(vocals, orig_sr=sr, target_sr=MIX_SAMPLE_RATE, res_type="kaiser_best")
+        if self.pre_stemmed or self.instrumentals_file is None:
+            if not self.pre_stemmed:
+                logger.info("RVCv2: Unable to find instrumentals file. Writing the vocals alone.")
+            self.joined_track = np.stack([vocals, vocals])
+            return
+        instrumentals_file = self.instrumentals_file
+        if self.instrumentals_pitch:
+            logger.info("RVCv2: Adjusting pitch of instrumentals...")
+            instrumentals_file = shifted_file(
+                self.instrumentals_file,
+                self.instrumentals_pitch,
+                os.path.join(self.stems_directory, "pitch"),
+                self.artifacts,
+                self.audio_cache,
+                MIX_SAMPLE_RATE,
+                cancel_token=self.cancel_token,
             )
-
-            shifted_channels.append(shifted_channel)
-
-        # Merge channels back into stereo or just return mono, as appropriate
-        if is_stereo:
-            shifted_audio = AudioSegment.from_mono_audiosegments(*shifted_channels)
-        else:
-            shifted_audio = shifted_channels[0]
-
-        return shifted_audio
+        instrumental = self.audio_cache.get(instrumentals_file, MIX_SAMPLE_RATE)
+        # like an overlay: the instrumentals set the length, and the vocals are added to both channels
+        mix = self.audio_cache.scratch(instrumental.shape)
+        mix[:] = instrumental
+        overlap = min(mix.shape[1], len(vocals))
+        mix[:, :overlap] += vocals[:overlap]
+        np.clip(mix, -1, 1, out=mix)
+        self.joined_track = mix
+
+    def write_output_track(self, tgt_sr: int, audio_opt: np.ndarray):
+        outputs = os.path.join(self.output_directory, "audio-outputs")
+        converted_vocals_file = f"converted_vocals.wav"
+        vocal_output = os.path.join(outputs, converted_vocals_file)
+        self.converted_vocals_file = vocal_output
+        os.makedirs(outputs, exist_ok=True)
+        logger.info(f"RVCv2: Inference succeeded. Writing to {vocal_output}...")
+        wavfile.write(vocal_output, tgt_sr, audio_opt)
+        metrics.count_bytes_written("outputs", vocal_output)
+        # encoded in the background while we mix, from the samples we already have
+        preview_encoder.submit(vocal_output, audio_opt, tgt_sr)
+        logger.info(f"RVCv2: Finished! Saved output to {vocal_output}")
+        logger.info("---------------------------------")
+        with self.timings.track("mixing"), metrics.time_stage("mixing"):
+            self.join_track(audio_opt, tgt_sr)
+        logger.info("Track rejoined.")
+        logger.info("Writing completed file...")
+        # Check the output format
+        output_format = self.output_format
+        if output_format not in ENCODER_OPTIONS:
+            logger.info("Unsupported output format: {}. Using default (mp3_192k).".format(self.output_format))
+            output_format = "mp3_192k"
+        output_file = "final.wav" if output_format == "wav" else "final.mp3"
+        joined_track_export = os.path.join(self.output_directory, output_file)
+        encodes = {joined_track_export: ENCODER_OPTIONS[output_format]}
+        if output_format == "wav":
+            # the same ffmpeg run writes the preview, instead of create_preview_tracks reading the wav back
+            encodes[os.path.join(self.output_directory, "final_preview.mp3")] = ENCODER_OPTIONS["mp3_192k"]
+        with self.timings.track("encoding", self.output_format), metrics.time_stage("encoding", self.output_format):
+            encode_audio(self.joined_track, MIX_SAMPLE_RATE, encodes, self.cancel_token)
+        metrics.count_bytes_written("outputs", *encodes)
+        if output_format == "wav":
+            self.inline_previews.add(joined_track_export)
+        logger.info(f"Track successfully written to: {joined_track_export}")
+        self.output_filepath = joined_track_export
+        self.joined_track = None
+        logger.info("---------------------------------")
+        logger.info("Inference complete.")
 
     def perform_inference(self):
         try:
             self.check_and_update_status("Starting inference...")
-            tgt_sr, audio_opt = self.model.run_inference(
-                self.vocals_file,
-                self.weights_path,
-                self.check_and_update_status,
-                self.options,
-            )
+            # hubert (with index retrieval), f0, synthesizer and segmentation seconds, filled in by the pipeline
+            times = [0, 0, 0, 0]
+            with self.stage("rvc"), self.timings.track("conversion", self.f0_method):
+                tgt_sr, audio_opt = self.model.run_inference(
+                    self.vocals_file,
+                    self.weights_path,
+                    self.check_and_update_status,
+                    self.options,
+                    self.cancel_token,
+                    times,
+                    self.audio_cache,
+                )
+            for stage, seconds in zip(("hubert", "f0", "synthesizer", "segmentation"), times):
+                self.timings.add(stage, seconds)
             self.check_and_update_status("Creating audio files...")
-            outputs = os.path.join(self.output_directory, "audio-outputs")
-            converted_vocals_file = f"converted_vocals.wav"
-            vocal_output = os.path.join(outputs, converted_vocals_file)
-            self.converted_vocals_file = vocal_output
-            os.makedirs(outputs, exist_ok=True)
-            logger.info(f"RVCv2: Inference succeeded. Writing to {vocal_output}...")
-            wavfile.write(vocal_output, tgt_sr, audio_opt)
-            logger.info(f"RVCv2: Finished! Saved output to {vocal_output}")
-            logger.info("---------------------------------")
-            logger.info("Rejoining the track...")
-            # Load the audio files
-            vocal = AudioSegment.from_wav(vocal_output)
-            if self.pre_stemmed:
-                self.joined_track = vocal
-            elif self.instrumentals_file is not None:
-                instrumental = AudioSegment.from_wav(self.instrumentals_file)
-                if self.instrumentals_pitch:
-                    logger.info("RVCv2: Adjusting pitch of instrumentals...")
-                    instrumental = self.pitch_shift(instrumental, self.instrumentals_pitch)
-                # Combine the audio files
-                self.joined_track = instrumental.overlay(vocal)
-            else:
-                logger.info("RVCv2: Unable to find instrumentals file. Skipping rejoin.")
-
-            logger.info("Track rejoined.")
-            logger.info("Writing completed file...")
-            # Check the output format
-            if self.output_format == "wav":
-                output_file = "final.wav"
-                parameters = {"format": "wav"}
-            elif self.output_format == "mp3_192k":
-                output_file = "final.mp3"
-                parameters = {"format": "mp3", "bitrate": "192k"}
-            elif self.output_format == "mp3_320k":
-                output_file = "final.mp3"
-                parameters = {"format": "mp3", "bitrate": "320k"}
-            else:
-                logger.info("Unsupported output format: {}. Using default (mp3_192k).".format(self.output_format))
-                output_file = "final.mp3"
-                parameters = {"format": "mp3", "bitrate": "192k"}
-            joined_track_export = os.path.join(self.output_directory, output_file)
-            self.joined_track.export(joined_track_export, **parameters)
-            logger.info(f"Track successfully written to: {joined_track_export}")
-            self.output_filepath = joined_track_export
-            logger.info("---------------------------------")
-            logger.info("Inference complete.")
-            # Clear references/memory
-            self.model.clearMemory()
-            del self.model
+            with self.stage("encode"):
+                self.write_output_track(tgt_sr, audio_opt)
+            # Clear references/memory; the model itself stays warm in the pool for the next job
+            self.model = None
+            self.release_model()
             del audio_opt
             if torch.cuda.is_available():
                 torch.cuda.empty_cache()
             gc.collect()
         except Exception as e:
+            if isinstance(e, JobCancelled):
+                self.status = "stopped"
             if self.status == "stopped":
                 self.check_and_update_status(
                     "Stopped",
@@ -334,6 +416,10 @@ class InferenceManager:
         youtube_regex_match = re.match(youtube_regex, url)
         if not youtube_regex_match:
             return False, None
+        download_key = artifact_key("youtube", youtube_regex_match.group(6))
+        cached_path = self.artifacts.lookup(download_key)
+        if cached_path is not None:
+            return True, cached_path
 
         def my_hook(d):
             if d["status"] == "finished":
@@ -372,36 +458,37 @@ class InferenceManager:
             safe_title = safe_title[: 255 - yt_cache_len]
         ydl_opts["outtmpl"] = f"{self.yt_cache}/{safe_title}"
 
-        # Check if file already exists
         output_path = f"{self.yt_cache}/{safe_title}.mp3"
-        if os.path.exists(output_path):
-            return True, output_path
 
         # Now download the video
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             self.check_and_update_status("Downloading audio from YouTube...")
             ydl.download([url])
-            return True, output_path
+        if os.path.exists(output_path):
+            self.artifacts.record(download_key, "youtube", output_path)
+        return True, output_path
 
     def check_and_update_status(self, status_message, status: STATUS = None):
         # Update local status
         self.status = status if status else self.status
         # Check if we should stop
-        if self.check_stop_job() and self.status != "stopped":
+        if self.cancel_token.cancelled and self.status != "stopped":
             self.status = "stopped"
-            raise RuntimeError("Stopped")
+            raise JobCancelled()
         # Print for debugging
         logger.info(f"Status ({self.status}): {status_message}")
         # Otherwise update current status
         error_str = None
         if self.error:
             error_str = str(self.error)
+        remaining = self.timings.remaining_seconds() if self.status == "processing" else None
         progress_resp = JobProgressResp(
             status=self.status,
             message=status_message,
             error=error_str,
-            elapsedSeconds=self.elapsed_seconds,
-            remainingSeconds=self.remaining_seconds,
+            elapsedSeconds=int(self.timings.elapsed_seconds),
+            remainingSeconds=int(remaining) if remaining is not None else None,
+            stageSeconds=dict(self.timings.stage_seconds),
             outputFilepath=self.output_filepath,
             inputFilepath=self.source_audio_path,
             preDeechoVocalsFile=self.pre_deecho_vocals_file,
@@ -410,7 +497,8 @@ class InferenceManager:
             instrumentalsPath=self.instrumentals_file,
             options=self.options,
             modelId=self.model_name,
-            songHash=self.track_md5,
+            songHash=self.song_hash,
+            contentHash=self.track_hash,
             trackName=self.track_name,
         )
         self.set_status(progress_resp)
@@ -425,14 +513,31 @@ class InferenceManager:
             logger.info(f"App path: {os.environ.get('PATH')}")
             raise runtime_error
 
+    def plan_timings(self):
+        """Tell the job's timings how long the track is and which stages are left, so it can estimate an ETA."""
+        self.timings.audio_seconds = audio_duration(self.source_audio_path)
+        stages = []
+        if not self.pre_stemmed:
+            stages.append(("separation", self.stemming_model))
+            if self.options.deEchoDeReverb:
+                stages.append(("deecho", DEECHO_MODEL))
+        if not self.vocals_only:
+            stages += [("conversion", self.f0_method), ("mixing", ""), ("encoding", self.output_format)]
+        self.timings.plan(stages)
+
     def set_source_audio_path(self):
-        is_yt_video, yt_audio_path = self.check_and_download_youtube_audio(self.source_audio_path)
+        start_time = time.time()
+        with self.stage("download"), self.timings.track("download"):
+            is_yt_video, yt_audio_path = self.check_and_download_youtube_audio(self.source_audio_path)
         if is_yt_video:
+            metrics.observe_stage("download", time.time() - start_time)
             if not os.path.exists(yt_audio_path):
                 raise RuntimeError(f"Unable to download YouTube video: {self.source_audio_path}")
             self.set_track_values(yt_audio_path)
 
     def create_preview_tracks(self):
+        """Queue previews of the job's wavs that don't have one yet. They are encoded in the background, so the job
+        doesn't wait for them."""
         files = [
             self.vocals_file,
             self.converted_vocals_file,
@@ -441,29 +546,22 @@ class InferenceManager:
             self.output_filepath,
         ]
         for file in files:
-            try:
-                if not file:
-                    continue
-                if os.path.exists(file) and file.endswith("wav"):
-                    filename, ext = os.path.splitext(file)
-                    preview_file = f"{filename}_preview.mp3"
-                    preview_path = os.path.join(os.path.dirname(file), preview_file)
-                    if os.path.exists(preview_path):
-                        continue
-                    logger.info(f"Creating preview track: {preview_file}")
-                    vocal = AudioSegment.from_wav(file)
-                    vocal.export(preview_path, format="mp3", bitrate="192k")
-            except Exception as e:
-                logger.error(f"Error creating preview track: {e}")
+            if file in self.inline_previews:
+                continue
+            if file and file.endswith("wav") and os.path.exists(file):
+                in_stems = os.path.abspath(file).startswith(os.path.abspath(self.stems_directory))
+                preview_encoder.submit(file, directory="stems" if in_stems else "outputs")
 
     def infer(self):
         start_time = time.time()
+        self.audio_cache = AudioCache(self.cancel_token)
         try:
             self.check_and_update_status("Starting up...", "processing")
             self.check_deps()
             self.check_and_update_status("Dependencies checked")
             self.set_source_audio_path()
             logger.info(f"Source audio path: {self.source_audio_path}")
+            self.plan_timings()
             if self.vocals_only:
                 self.check_and_update_status("Skipping inference due to vocalsOnly option")
                 self.stem_and_load_input_track()
@@ -484,6 +582,8 @@ class InferenceManager:
             logger.info(e)
             traceback.print_exc()
             self.error = e
+            if isinstance(e, JobCancelled):
+                self.status = "stopped"
             if self.status == "stopped":
                 # Runtime Error from stopping. Do nothing.
                 self.check_and_update_status("Stopped", "stopped")
@@ -497,8 +597,13 @@ class InferenceManager:
             logger.error(e)
             traceback.print_exc()
         finally:
+            self.release_model()
+            # a job that failed while mixing still holds the mix, mapped from a file of the cache
+            self.joined_track = None
+            self.audio_cache.close()
             if self.status == "processing":
                 self.check_and_update_status("Completed", "completed")
+            metrics.JOBS_FINISHED.labels(self.status).inc()
             logger.info("Last progress response:")
             logger.info(self.last_progress_resp)
             elapsed_time = time.time() - start_time
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+from inference.api_models import JobProgressResp
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_SECONDS = 15
+
+
+def progress_to_state(progress: JobProgressResp) -> Dict[str, Any]:
+    return progress.model_dump(mode="json")
+
+
+class JobEventSubscription:
+    """Pending changes for one connected client, merged until the client's stream flushes them."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, job_id: Optional[str] = None):
+        self.loop = loop
+        self.job_id = job_id
+        self.event = asyncio.Event()
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    def push(self, job_id: str, changes: Optional[Dict[str, Any]]):
+        if self.job_id is not None and job_id != self.job_id:
+            return
+        with self._lock:
+            if changes is None or job_id not in self._pending or self._pending[job_id] is None:
+                # removals replace whatever is pending, and a job that comes back starts fresh
+                self._pending[job_id] = None if changes is None else dict(changes)
+            else:
+                self._pending[job_id].update(changes)
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    def drain(self) -> Dict[str, Optional[Dict[str, Any]]]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+
+class JobEventBroker:
+    """Publishes only the fields of a job that changed since the last update to every subscriber."""
+
+    def __init__(self, max_updates_per_second: float = 4):
+        self.max_updates_per_second = max_updates_per_second
+        self._lock = threading.Lock()
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._subscriptions: Set[JobEventSubscription] = set()
+
+    def publish(self, job_id: str, progress: JobProgressResp):
+        state = progress_to_state(progress)
+        with self._lock:
+            previous = self._states.get(job_id, {})
+            changes = {key: value for key, value in state.items() if previous.get(key) != value}
+            self._states[job_id] = state
+            subscriptions = list(self._subscriptions)
+        if not changes:
+            return
+        changes["jobId"] = job_id
+        for subscription in subscriptions:
+            subscription.push(job_id, changes)
+
+    def publish_removed(self, job_id: str):
+        with self._lock:
+            self._states.pop(job_id, None)
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.push(job_id, None)
+
+    def snapshot(self, job_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            if job_id is not None:
+                return [dict(self._states[job_id])] if job_id in self._states else []
+            return [dict(state) for state in self._states.values()]
+
+    def subscribe(self, job_id: Optional[str] = None) -> JobEventSubscription:
+        subscription = JobEventSubscription(asyncio.get_running_loop(), job_id)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: JobEventSubscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    async def stream(self, job_id: Optional[str] = None, max_updates_per_second: float = None) -> AsyncIterator[str]:
+        """Server-sent events: a snapshot of the current jobs, then coalesced changes at a bounded rate."""
+        rate = max_updates_per_second or self.max_updates_per_second
+        min_interval = 1 / rate if rate > 0 else 0
+        subscription = self.subscribe(job_id)
+        try:
+            yield format_sse("snapshot", {"jobs": self.snapshot(job_id)})
+            while True:
+                try:
+                    await asyncio.wait_for(subscription.event.wait(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                subscription.event.clear()
+                for changed_job_id, changes in subscription.drain().items():
+                    if changes is None:
+                        yield format_sse("removed", {"jobId": changed_job_id})
+                    else:
+                        yield format_sse("progress", changes)
+                # anything published while we sleep is merged into a single update
+                await asyncio.sleep(min_interval)
+        finally:
+            self.unsubscribe(subscription)
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
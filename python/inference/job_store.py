@@ -0,0 +1,222 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from inference.api_models import CreateSongReq, JobProgressResp, STATUS
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES: Tuple[STATUS, ...] = ("completed", "errored", "stopped")
+# progress ticks arrive many times a second; the live copy is always current, the row catches up at this rate
+PERSIST_INTERVAL_SECONDS = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    request TEXT,
+    progress TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL,
+    batch_id TEXT
+);
+"""
+# after the migrations, indexes may cover columns that older databases only just got
+INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+CREATE INDEX IF NOT EXISTS jobs_batch_id ON jobs (batch_id);
+"""
+
+
+class JobStore:
+    """Thread-safe, SQLite-backed map of job id to the job's latest progress.
+
+    Written from the job executor threads and read/cleared from the event loop. Queued and running jobs are
+    also kept in memory so progress reads never wait on the database.
+    """
+
+    def __init__(self, db_path: str = ":memory:", retention_seconds: float = 24 * 60 * 60):
+        self.db_path = db_path
+        self.retention_seconds = retention_seconds
+        self._lock = threading.RLock()
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "batch_id" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN batch_id TEXT")
+        self._db.executescript(INDEXES)
+        self._live: Dict[str, JobProgressResp] = {}
+        self._last_persisted: Dict[str, float] = {}
+        self._on_set: List[Callable[[str, JobProgressResp], None]] = []
+        self._on_remove: List[Callable[[str], None]] = []
+
+    def add_listener(self, on_set: Callable[[str, JobProgressResp], None], on_remove: Callable[[str], None]):
+        """Listeners are called under the store's lock so they observe updates in order."""
+        with self._lock:
+            self._on_set.append(on_set)
+            self._on_remove.append(on_remove)
+
+    def __contains__(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._live or self._has_row(job_id)
+
+    def get(self, job_id: str) -> Optional[JobProgressResp]:
+        with self._lock:
+            if job_id in self._live:
+                return self._live[job_id]
+            row = self._db.execute("SELECT progress FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return JobProgressResp.model_validate_json(row[0]) if row else None
+
+    def add(self, job_id: str, request: CreateSongReq, progress: JobProgressResp, batch_id: Optional[str] = None):
+        """Record a newly submitted job along with the request needed to run it again after a restart, and the batch
+        it is part of, if any."""
+        now = time.time()
+        with self._lock:
+            progress.jobId = job_id
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, status, request, progress, created_at, updated_at, batch_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, progress.status, request.model_dump_json(), progress.model_dump_json(), now, now, batch_id),
+            )
+            self._live[job_id] = progress
+            self._last_persisted[job_id] = now
+            for on_set in self._on_set:
+                on_set(job_id, progress)
+
+    def set(self, job_id: str, progress: JobProgressResp):
+        """Update the progress of a job recorded with add. Jobs never added, or removed since, are left alone."""
+        now = time.time()
+        with self._lock:
+            previous = self._live.get(job_id)
+            if previous is None and not self._has_row(job_id):
+                return
+            progress.jobId = job_id
+            finished = progress.status in FINISHED_STATUSES
+            if finished:
+                self._live.pop(job_id, None)
+                self._last_persisted.pop(job_id, None)
+            else:
+                self._live[job_id] = progress
+            status_changed = previous is None or previous.status != progress.status
+            if finished or status_changed or now - self._last_persisted.get(job_id, 0) >= PERSIST_INTERVAL_SECONDS:
+                self._persist(job_id, progress, now, now if finished else None)
+            for on_set in self._on_set:
+                on_set(job_id, progress)
+
+    def _persist(self, job_id: str, progress: JobProgressResp, now: float, finished_at: Optional[float]):
+        # rows are only created by add, a job removed in the meantime stays removed
+        self._db.execute(
+            "UPDATE jobs SET status = ?, progress = ?, updated_at = ?, finished_at = ? WHERE job_id = ?",
+            (progress.status, progress.model_dump_json(), now, finished_at, job_id),
+        )
+        if finished_at is None:
+            self._last_persisted[job_id] = now
+
+    def _has_row(self, job_id: str) -> bool:
+        return self._db.execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone() is not None
+
+    def remove(self, job_id: str):
+        with self._lock:
+            self._live.pop(job_id, None)
+            self._last_persisted.pop(job_id, None)
+            if not self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,)).rowcount:
+                return
+            for on_remove in self._on_remove:
+                on_remove(job_id)
+
+    def list(
+        self, statuses: Optional[Sequence[str]] = None, offset: int = 0, limit: Optional[int] = None
+    ) -> List[JobProgressResp]:
+        """Jobs in submission order, optionally filtered by status and paginated."""
+        where, params = self._status_filter(statuses)
+        params += [limit if limit is not None else -1, offset]
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT job_id, progress FROM jobs {where} ORDER BY created_at, rowid LIMIT ? OFFSET ?", params
+            ).fetchall()
+            live = dict(self._live)
+        return [live[job_id] if job_id in live else JobProgressResp.model_validate_json(data) for job_id, data in rows]
+
+    def batch(self, batch_id: str) -> List[JobProgressResp]:
+        """The jobs of a batch still in the store, in submission order. Batches go away with their jobs."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT job_id, progress FROM jobs WHERE batch_id = ? ORDER BY created_at, rowid", (batch_id,)
+            ).fetchall()
+            live = dict(self._live)
+        return [live[job_id] if job_id in live else JobProgressResp.model_validate_json(data) for job_id, data in rows]
+
+    def count(self, statuses: Optional[Sequence[str]] = None) -> int:
+        where, params = self._status_filter(statuses)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM jobs {where}", params).fetchone()[0]
+
+    @staticmethod
+    def _status_filter(statuses: Optional[Sequence[str]]):
+        if not statuses:
+            return "", []
+        return f"WHERE status IN ({', '.join('?' for _ in statuses)})", list(statuses)
+
+    def evict_finished(self) -> int:
+        """Delete finished jobs older than the retention window."""
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            job_ids = [
+                row[0]
+                for row in self._db.execute(
+                    "SELECT job_id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,)
+                ).fetchall()
+            ]
+            for job_id in job_ids:
+                self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+                for on_remove in self._on_remove:
+                    on_remove(job_id)
+        if job_ids:
+            logger.info(f"Evicted {len(job_ids)} finished jobs")
+        return len(job_ids)
+
+    def take_interrupted(self) -> List[Tuple[str, CreateSongReq]]:
+        """Jobs that were queued or running when the last server process died, reset to queued."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT job_id, request, progress FROM jobs WHERE status IN ('queued', 'processing') "
+                "AND request IS NOT NULL ORDER BY created_at, rowid"
+            ).fetchall()
+            interrupted = []
+            for job_id, request, data in rows:
+                progress = JobProgressResp.model_validate_json(data)
+                progress.status = "queued"
+                progress.message = "Waiting to start..."
+                self._live[job_id] = progress
+                self._persist(job_id, progress, time.time(), None)
+                interrupted.append((job_id, CreateSongReq.model_validate_json(request)))
+        return interrupted
+
+
+class StopRequests:
+    """Thread-safe set of job ids that have been asked to stop."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._job_ids: Set[str] = set()
+
+    def __contains__(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._job_ids
+
+    def add(self, job_id: str):
+        with self._lock:
+            self._job_ids.add(job_id)
+
+    def discard(self, job_id: str):
+        with self._lock:
+            self._job_ids.discard(job_id)
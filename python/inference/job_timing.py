@@ -0,0 +1,141 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# weight of the newest run in a stage's throughput, so estimates follow hardware and model changes
+RATE_SMOOTHING = 0.3
+# runs faster than this are cache hits or empty input and say nothing about throughput
+MIN_MEASURED_SECONDS = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stage_throughput (
+    stage TEXT NOT NULL,
+    model TEXT NOT NULL,
+    device TEXT NOT NULL,
+    rate REAL NOT NULL,
+    runs INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (stage, model, device)
+);
+"""
+
+PlannedStage = Tuple[str, str]  # stage, model
+
+
+class ThroughputHistory:
+    """Audio seconds processed per wall-clock second for each (stage, model, device), persisted across runs.
+
+    The server and its worker processes share the database file, so every job's measurements feed later ETAs.
+    """
+
+    def __init__(self, db_path: str = ":memory:"):
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.configure(db_path)
+
+    def configure(self, db_path: str):
+        with self._lock:
+            if db_path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self.db_path = db_path
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5)
+            if db_path != ":memory:":
+                self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+
+    def rates(self, device: str) -> Dict[PlannedStage, float]:
+        with self._lock:
+            rows = self._db.execute("SELECT stage, model, rate FROM stage_throughput WHERE device = ?", (device,))
+            return {(stage, model): rate for stage, model, rate in rows.fetchall()}
+
+    def record(self, stage: str, model: str, device: str, audio_seconds: float, wall_seconds: float):
+        if wall_seconds < MIN_MEASURED_SECONDS or audio_seconds <= 0:
+            return
+        rate = audio_seconds / wall_seconds
+        try:
+            with self._lock:
+                self._db.execute(
+                    "INSERT INTO stage_throughput (stage, model, device, rate, runs, updated_at) "
+                    "VALUES (?, ?, ?, ?, 1, ?) "
+                    "ON CONFLICT (stage, model, device) DO UPDATE SET "
+                    "rate = rate * ? + excluded.rate * ?, runs = runs + 1, updated_at = excluded.updated_at",
+                    (stage, model, device, rate, time.time(), 1 - RATE_SMOOTHING, RATE_SMOOTHING),
+                )
+        except sqlite3.Error as e:
+            # an estimate is not worth failing a job over
+            logger.error(f"Unable to record {stage} throughput: {e}")
+
+
+throughput_history = ThroughputHistory()
+
+
+class JobTimings:
+    """Wall-clock seconds a job spends in each stage, and the time it has left based on past throughput."""
+
+    def __init__(self, device: str, history: ThroughputHistory = throughput_history):
+        self.device = device
+        self.history = history
+        self.started_at = time.time()
+        self.stage_seconds: Dict[str, float] = {}
+        self.audio_seconds: Optional[float] = None
+        self._planned: List[PlannedStage] = []
+        self._rates: Dict[PlannedStage, float] = {}
+        self._current: Optional[PlannedStage] = None
+        self._current_started_at: Optional[float] = None
+
+    def plan(self, stages: List[PlannedStage]):
+        """The stages still to run, in order. Rates are read once here, not on every progress update."""
+        self._planned = list(stages)
+        self._rates = self.history.rates(self.device)
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return time.time() - self.started_at
+
+    @contextmanager
+    def track(self, stage: str, model: str = ""):
+        """Time a stage. Yields a dict; set "cached" in it when the stage reused earlier output."""
+        self._current = (stage, model)
+        self._current_started_at = start = time.time()
+        result = {"cached": False}
+        try:
+            yield result
+        finally:
+            elapsed = time.time() - start
+            self.add(stage, elapsed)
+            self._current = self._current_started_at = None
+            if (stage, model) in self._planned:
+                self._planned.remove((stage, model))
+        if not result["cached"] and self.audio_seconds:
+            self.history.record(stage, model, self.device, self.audio_seconds, elapsed)
+
+    def add(self, stage: str, seconds: float):
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0) + seconds
+
+    def rate(self, stage: str, model: str) -> Optional[float]:
+        if (stage, model) in self._rates:
+            return self._rates[(stage, model)]
+        # a model we have not timed yet: go by the other models of the stage
+        others = [rate for (s, _), rate in self._rates.items() if s == stage]
+        return sum(others) / len(others) if others else None
+
+    def remaining_seconds(self) -> Optional[float]:
+        """None until the audio length is known and every remaining stage has been timed on this device."""
+        if not self.audio_seconds:
+            return None
+        remaining = 0.0
+        for stage, model in self._planned:
+            rate = self.rate(stage, model)
+            if not rate:
+                return None
+            expected = self.audio_seconds / rate
+            if (stage, model) == self._current:
+                expected = max(0.0, expected - (time.time() - self._current_started_at))
+            remaining += expected
+        return remaining
@@ -0,0 +1,233 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition format, without pulling prometheus_client into the bundled server.
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+LabelValues = Tuple[str, ...]
+# (metric name, label values, value) as sent from a worker process to the server
+Observation = Tuple[str, LabelValues, float]
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def labels(self, *values: str) -> "BoundMetric":
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        return BoundMetric(self, tuple(str(value) for value in values))
+
+    def record(self, values: LabelValues, amount: float):
+        """Apply an update locally, or hand it to the registry's forwarder when running in a worker process."""
+        if self.registry.forward is not None:
+            self.registry.forward((self.name, values, amount))
+        else:
+            self.apply(values, amount)
+
+    def apply(self, values: LabelValues, amount: float):
+        raise NotImplementedError
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines += self.samples()
+        return "\n".join(lines)
+
+
+class BoundMetric:
+    def __init__(self, metric: Metric, values: LabelValues):
+        self.metric = metric
+        self.values = values
+
+    def inc(self, amount: float = 1):
+        self.metric.record(self.values, amount)
+
+    def dec(self, amount: float = 1):
+        self.metric.record(self.values, -amount)
+
+    def observe(self, amount: float):
+        self.metric.record(self.values, amount)
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def apply(self, values: LabelValues, amount: float):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+            for labels, value in sorted(values.items())
+        ]
+
+
+class Gauge(Metric):
+    """A value that goes up and down, either tracked with inc/dec or read from a function when scraped."""
+
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set_function(self, function: Callable[[], float], *values: str):
+        with self._lock:
+            self._functions[tuple(values)] = function
+
+    def apply(self, values: LabelValues, amount: float):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for labels, function in functions.items():
+            values[labels] = function()
+        return [
+            f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+            for labels, value in sorted(values.items())
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # per label set: bucket counts, then sum
+        self._values: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def apply(self, values: LabelValues, amount: float):
+        with self._lock:
+            counts, total = self._values.get(values, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    counts[i] += 1
+            self._values[values] = (counts, total + amount)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self._values.items()}
+        lines = []
+        for labels, (counts, total) in sorted(values.items()):
+            for bound, count in zip(self.buckets, counts):
+                le = format_labels(self.labelnames, labels, f'le="{format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        # set in worker processes to send updates to the server, which owns the real values
+        self.forward: Optional[Callable[[Observation], None]] = None
+
+    def register(self, metric: Metric):
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def apply(self, observation: Observation):
+        name, values, amount = observation
+        metric = self._metrics.get(name)
+        if metric is not None:
+            metric.apply(tuple(values), amount)
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = MetricsRegistry()
+
+QUEUE_LENGTH = Gauge(registry, "replay_queue_length", "Jobs waiting to start")
+ACTIVE_JOBS = Gauge(registry, "replay_active_jobs", "Jobs currently running")
+ACTIVE_STAGES = Gauge(registry, "replay_active_stages", "Jobs currently inside each pipeline stage", ["stage"])
+STAGE_SECONDS = Histogram(
+    registry,
+    "replay_stage_duration_seconds",
+    "Wall-clock time spent in each pipeline stage",
+    ["stage", "model"],
+)
+MODEL_POOL_REQUESTS = Counter(
+    registry, "replay_model_pool_requests_total", "Model pool lookups by result (hit or miss)", ["kind", "result"]
+)
+MODEL_POOL_EVICTIONS = Counter(registry, "replay_model_pool_evictions_total", "Models evicted from the pool", ["kind"])
+MODEL_LOAD_SECONDS = Histogram(
+    registry, "replay_model_load_duration_seconds", "Time spent loading models on a pool miss", ["kind"]
+)
+BYTES_WRITTEN = Counter(
+    registry, "replay_bytes_written_total", "Bytes of audio written, by directory (stems or outputs)", ["directory"]
+)
+JOBS_FINISHED = Counter(registry, "replay_jobs_finished_total", "Jobs that finished, by final status", ["status"])
+
+
+def time_stage(stage: str, model: str = ""):
+    """Context manager recording how long the block took as one observation of the stage."""
+    return STAGE_SECONDS.labels(stage, model or "").time()
+
+
+def observe_stage(stage: str, seconds: float, model: str = ""):
+    STAGE_SECONDS.labels(stage, model or "").observe(seconds)
+
+
+def count_bytes_written(directory: str, *paths: Optional[str]):
+    """Add the size of the given files to the bytes written to a directory."""
+    total = sum(os.path.getsize(path) for path in paths if path and os.path.isfile(path))
+    if total:
+        BYTES_WRITTEN.labels(directory).inc(total)
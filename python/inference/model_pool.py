@@ -0,0 +1,216 @@
+import gc
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from inference import metrics
+
+logger = logging.getLogger(__name__)
+
+PoolKey = Tuple[str, str, str, str]  # kind, path, device, precision
+
+
+class PoolEntry:
+    def __init__(self, key: PoolKey, model: Any, size_bytes: int, on_evict: Optional[Callable[[Any], None]]):
+        self.key = key
+        self.model = model
+        self.size_bytes = size_bytes
+        self.on_evict = on_evict
+        self.users = 0
+        self.last_used = time.time()
+
+    @property
+    def device(self) -> str:
+        return self.key[2]
+
+
+def estimate_size(model: Any, path: Optional[str] = None) -> int:
+    """Resident bytes of a torch module's parameters and buffers, else the size of the file it came from."""
+    if hasattr(model, "resident_bytes"):
+        return model.resident_bytes()
+    import torch
+
+    if isinstance(model, torch.nn.Module):
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    if path and os.path.isfile(path):
+        return os.path.getsize(path)
+    return 0
+
+
+class ModelPool:
+    """Keeps loaded models warm between jobs, evicting least recently used ones past a memory budget.
+
+    Models are keyed by (kind, path, device, precision). Models in use are pinned and never evicted; cuda models
+    count against the vram budget, everything else (cpu, mps) against the ram budget.
+    """
+
+    def __init__(self, ram_budget_bytes: int = 4 << 30, vram_budget_bytes: int = 0):
+        self.ram_budget_bytes = ram_budget_bytes
+        self.vram_budget_bytes = vram_budget_bytes
+        # fraction of the budgets this process may use, when several worker processes each keep their own pool
+        self.budget_share = 1.0
+        self._lock = threading.RLock()
+        self._entries: "OrderedDict[PoolKey, PoolEntry]" = OrderedDict()
+        self._load_locks: Dict[PoolKey, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(
+        self,
+        ram_budget_bytes: Optional[int] = None,
+        vram_budget_bytes: Optional[int] = None,
+        budget_share: Optional[float] = None,
+    ):
+        with self._lock:
+            if budget_share is not None:
+                self.budget_share = budget_share
+            if ram_budget_bytes is not None:
+                self.ram_budget_bytes = ram_budget_bytes
+            if vram_budget_bytes is not None:
+                self.vram_budget_bytes = vram_budget_bytes
+            self._evict_over_budget()
+
+    def budget_for(self, device: str) -> int:
+        if not device.startswith("cuda"):
+            return int(self.ram_budget_bytes * self.budget_share)
+        if self.vram_budget_bytes > 0:
+            return int(self.vram_budget_bytes * self.budget_share)
+        import torch
+
+        # default to most of the card, leaving room for activations
+        return int(torch.cuda.get_device_properties(0).total_memory * 0.6 * self.budget_share)
+
+    @contextmanager
+    def use(
+        self,
+        kind: str,
+        path: str,
+        loader: Callable[[], Any],
+        device: str = "cpu",
+        precision: str = "float32",
+        size_bytes: Optional[int] = None,
+        on_evict: Optional[Callable[[Any], None]] = None,
+    ):
+        """Yield the pooled model for the key, loading it on a miss. The model is pinned inside the block."""
+        entry = self.acquire(kind, path, loader, device, precision, size_bytes, on_evict)
+        try:
+            yield entry.model
+        finally:
+            self.release(entry)
+
+    def acquire(
+        self,
+        kind: str,
+        path: str,
+        loader: Callable[[], Any],
+        device: str = "cpu",
+        precision: str = "float32",
+        size_bytes: Optional[int] = None,
+        on_evict: Optional[Callable[[Any], None]] = None,
+    ) -> PoolEntry:
+        key: PoolKey = (kind, os.path.abspath(path), device, precision)
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        # only one thread loads a given model; others wait and then hit
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    metrics.MODEL_POOL_REQUESTS.labels(kind, "hit").inc()
+                    self._entries.move_to_end(key)
+                    entry.users += 1
+                    entry.last_used = time.time()
+                    return entry
+                self.misses += 1
+                metrics.MODEL_POOL_REQUESTS.labels(kind, "miss").inc()
+            logger.info(f"Model pool: loading {kind} {path} on {device}")
+            start = time.time()
+            model = loader()
+            size = size_bytes if size_bytes is not None else estimate_size(model, path)
+            elapsed = time.time() - start
+            metrics.MODEL_LOAD_SECONDS.labels(kind).observe(elapsed)
+            logger.info(f"Model pool: loaded {kind} ({size / 2**20:.0f}MB) in {elapsed:.2f}s")
+            with self._lock:
+                entry = PoolEntry(key, model, size, on_evict)
+                entry.users = 1
+                self._entries[key] = entry
+                self._evict_over_budget()
+            return entry
+
+    def release(self, entry: PoolEntry):
+        with self._lock:
+            entry.users -= 1
+            entry.last_used = time.time()
+            self._evict_over_budget()
+
+    def resident_bytes(self, device: str) -> int:
+        with self._lock:
+            return sum(e.size_bytes for e in self._entries.values() if self._same_budget(e.device, device))
+
+    @staticmethod
+    def _same_budget(a: str, b: str) -> bool:
+        return a.startswith("cuda") == b.startswith("cuda")
+
+    def _evict_over_budget(self):
+        evicted = False
+        for device in {entry.device for entry in self._entries.values()}:
+            budget = self.budget_for(device)
+            # oldest first; pinned models stay even if that means running over budget
+            for key, entry in list(self._entries.items()):
+                if self.resident_bytes(device) <= budget:
+                    break
+                if entry.users > 0 or not self._same_budget(entry.device, device):
+                    continue
+                self._evict(key)
+                evicted = True
+        if evicted:
+            free_device_memory()
+
+    def _evict(self, key: PoolKey):
+        entry = self._entries.pop(key)
+        self.evictions += 1
+        metrics.MODEL_POOL_EVICTIONS.labels(key[0]).inc()
+        logger.info(f"Model pool: evicting {key[0]} {key[1]} ({entry.size_bytes / 2**20:.0f}MB)")
+        if entry.on_evict:
+            try:
+                entry.on_evict(entry.model)
+            except Exception as e:
+                logger.error(f"Model pool: error evicting {key[0]}: {e}")
+        entry.model = None
+
+    def clear(self):
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.users == 0:
+                    self._evict(key)
+        free_device_memory()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "models": [
+                    {"kind": k[0], "path": k[1], "device": k[2], "sizeBytes": e.size_bytes, "users": e.users}
+                    for k, e in self._entries.items()
+                ],
+            }
+
+
+def free_device_memory():
+    import torch
+
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+model_pool = ModelPool()
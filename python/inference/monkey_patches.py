@@ -5,14 +5,13 @@ import ssl
 import subprocess as sp
 import sys
 
-from server_args import get_server_arg_parser
+from server_args import get_server_args
 
 logger = logging.getLogger()
 
 
 def init_logging():
-    parser = get_server_arg_parser()
-    args = parser.parse_args()
+    args = get_server_args()
 
     logger.setLevel(logging.INFO)
     formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
@@ -0,0 +1,79 @@
+import logging
+import os
+from typing import Literal, Optional
+
+import numpy as np
+from scipy.io import wavfile
+
+from inference.artifact_store import ArtifactStore, artifact_key
+from inference.audio_cache import DECODE_SAMPLE_RATE, AudioCache
+from inference.cancel import CancelToken
+from inference.hashing import file_hashes
+
+logger = logging.getLogger(__name__)
+
+PITCH_BACKEND = Literal["auto", "rubberband", "librosa"]
+
+# rubberband when its cli is bundled or installed: faster than librosa's phase vocoder, with fewer artifacts
+DEFAULT_BACKEND: PITCH_BACKEND = "auto"
+
+
+def resolve_backend(backend: PITCH_BACKEND = DEFAULT_BACKEND) -> PITCH_BACKEND:
+    if backend != "auto":
+        return backend
+    from inference.uvr.lib_v5 import pyrb
+
+    return "rubberband" if pyrb.available() else "librosa"
+
+
+def pitch_shift(
+    audio: np.ndarray,
+    sr: int,
+    semitones: float,
+    backend: PITCH_BACKEND = DEFAULT_BACKEND,
+    cancel_token: Optional[CancelToken] = None,
+) -> np.ndarray:
+    """Shift (channels, samples) float audio by semitones, all channels in one call."""
+    if not semitones:
+        return audio
+    audio = np.asarray(audio, dtype=np.float32)
+    if resolve_backend(backend) == "rubberband":
+        from inference.uvr.lib_v5 import pyrb
+
+        # rubberband takes (samples, channels), like soundfile
+        shifted = pyrb.pitch_shift(audio.T, sr, semitones, cancel_token=cancel_token).T
+    else:
+        import librosa
+
+        shifted = librosa.effects.pitch_shift(audio, sr=sr, n_steps=float(semitones))
+    return np.ascontiguousarray(shifted, dtype=np.float32)
+
+
+def shifted_file(
+    path: str,
+    semitones: float,
+    directory: str,
+    store: ArtifactStore,
+    audio_cache: AudioCache,
+    sr: int,
+    backend: PITCH_BACKEND = DEFAULT_BACKEND,
+    cancel_token: Optional[CancelToken] = None,
+) -> str:
+    """Path of a wav of the audio at path shifted by semitones, made by an earlier job if one shifted the same audio
+    by the same amount."""
+    backend = resolve_backend(backend)
+    key = artifact_key("pitch", file_hashes.digest(path), semitones, backend)
+    cached = store.lookup(key)
+    if cached is not None:
+        logger.info(f"Using pitch shifted audio {cached}")
+        return cached
+    shifted = pitch_shift(audio_cache.get(path, sr), sr, semitones, backend, cancel_token)
+    os.makedirs(directory, exist_ok=True)
+    output_path = os.path.join(directory, f"{key}.wav")
+    partial_path = f"{output_path}.partial"
+    wavfile.write(partial_path, sr, shifted.T)
+    os.replace(partial_path, output_path)
+    if sr == DECODE_SAMPLE_RATE:
+        audio_cache.put(output_path, shifted)
+    store.record(key, "pitch", output_path)
+    return output_path
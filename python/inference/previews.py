@@ -0,0 +1,105 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from inference import metrics
+from inference.hashing import file_hashes
+from inference.scheduler import default_cpu_slots
+from inference.utils import ENCODER_OPTIONS, encode_audio, transcode
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_OPTIONS = ENCODER_OPTIONS["mp3_192k"]
+
+
+def preview_path(audio_path: str) -> str:
+    return f"{os.path.splitext(audio_path)[0]}_preview.mp3"
+
+
+def source_hash_path(preview: str) -> str:
+    """The sidecar holding the content hash of the wav a preview was encoded from."""
+    return f"{preview}.source"
+
+
+def is_up_to_date(preview: str, audio_path: str) -> bool:
+    """Whether the preview was encoded from a wav with the content of the one at audio_path. Mtimes can't tell, a
+    wav rewritten with other audio may keep an older one and copies get new ones."""
+    try:
+        with open(source_hash_path(preview)) as f:
+            source_hash = f.read().strip()
+        return os.path.exists(preview) and source_hash == file_hashes.digest(audio_path)
+    except OSError:
+        return False
+
+
+class PreviewEncoder:
+    """Encodes the mp3 previews of a job's wavs in the background, a few at a time, so the job is done as soon as its
+    main output is written.
+
+    Stages hand over the samples they already have in memory; wavs without them are transcoded by ffmpeg directly.
+    A preview that is up to date, or already being encoded for another job, is not encoded again.
+    """
+
+    def __init__(self, max_workers: int = 0):
+        self.executor = ThreadPoolExecutor(max_workers or default_cpu_slots(), thread_name_prefix="replay-preview")
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+
+    def submit(
+        self,
+        audio_path: str,
+        audio: Optional[np.ndarray] = None,
+        sr: Optional[int] = None,
+        directory: str = "outputs",
+        on_done: Optional[Callable[[], None]] = None,
+    ) -> Optional[Future]:
+        """Queue the preview of the wav at audio_path, from audio (at sr) if given. directory labels the bytes written
+        in the metrics. Returns None if the preview is up to date."""
+        preview = preview_path(audio_path)
+        with self._lock:
+            if preview in self._pending:
+                return self._pending[preview]
+        # hashing the wav may read all of it, so not while holding up other submits
+        if is_up_to_date(preview, audio_path):
+            return None
+        with self._lock:
+            if preview in self._pending:
+                return self._pending[preview]
+            future = self.executor.submit(self._encode, audio_path, preview, audio, sr, directory, on_done)
+            self._pending[preview] = future
+        return future
+
+    def _encode(self, audio_path, preview, audio, sr, directory, on_done):
+        partial = f"{preview}.partial"
+        source_partial = f"{source_hash_path(preview)}.partial"
+        try:
+            logger.info(f"Creating preview track: {preview}")
+            source_hash = file_hashes.digest(audio_path)
+            with metrics.time_stage("encoding", "preview"):
+                if audio is not None:
+                    encode_audio(audio, sr, {partial: PREVIEW_OPTIONS})
+                else:
+                    transcode(audio_path, {partial: PREVIEW_OPTIONS})
+            # the player never sees a half written preview
+            os.replace(partial, preview)
+            with open(source_partial, "w") as f:
+                f.write(source_hash)
+            os.replace(source_partial, source_hash_path(preview))
+            metrics.count_bytes_written(directory, preview)
+            if on_done is not None:
+                on_done()
+        except Exception as e:
+            logger.error(f"Error creating preview track: {e}")
+            for path in (partial, source_partial):
+                if os.path.exists(path):
+                    os.remove(path)
+        finally:
+            with self._lock:
+                self._pending.pop(preview, None)
+
+
+preview_encoder = PreviewEncoder()
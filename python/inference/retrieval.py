@@ -0,0 +1,167 @@
+import logging
+import os
+import threading
+from typing import Literal, Optional, Tuple
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_BACKEND = Literal["auto", "ivf", "hnsw", "exact"]
+
+DEFAULT_BACKEND: INDEX_BACKEND = "auto"
+
+# neighbours blended per frame
+SEARCH_K = 8
+# faiss' own default, what conversion always used
+DEFAULT_NPROBE = 1
+# auto searches indexes up to this size exhaustively, it costs less than a probe of a bigger one
+EXACT_MAX_VECTORS = 4096
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+# frames per matmul or gather, bounds the (frames, vectors) distances and (frames, k, dims) neighbours in memory
+CHUNK_FRAMES = 2048
+# vectors per matmul of exact search, so its distances stay at 64MB however big the index
+CHUNK_VECTORS = 8192
+
+
+def hnsw_path(file_index: str) -> str:
+    """The sidecar the hnsw graph built over the vectors of the index is saved in."""
+    return f"{file_index}.hnsw"
+
+
+def nearest_columns(distances: np.ndarray, k: int) -> np.ndarray:
+    """Columns of the (up to) k smallest distances of each row, in no particular order."""
+    if distances.shape[1] <= k:
+        return np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+    return np.argpartition(distances, k - 1, axis=1)[:, :k]
+
+
+class FeatureRetriever:
+    """Nearest neighbours of hubert features among the vectors of a model's index, with a choice of search:
+
+    - ivf: the model's own index, probing nprobe of its lists
+    - hnsw: a graph built over the vectors on first use and saved next to the index
+    - exact: brute force distances by matrix multiplication, for small indexes and as the reference for the others
+
+    A retriever belongs to a loaded model and is shared by the jobs using it; searches don't change its state.
+    """
+
+    def __init__(self, index, big_npy: np.ndarray, file_index: Optional[str] = None):
+        self.index = index
+        self.big_npy = big_npy
+        self.file_index = file_index
+        self._lock = threading.Lock()
+        self._hnsw = None
+        self._norms: Optional[np.ndarray] = None
+        try:
+            faiss.extract_index_ivf(index)
+            self._is_ivf = True
+        except RuntimeError:
+            self._is_ivf = False
+
+    def resolve_backend(self, backend: INDEX_BACKEND = DEFAULT_BACKEND) -> INDEX_BACKEND:
+        if backend != "auto":
+            return backend
+        return "exact" if self.big_npy.shape[0] <= EXACT_MAX_VECTORS else "ivf"
+
+    def search(
+        self, npy: np.ndarray, k: int = SEARCH_K, backend: INDEX_BACKEND = DEFAULT_BACKEND, nprobe: int = DEFAULT_NPROBE
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Squared l2 distances and ids of the k nearest vectors of each row of npy, like faiss: id -1 where fewer
+        than k were found."""
+        npy = np.ascontiguousarray(npy, dtype=np.float32)
+        backend = self.resolve_backend(backend)
+        if backend == "exact":
+            return self._search_exact(npy, k)
+        if backend == "hnsw":
+            return self._hnsw_index().search(npy, k, params=faiss.SearchParametersHNSW(efSearch=max(HNSW_EF_SEARCH, k)))
+        if self._is_ivf:
+            # per call parameters, jobs sharing the index may ask for different probes at the same time
+            return self.index.search(npy, k, params=faiss.SearchParametersIVF(nprobe=nprobe))
+        return self.index.search(npy, k)
+
+    def retrieve(
+        self, npy: np.ndarray, backend: INDEX_BACKEND = DEFAULT_BACKEND, nprobe: int = DEFAULT_NPROBE
+    ) -> np.ndarray:
+        """Each row of npy replaced by the mean of its nearest vectors, weighted by inverse squared distance. Rows
+        without any neighbour are returned as they are."""
+        npy = np.ascontiguousarray(npy, dtype=np.float32)
+        score, ix = self.search(npy, SEARCH_K, backend, nprobe)
+        found = ix >= 0
+        with np.errstate(divide="ignore"):
+            weight = np.where(found, np.square(1 / score), 0)
+        # a vector the frame matches exactly takes all the weight
+        exact = np.isinf(weight)
+        matched = exact.any(axis=1)
+        weight[matched] = exact[matched]
+        total = weight.sum(axis=1, keepdims=True)
+        weight = np.divide(weight, total, out=np.zeros_like(weight), where=total > 0).astype(np.float32)
+        retrieved = np.empty_like(npy)
+        for start in range(0, npy.shape[0], CHUNK_FRAMES):
+            chunk = slice(start, start + CHUNK_FRAMES)
+            neighbours = self.big_npy[np.where(found[chunk], ix[chunk], 0)]
+            retrieved[chunk] = np.einsum("nk,nkd->nd", weight[chunk], neighbours)
+        lost = ~found.any(axis=1)
+        retrieved[lost] = npy[lost]
+        return retrieved
+
+    def _search_exact(self, npy: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        vectors = self.big_npy
+        with self._lock:
+            if self._norms is None:
+                self._norms = np.einsum("nd,nd->n", vectors, vectors, dtype=np.float32)
+        found = min(k, vectors.shape[0])
+        distances = np.full((npy.shape[0], k), np.finfo(np.float32).max, dtype=np.float32)
+        ids = np.full((npy.shape[0], k), -1, dtype=np.int64)
+        for start in range(0, npy.shape[0], CHUNK_FRAMES):
+            queries = npy[start : start + CHUNK_FRAMES]
+            query_norms = np.einsum("nd,nd->n", queries, queries)[:, None]
+            # the k nearest of the vectors seen so far, merged with each tile's own k nearest
+            best_distances = np.empty((len(queries), 0), dtype=np.float32)
+            best_ids = np.empty((len(queries), 0), dtype=np.int64)
+            for first in range(0, vectors.shape[0], CHUNK_VECTORS):
+                tile = vectors[first : first + CHUNK_VECTORS]
+                chunk = query_norms - 2 * queries @ tile.T + self._norms[None, first : first + len(tile)]
+                np.maximum(chunk, 0, out=chunk)
+                nearest = nearest_columns(chunk, k)
+                best_distances = np.concatenate((best_distances, np.take_along_axis(chunk, nearest, axis=1)), axis=1)
+                best_ids = np.concatenate((best_ids, nearest + first), axis=1)
+                kept = nearest_columns(best_distances, k)
+                best_distances = np.take_along_axis(best_distances, kept, axis=1)
+                best_ids = np.take_along_axis(best_ids, kept, axis=1)
+            order = np.argsort(best_distances, axis=1)
+            distances[start : start + len(queries), :found] = np.take_along_axis(best_distances, order, axis=1)
+            ids[start : start + len(queries), :found] = np.take_along_axis(best_ids, order, axis=1)
+        return distances, ids
+
+    def _hnsw_index(self):
+        with self._lock:
+            if self._hnsw is None:
+                self._hnsw = self._load_hnsw()
+            return self._hnsw
+
+    def _load_hnsw(self):
+        path = hnsw_path(self.file_index) if self.file_index else None
+        if path is not None:
+            try:
+                if os.path.getmtime(path) >= os.path.getmtime(self.file_index):
+                    hnsw = faiss.read_index(path)
+                    if hnsw.ntotal == self.big_npy.shape[0] and hnsw.d == self.big_npy.shape[1]:
+                        return hnsw
+            except (OSError, RuntimeError):
+                pass
+        logger.info(f"Building hnsw index over {self.big_npy.shape[0]} vectors")
+        hnsw = faiss.IndexHNSWFlat(self.big_npy.shape[1], HNSW_M)
+        hnsw.add(np.ascontiguousarray(self.big_npy, dtype=np.float32))
+        if path is not None:
+            partial_path = f"{path}.partial"
+            try:
+                faiss.write_index(hnsw, partial_path)
+                os.replace(partial_path, path)
+            except (OSError, RuntimeError) as e:
+                logger.info(f"Could not save the hnsw index of {self.file_index}: {e}")
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+        return hnsw
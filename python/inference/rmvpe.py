@@ -1,5 +1,5 @@
 import os
-from threading import Lock
+from contextlib import contextmanager
 
 import numpy as np
 import torch
@@ -7,6 +7,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from inference.config import config
+from inference.model_pool import model_pool
 
 
 class BiGRU(nn.Module):
@@ -311,21 +312,31 @@ class MelSpectrogram(torch.nn.Module):
         return log_mel_spec
 
 
-RMVPE_LOCK = Lock()
-
-
 class RMVPE:
-    def load_model(self, weights_path: str):
-        with RMVPE_LOCK:
-            if self.model is not None:
-                return
-
-            model = E2E(4, 1, (2, 2))
-            model_path = os.path.join(weights_path, "rmvpe.pt")
-            ckpt = torch.load(model_path, map_location=config.device)
-            model.load_state_dict(ckpt)
-            model.eval()
-            self.model = model.to(self.device)
+    def load_model(self, model_path: str):
+        model = E2E(4, 1, (2, 2))
+        ckpt = torch.load(model_path, map_location=config.device)
+        model.load_state_dict(ckpt)
+        model.eval()
+        return model.to(self.device)
+
+    def unload_model(self, model):
+        if self.model is model:
+            self.model = None
+
+    @contextmanager
+    def use(self, weights_path: str):
+        """Hold the pooled rmvpe model for the duration of the block."""
+        model_path = os.path.join(weights_path, "rmvpe.pt")
+        with model_pool.use(
+            "rmvpe",
+            model_path,
+            lambda: self.load_model(model_path),
+            device=str(self.device),
+            on_evict=self.unload_model,
+        ) as model:
+            self.model = model
+            yield model
 
     def __init__(self, device=config.device):
         self.resample_kernel = {}
@@ -335,11 +346,12 @@ class RMVPE:
         cents_mapping = 20 * np.arange(360) + 1997.3794084376191
         self.cents_mapping = np.pad(cents_mapping, (4, 4))  # 368
 
-    def mel2hidden(self, mel):
+    def mel2hidden(self, mel, model=None):
+        model = model if model is not None else self.model
         with torch.no_grad():
             n_frames = mel.shape[-1]
             mel = F.pad(mel, (0, 32 * ((n_frames - 1) // 32 + 1) - n_frames), mode="reflect")
-            hidden = self.model(mel)
+            hidden = model(mel)
             return hidden[:, :n_frames]
 
     def decode(self, hidden, thred=0.03):
@@ -348,7 +360,9 @@ class RMVPE:
         f0[f0 == 10] = 0
         return f0
 
-    def infer_from_audio(self, input_audio_path, audio, thred=0.03):
+    def infer_from_audio(self, input_audio_path, audio, thred=0.03, model=None):
+        """f0 of the audio with model, the loaded model by default. Callers off the thread that pinned the model pass
+        it in: the pool may unload self.model under them once the pin is gone."""
         cache_suffix = f"_rmvpe_{thred}.npy"
         input_filename = os.path.splitext(os.path.basename(input_audio_path))[0]
         cache_name = input_filename + cache_suffix
@@ -363,7 +377,7 @@ class RMVPE:
 
         audio = torch.from_numpy(audio).float().to(self.device).unsqueeze(0)
         mel = self.mel_extractor(audio, center=True)
-        hidden = self.mel2hidden(mel)
+        hidden = self.mel2hidden(mel, model)
         hidden = hidden.squeeze(0).cpu().numpy()
         f0 = self.decode(hidden, thred=thred)
         np.save(cache_path, f0)
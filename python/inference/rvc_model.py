@@ -1,12 +1,17 @@
 # import monkey patch above all else
 import logging
+import os
+from contextlib import nullcontext
 from threading import Lock
 from typing import List, Optional
 
 import numpy as np
 import torch
 
+from inference import metrics
 from inference.api_models import CreateSongOptions
+from inference.audio_cache import AudioCache
+from inference.cancel import CancelToken
 from inference.config import config
 from inference.hubert import hubert_model
 from inference.infer_pack.models import (
@@ -15,9 +20,10 @@ from inference.infer_pack.models import (
     SynthesizerTrnMs768NSFsid,
     SynthesizerTrnMs768NSFsid_nono,
 )
+from inference.retrieval import DEFAULT_BACKEND, DEFAULT_NPROBE, FeatureRetriever
 from inference.rmvpe import model_rmvpe
 from inference.utils import load_audio
-from inference.vc_infer_pipeline import VC
+from inference.vc_infer_pipeline import VC, load_index
 
 RVC_LOCK = Lock()
 
@@ -35,6 +41,10 @@ class RVCModel:
         self.pth_files = pth_files
         self.index_files = index_files
         self.cpt = None
+        self.index_lock = Lock()
+        # (path, mtime) of the index loaded, so an index replaced on disk is read again
+        self.index_key = None
+        self.retriever: Optional[FeatureRetriever] = None
 
         if len(pth_files) == 0:
             raise RuntimeError(f"No .pth files found for {name}")
@@ -121,7 +131,29 @@ class RVCModel:
         self.n_spk = self.cpt["config"][-3]
         self.net_g = net_g.float()
 
+    def load_index(self) -> Optional[FeatureRetriever]:
+        """Read the faiss index once per loaded model, so every job run with this model shares it. It goes with the
+        model when the pool evicts it."""
+        file_index = self.index_files[0] if len(self.index_files) > 0 else None
+        try:
+            index_key = (file_index, os.stat(file_index).st_mtime_ns) if file_index else None
+        except OSError:
+            index_key = None
+        with self.index_lock:
+            if index_key != self.index_key:
+                index, big_npy = load_index(file_index) if index_key else (None, None)
+                self.retriever = FeatureRetriever(index, big_npy, file_index) if index is not None else None
+                self.index_key = index_key
+            return self.retriever
+
+    def resident_bytes(self) -> int:
+        """Bytes held by the synthesizer and the checkpoint weights it was built from."""
+        tensors = list(self.net_g.parameters()) + list(self.net_g.buffers())
+        tensors += [t for t in self.cpt["weight"].values() if isinstance(t, torch.Tensor)]
+        return sum(t.numel() * t.element_size() for t in tensors)
+
     def clearMemory(self):
+        del self.retriever
         del self.cpt
         del self.tgt_sr
         del self.vc
@@ -134,7 +166,12 @@ class RVCModel:
         weights_path,
         status_report,
         options: Optional[CreateSongOptions] = None,
+        cancel_token: Optional[CancelToken] = None,
+        times: Optional[List[float]] = None,
+        audio_cache: Optional[AudioCache] = None,
     ):
+        """Convert the vocals. Pass `times` to get back the hubert, f0, synthesizer and segmentation seconds, and the job's
+        audio_cache to reuse audio it already decoded."""
         if input_audio_path is None:
             raise RuntimeError("No input audio path provided")
         status_report = status_report or (lambda x: None)
@@ -152,42 +189,59 @@ class RVCModel:
         resample_sr = 0
 
         status_report(f"Loading audio...")
-        audio = load_audio(input_audio_path, 16000)
+        if audio_cache is not None:
+            audio = audio_cache.get(input_audio_path, 16000, mono=True)
+        else:
+            audio = load_audio(input_audio_path, 16000, cancel_token)
         status_report("Processing audio...")
         audio_max = np.abs(audio).max() / 0.95
         if audio_max > 1:
-            audio /= audio_max
-        times = [0, 0, 0]
-        status_report(f"Loading hubert model...")
-        hubert_model.load_model(weights_path)
-        logger.info(f"Loaded hubert model")
-        if f0_method == "rmvpe":
-            logger.info(f"Loading rmvpe model...")
-            model_rmvpe.load_model(weights_path)
-            logger.info(f"Loaded rmvpe model")
+            # not in place, the cached audio is shared
+            audio = audio / audio_max
+        times = times if times is not None else [0, 0, 0, 0]
         if_f0 = self.cpt.get("f0", 1)
-        status_report("Performing inference...")
-        audio_data = self.vc.pipeline(
-            hubert_model.hubert_model,
-            self.net_g,
-            sid,
-            audio,
-            input_audio_path,
-            times,
-            f0_up_key,
-            f0_method,
-            file_index,
-            index_rate,
-            if_f0,
-            filter_radius,
-            self.tgt_sr,
-            resample_sr,
-            rms_mix_rate,
-            self.version,
-            protect,
-            crepe_hop_length,
-            status_report,
-        )
+        retriever = None
+        if file_index and index_rate > 0:
+            status_report("Loading index...")
+            retriever = self.load_index()
+        status_report(f"Loading hubert model...")
+        # both models stay pinned in the pool until the pipeline is done with them
+        rmvpe_context = model_rmvpe.use(weights_path) if f0_method == "rmvpe" else nullcontext()
+        with hubert_model.use(weights_path) as hubert, rmvpe_context as rmvpe:
+            logger.info(f"Loaded hubert model")
+            status_report("Performing inference...")
+            audio_data = self.vc.pipeline(
+                hubert,
+                self.net_g,
+                sid,
+                audio,
+                input_audio_path,
+                times,
+                f0_up_key,
+                f0_method,
+                file_index,
+                index_rate,
+                if_f0,
+                filter_radius,
+                self.tgt_sr,
+                resample_sr,
+                rms_mix_rate,
+                self.version,
+                protect,
+                crepe_hop_length,
+                status_report,
+                retriever=retriever,
+                cancel_token=cancel_token,
+                index_backend=options.indexBackend or DEFAULT_BACKEND,
+                index_nprobe=options.indexNprobe or DEFAULT_NPROBE,
+                rmvpe_model=rmvpe,
+            )
+        # the pipeline fills times with hubert (and index retrieval), f0, synthesizer and segmentation seconds
+        if if_f0 == 1:
+            metrics.observe_stage("f0", times[1], f0_method)
+        metrics.observe_stage("hubert", times[0], "hubert_base")
+        metrics.observe_stage("synthesizer", times[2], f"rvc_{self.version}")
+        metrics.observe_stage("segmentation", times[3])
         if self.tgt_sr != resample_sr and resample_sr >= 16000:
             self.tgt_sr = resample_sr
         return self.tgt_sr, audio_data
@@ -0,0 +1,181 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Literal, Optional, Set, Tuple
+
+from inference import metrics
+from inference.cancel import CancelToken, JobCancelled
+
+logger = logging.getLogger(__name__)
+
+RESOURCE_CLASS = Literal["cpu", "device"]
+
+# Which resource each stage of a job occupies while it runs. "device" stages run on config.device (which may
+# itself be the cpu), so they are budgeted separately from the ffmpeg/yt-dlp style work.
+STAGE_RESOURCES: Dict[str, RESOURCE_CLASS] = {
+    "download": "cpu",
+    "decode": "cpu",
+    "separation": "device",
+    "rvc": "device",
+    "encode": "cpu",
+}
+
+# How many jobs may be inside each stage at once, on top of the resource class caps. One separation and one
+# conversion at a time lets the next song separate while the current one converts, without two copies of
+# either model fighting over the device.
+DEFAULT_STAGE_SLOTS: Dict[str, int] = {
+    "download": 2,
+    "separation": 1,
+    "rvc": 1,
+}
+
+# how often a job waiting for a stage checks whether it has been stopped
+WAIT_POLL_SECONDS = 0.25
+
+Ticket = Tuple[float, int]  # priority, then arrival
+
+
+def default_cpu_slots() -> int:
+    return max(1, min(4, (os.cpu_count() or 1) // 2))
+
+
+def parse_stage_slots(value: str) -> Dict[str, int]:
+    """Parse "separation=1,rvc=1" into a dict, checking the stage names."""
+    stage_slots = {}
+    for part in value.split(","):
+        if not part.strip():
+            continue
+        name, _, slots = part.partition("=")
+        name = name.strip()
+        if name not in STAGE_RESOURCES:
+            raise ValueError(f"Unknown stage {name!r}, expected one of {', '.join(STAGE_RESOURCES)}")
+        if int(slots) < 1:
+            raise ValueError(f"Stage {name} needs at least one slot")
+        stage_slots[name] = int(slots)
+    return stage_slots
+
+
+class JobScheduler:
+    """Runs several jobs at once as a staged pipeline: while one job converts, the next can separate and the
+    previous one encode.
+
+    Each stage has its own cap, and each class of stage (cpu or device) a shared cap. Within a stage, waiting jobs
+    are let in by priority (the time the job started), so an earlier job is never overtaken by a later one.
+    """
+
+    def __init__(
+        self,
+        max_jobs: int = 4,
+        cpu_slots: int = 0,
+        device_slots: int = 2,
+        stage_slots: Optional[Dict[str, int]] = None,
+    ):
+        """stage_slots overrides the caps of DEFAULT_STAGE_SLOTS and adds caps for other stages."""
+        unknown = set(stage_slots or {}) - set(STAGE_RESOURCES)
+        if unknown:
+            raise ValueError(f"Unknown stages {', '.join(sorted(unknown))}, expected {', '.join(STAGE_RESOURCES)}")
+        self.max_jobs = max(1, max_jobs)
+        self.cpu_slots = cpu_slots if cpu_slots > 0 else default_cpu_slots()
+        self.device_slots = max(1, device_slots)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix="replay-job")
+        self._class_slots: Dict[RESOURCE_CLASS, int] = {"cpu": self.cpu_slots, "device": self.device_slots}
+        # a stage without its own cap is only limited by its class
+        self.stage_slots: Dict[str, int] = {
+            name: self._class_slots[resource] for name, resource in STAGE_RESOURCES.items()
+        }
+        self.stage_slots.update(DEFAULT_STAGE_SLOTS)
+        self.stage_slots.update(stage_slots or {})
+        self._cond = threading.Condition()
+        self._arrivals = itertools.count()
+        self._active: Dict[str, int] = {stage: 0 for stage in STAGE_RESOURCES}
+        self._class_active: Dict[RESOURCE_CLASS, int] = {"cpu": 0, "device": 0}
+        self._waiting: Dict[str, List[Ticket]] = {stage: [] for stage in STAGE_RESOURCES}
+        self._locked: Set[str] = set()
+        slots = ", ".join(f"{name}={count}" for name, count in self.stage_slots.items())
+        logger.info(
+            f"Scheduler: {self.max_jobs} jobs, {self.cpu_slots} cpu slots, {self.device_slots} device slots, "
+            f"stages {slots}"
+        )
+
+    def _can_enter(self, name: str, ticket: Ticket) -> bool:
+        resource = STAGE_RESOURCES[name]
+        return (
+            self._waiting[name][0] == ticket
+            and self._active[name] < self.stage_slots[name]
+            and self._class_active[resource] < self._class_slots[resource]
+        )
+
+    def acquire(self, name: str, priority: Optional[float] = None, should_stop: Callable[[], bool] = None) -> bool:
+        """Wait for a slot in the stage. Returns False, without a slot, if should_stop turns true while waiting."""
+        priority = time.time() if priority is None else priority
+        ticket: Ticket = (priority, next(self._arrivals))
+        with self._cond:
+            heapq.heappush(self._waiting[name], ticket)
+            while not self._can_enter(name, ticket):
+                self._cond.wait(WAIT_POLL_SECONDS if should_stop else None)
+                if should_stop and should_stop():
+                    self._waiting[name].remove(ticket)
+                    heapq.heapify(self._waiting[name])
+                    self._cond.notify_all()
+                    return False
+            heapq.heappop(self._waiting[name])
+            self._active[name] += 1
+            self._class_active[STAGE_RESOURCES[name]] += 1
+            # the next job in line may fit as well
+            self._cond.notify_all()
+        metrics.ACTIVE_STAGES.labels(name).inc()
+        return True
+
+    def release(self, name: str):
+        with self._cond:
+            self._active[name] -= 1
+            self._class_active[STAGE_RESOURCES[name]] -= 1
+            self._cond.notify_all()
+        metrics.ACTIVE_STAGES.labels(name).dec()
+
+    @contextmanager
+    def stage(self, name: str, priority: Optional[float] = None, cancel_token: Optional[CancelToken] = None):
+        """Hold a slot of the stage for the duration of the block."""
+        should_stop = (lambda: cancel_token.cancelled) if cancel_token is not None else None
+        if not self.acquire(name, priority, should_stop):
+            raise JobCancelled()
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def lock(self, key: str, should_stop: Callable[[], bool] = None) -> bool:
+        """Wait until no other job holds the key. Returns False, without the key, if should_stop turns true."""
+        with self._cond:
+            while key in self._locked:
+                self._cond.wait(WAIT_POLL_SECONDS if should_stop else None)
+                if should_stop and should_stop():
+                    return False
+            self._locked.add(key)
+        return True
+
+    def unlock(self, key: str):
+        with self._cond:
+            self._locked.discard(key)
+            self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self, key: str, cancel_token: Optional[CancelToken] = None):
+        """Let one job at a time do the work identified by key, e.g. separating a song with a model, so the others
+        wait (without holding a stage slot) and then pick up its output."""
+        should_stop = (lambda: cancel_token.cancelled) if cancel_token is not None else None
+        if not self.lock(key, should_stop):
+            raise JobCancelled()
+        try:
+            yield
+        finally:
+            self.unlock(key)
+
+    def active_stages(self) -> Dict[str, int]:
+        with self._cond:
+            return dict(self._active)
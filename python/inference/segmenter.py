@@ -0,0 +1,29 @@
+from typing import List
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def moving_sum(audio: np.ndarray, window: int) -> np.ndarray:
+    """Sum of each window samples of audio, reflect padded by half a window on both ends so the result lines up with
+    audio: element i sums the window centred on sample i."""
+    audio_pad = np.pad(audio, (window // 2, window // 2), mode="reflect")
+    cumulative = np.concatenate(([0.0], np.cumsum(audio_pad, dtype=np.float64)))
+    return cumulative[window : window + audio.shape[0]] - cumulative[: audio.shape[0]]
+
+
+def split_points(audio: np.ndarray, window: int, center: int, query: int) -> List[int]:
+    """Where to cut long audio: near every center samples, the quietest point within query samples of it.
+
+    Quietness is the absolute moving sum over window samples; the first of equally quiet points wins.
+    """
+    if audio.shape[0] <= center:
+        return []
+    loudness = np.abs(moving_sum(audio, window))
+    centers = np.arange(center, audio.shape[0], center)
+    starts = centers - query
+    # the last window may run past the end, where nothing can be the quietest point
+    end = max(int(starts[-1]) + 2 * query, loudness.shape[0])
+    loudness = np.concatenate((loudness, np.full(end - loudness.shape[0], np.inf)))
+    windows = sliding_window_view(loudness, 2 * query)[starts]
+    return (starts + windows.argmin(axis=1)).tolist()
@@ -2,15 +2,27 @@ import os
 import time
 from functools import lru_cache
 from threading import Lock
-from typing import Callable
+from typing import Callable, Optional, Tuple
 
+from inference import metrics
+from inference.artifact_store import ArtifactStore, artifact_key, artifact_stores
+from inference.audio_cache import AudioCache
+from inference.cancel import CancelToken
+from inference.hashing import file_hashes
 from inference.inference_conf import stemming_models_list
+from inference.previews import preview_encoder
 from inference.uvr.constants import DEMUCS_ARCH_TYPE, MDX_ARCH_TYPE, NO_OTHER_STEM, VR_ARCH_TYPE
 from inference.uvr.model_data import ModelData
 from inference.uvr.separate import SeparateDemucs, SeparateMDX, SeparateVR
 
 SEPARATION_LOCK = Lock()
 
+SEPARATORS = {
+    VR_ARCH_TYPE: SeparateVR,
+    MDX_ARCH_TYPE: SeparateMDX,
+    DEMUCS_ARCH_TYPE: SeparateDemucs,
+}
+
 lock_dict = {}
 
 
@@ -61,11 +73,27 @@ def demucs_model_name_mapper(name: str):
 class Stemmer:
     @staticmethod
     @lru_cache(maxsize=128)  # adjust this value based on how many unique combinations you expect
-    def _get_lock(source_audio_path: str, output_directory: str):
-        key = (source_audio_path, output_directory)
-        if key not in lock_dict:
-            lock_dict[key] = Lock()
-        return lock_dict[key]
+    def _get_lock(track_dir: str):
+        if track_dir not in lock_dict:
+            lock_dict[track_dir] = Lock()
+        return lock_dict[track_dir]
+
+    @staticmethod
+    def stems_key(weights_dir: str, model_name: str, source_identity: str) -> str:
+        """Key of the stems of the input identified by source_identity (a content hash), so different songs with
+        the same filename never share stems and a changed model file or setting separates again."""
+        return Stemmer._stems_key(Stemmer.get_model_data(weights_dir, model_name), source_identity)
+
+    @staticmethod
+    def _stems_key(model_data: ModelData, source_identity: str) -> str:
+        model_hash = model_data.model_hash
+        if not model_hash and os.path.isfile(model_data.model_path):
+            model_hash = file_hashes.digest(model_data.model_path)
+        settings = {
+            name: getattr(model_data, name, None)
+            for name in ("process_method", "primary_stem", "aggression_setting", "window_size", "margin", "overlap")
+        }
+        return artifact_key("stems", source_identity, model_data.model_name, model_hash, sorted(settings.items()))
 
     @staticmethod
     def separate_track(
@@ -74,32 +102,34 @@ class Stemmer:
         weights_dir: str,
         model_name: str = "UVR-MDX-NET Voc FT",
         status_setter: Callable[[str], None] = None,
-    ):
+        cancel_token: Optional[CancelToken] = None,
+        metrics_stage: str = "separation",
+        source_identity: Optional[str] = None,
+        store: Optional[ArtifactStore] = None,
+        audio_cache: Optional[AudioCache] = None,
+    ) -> Tuple[str, str, bool]:
+        """Separate the track into output_directory/<model>/<stems key>/, or return the stems a previous run left
+        there. source_identity is the content hash of the track, computed here if not given.
+
+        Returns the vocals and instrumentals paths, and whether they came from the artifact store instead of being
+        separated now."""
         if not os.path.exists(source_audio_path):
             raise Exception(f"Source audio path does not exist: {source_audio_path}")
         track_filename = os.path.basename(source_audio_path)
         track_name = os.path.splitext(track_filename)[0]
-        model = None
-        for m in stemming_models_list:
-            if m.name == model_name:
-                model = m
-                break
-        lock = Stemmer._get_lock(source_audio_path, output_directory)
-        with lock:
-            model_path = os.path.join(weights_dir, model.files[0])
-            if len(model.files) > 1:
-                # demucs models download a yaml file that has all the information regarding the model
-                model_path = os.path.join(weights_dir, demucs_model_name_mapper(model_name))
-            model_data: ModelData = ModelData(model_name, model_path=model_path, selected_process_method=model.type)
-            safe_name = "".join(x for x in model_name if x.isalnum())
-            track_dir = os.path.join(output_directory, safe_name, track_name)
-            os.makedirs(track_dir, exist_ok=True)
+        if source_identity is None:
+            source_identity = file_hashes.digest(source_audio_path)
+        store = store or artifact_stores.get(output_directory)
+        model_data = Stemmer.get_model_data(weights_dir, model_name)
+        key = Stemmer._stems_key(model_data, source_identity)
+        safe_name = "".join(x for x in model_name if x.isalnum())
+        track_dir = os.path.join(output_directory, safe_name, key)
+        with Stemmer._get_lock(track_dir):
             vocal_file = os.path.join(track_dir, "vocals.wav")
             no_vocals_wav = os.path.join(track_dir, "no_vocals.wav")
-
-            no_vocals_is_valid = os.path.exists(no_vocals_wav) or model_data.primary_stem == NO_OTHER_STEM
-            if os.path.exists(vocal_file) and no_vocals_is_valid:
-                return vocal_file, no_vocals_wav
+            if store.lookup(key) is not None:
+                return vocal_file, no_vocals_wav, True
+            os.makedirs(track_dir, exist_ok=True)
 
             def write_to_console(progress_text, base_text=""):
                 if status_setter:
@@ -110,6 +140,10 @@ class Stemmer:
                 perc = (x + y) * 100
                 write_to_console(f"{perc:.2f}%")
 
+            def write_preview(stem_path, audio, samplerate):
+                # the stems' size in the index grows by their previews
+                preview_encoder.submit(stem_path, audio, samplerate, "stems", on_done=lambda: store.refresh(key))
+
             process_data = {
                 "model_data": model_data,
                 "export_path": track_dir,
@@ -117,17 +151,49 @@ class Stemmer:
                 "audio_file": source_audio_path,
                 "set_progress_bar": set_progress_bar,
                 "write_to_console": write_to_console,
+                "cancel_token": cancel_token,
+                "audio_cache": audio_cache,
+                "write_preview": write_preview,
             }
 
             start_time = time.time()
-            if model_data.process_method == VR_ARCH_TYPE:
-                seperator = SeparateVR(model_data, process_data)
-            if model_data.process_method == MDX_ARCH_TYPE:
-                seperator = SeparateMDX(model_data, process_data)
-            if model_data.process_method == DEMUCS_ARCH_TYPE:
-                seperator = SeparateDemucs(model_data, process_data)
-
+            seperator = SEPARATORS[model_data.process_method](model_data, process_data)
             seperator.separate()
             elapsed_time = time.time() - start_time
             print(f"Separation complete. Elapsed time: {elapsed_time}")
-            return vocal_file, no_vocals_wav
+            metrics.observe_stage(metrics_stage, elapsed_time, model_name)
+            metrics.count_bytes_written("stems", vocal_file, no_vocals_wav)
+            no_vocals_is_valid = os.path.exists(no_vocals_wav) or model_data.primary_stem == NO_OTHER_STEM
+            if os.path.exists(vocal_file) and no_vocals_is_valid:
+                store.record(key, "stems", track_dir)
+            return vocal_file, no_vocals_wav, False
+
+    @staticmethod
+    def get_model_data(weights_dir: str, model_name: str) -> ModelData:
+        model = None
+        for m in stemming_models_list:
+            if m.name == model_name:
+                model = m
+                break
+        if model is None:
+            raise Exception(f"Unknown stemming model: {model_name}")
+        model_path = os.path.join(weights_dir, model.files[0])
+        if len(model.files) > 1:
+            # demucs models download a yaml file that has all the information regarding the model
+            model_path = os.path.join(weights_dir, demucs_model_name_mapper(model_name))
+        return ModelData(model_name, model_path=model_path, selected_process_method=model.type)
+
+    @staticmethod
+    def preload(weights_dir: str, model_name: str = "UVR-MDX-NET Voc FT"):
+        """Load a stemming model into the model pool without separating anything."""
+        model_data = Stemmer.get_model_data(weights_dir, model_name)
+        process_data = {
+            "model_data": model_data,
+            "export_path": None,
+            "audio_file_base": None,
+            "audio_file": None,
+            "set_progress_bar": None,
+            "write_to_console": None,
+        }
+        with SEPARATORS[model_data.process_method](model_data, process_data).use_model():
+            pass
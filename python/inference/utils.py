@@ -1,24 +1,121 @@
 import os
+from typing import Dict, List, Optional
 
 import ffmpeg
 import numpy as np
 
+from inference.cancel import CancelToken, JobCancelled, communicate
 
-def load_audio(file, sr) -> np.ndarray:
+
+def load_audio(file, sr, cancel_token: Optional[CancelToken] = None) -> np.ndarray:
     try:
         # https://github.com/openai/whisper/blob/main/whisper/audio.py#L26
         # This launches a subprocess to decode audio while down-mixing and resampling as necessary.
         # Requires the ffmpeg CLI and `ffmpeg-python` package to be installed.
         file = file.strip(" ").strip('"').strip("\n").strip('"').strip(" ")
         job = ffmpeg.input(file, threads=0).output("-", format="f32le", acodec="pcm_f32le", ac=1, ar=sr)
-        out, _ = job.run(cmd=["ffmpeg", "-nostdin"], capture_stdout=True, capture_stderr=True)
-
+        process = job.run_async(cmd=["ffmpeg", "-nostdin"], pipe_stdout=True, pipe_stderr=True)
+        out, err = communicate(process, cancel_token)
+        if process.returncode:
+            raise ffmpeg.Error("ffmpeg", out, err)
+    except JobCancelled:
+        raise
     except Exception as e:
         raise RuntimeError(f"Failed to load audio file {file}: {e}")
 
     return np.frombuffer(out, np.float32).flatten()
 
 
+def extract_clip(
+    file,
+    output_path: str,
+    start_seconds: float,
+    duration_seconds: float,
+    sr: int,
+    cancel_token: Optional[CancelToken] = None,
+) -> str:
+    """Decode only [start, start + duration) of the file into a float wav, seeking the input instead of decoding
+    everything before the window."""
+    partial_path = f"{output_path}.partial.wav"
+    try:
+        file = file.strip(" ").strip('"').strip("\n").strip('"').strip(" ")
+        job = (
+            ffmpeg.input(file, ss=start_seconds, t=duration_seconds, threads=0)
+            .output(partial_path, acodec="pcm_f32le", ac=1, ar=sr)
+            .overwrite_output()
+        )
+        process = job.run_async(cmd=["ffmpeg", "-nostdin"], pipe_stdout=True, pipe_stderr=True)
+        out, err = communicate(process, cancel_token)
+        if process.returncode:
+            raise ffmpeg.Error("ffmpeg", out, err)
+        # only a complete clip ever shows up under its name
+        os.replace(partial_path, output_path)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Failed to extract a clip of {file}: {e}")
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return output_path
+
+
+# ffmpeg output options of the formats a track is exported in
+ENCODER_OPTIONS = {
+    "wav": {"format": "wav", "acodec": "pcm_s16le"},
+    "mp3_192k": {"format": "mp3", "acodec": "libmp3lame", "audio_bitrate": "192k"},
+    "mp3_320k": {"format": "mp3", "acodec": "libmp3lame", "audio_bitrate": "320k"},
+}
+
+
+def encode_audio(
+    audio: np.ndarray, sr: int, outputs: Dict[str, dict], cancel_token: Optional[CancelToken] = None
+) -> List[str]:
+    """Encode audio, (channels, samples) or (samples,), into every output path with its ffmpeg options, using one
+    ffmpeg process that reads the samples from a pipe. Integer samples are scaled to [-1, 1)."""
+    channels = audio.shape[0] if audio.ndim == 2 else 1
+    if np.issubdtype(audio.dtype, np.integer):
+        audio = audio.astype(np.float32) / -np.iinfo(audio.dtype).min
+    # ffmpeg wants the channels interleaved
+    interleaved = np.ascontiguousarray(audio.T, dtype=np.float32)
+    try:
+        stream = ffmpeg.input("pipe:", format="f32le", ac=channels, ar=sr)
+        job = ffmpeg.merge_outputs(*[stream.output(path, **options) for path, options in outputs.items()])
+        process = job.overwrite_output().run_async(pipe_stdin=True, pipe_stderr=True)
+        _, err = communicate(process, cancel_token, input=memoryview(interleaved).cast("B"))
+        if process.returncode:
+            raise ffmpeg.Error("ffmpeg", None, err)
+    except JobCancelled:
+        raise
+    except ffmpeg.Error as e:
+        raise RuntimeError(f"Failed to encode {', '.join(outputs)}: {e.stderr.decode(errors='replace')[-500:]}")
+    return list(outputs)
+
+
+def transcode(file: str, outputs: Dict[str, dict], cancel_token: Optional[CancelToken] = None) -> List[str]:
+    """Encode an audio file into every output path with its ffmpeg options, decoding it once."""
+    try:
+        stream = ffmpeg.input(file)
+        job = ffmpeg.merge_outputs(*[stream.output(path, **options) for path, options in outputs.items()])
+        process = job.overwrite_output().run_async(cmd=["ffmpeg", "-nostdin"], pipe_stdout=True, pipe_stderr=True)
+        out, err = communicate(process, cancel_token)
+        if process.returncode:
+            raise ffmpeg.Error("ffmpeg", out, err)
+    except JobCancelled:
+        raise
+    except ffmpeg.Error as e:
+        raise RuntimeError(f"Failed to encode {', '.join(outputs)}: {e.stderr.decode(errors='replace')[-500:]}")
+    return list(outputs)
+
+
+def audio_duration(file) -> Optional[float]:
+    """Length of an audio file in seconds according to ffprobe, or None if it can't be read."""
+    try:
+        return float(ffmpeg.probe(file)["format"]["duration"])
+    except Exception:
+        return None
+
+
 def seconds_to_time(seconds):
     # This function takes an integer number of seconds and returns a string in the format MM:SS
     minutes, seconds = divmod(seconds, 60)
@@ -1,31 +1,42 @@
 import os
+import shutil
 import subprocess
 import tempfile
 
 import numpy as np
 import soundfile as sf
 
+from inference.cancel import communicate
+
 BASE_PATH_RUB = os.path.dirname(os.path.abspath(__file__))
 
 __all__ = ["time_stretch", "pitch_shift"]
 
 __RUBBERBAND_UTIL = os.path.join(BASE_PATH_RUB, "rubberband")
+if not os.path.exists(__RUBBERBAND_UTIL):
+    # not bundled, use the one on the path if any
+    __RUBBERBAND_UTIL = shutil.which("rubberband") or __RUBBERBAND_UTIL
 
 
 DEVNULL = subprocess.DEVNULL
 
 
-def __rubberband(y, sr, **kwargs):
+def available():
+    return os.path.exists(__RUBBERBAND_UTIL)
+
+
+def __rubberband(y, sr, cancel_token=None, **kwargs):
     assert sr > 0
 
+    # rubberband reads and writes with libsndfile, which can't write a wav to a pipe, so it goes through files
     # Get the input and output tempfile
     fd, infile = tempfile.mkstemp(suffix=".wav")
     os.close(fd)
     fd, outfile = tempfile.mkstemp(suffix=".wav")
     os.close(fd)
 
-    # dump the audio
-    sf.write(infile, y, sr)
+    # dump the audio, as floats like the callers' arrays rather than rounded to 16 bits
+    sf.write(infile, y, sr, subtype="FLOAT")
 
     try:
         # Execute rubberband
@@ -37,7 +48,10 @@ def __rubberband(y, sr, **kwargs):
 
         arguments.extend([infile, outfile])
 
-        subprocess.check_call(arguments, stdout=DEVNULL, stderr=DEVNULL)
+        process = subprocess.Popen(arguments, stdout=DEVNULL, stderr=DEVNULL)
+        communicate(process, cancel_token)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, arguments)
 
         # Load the processed audio.
         y_out, _ = sf.read(outfile, always_2d=True)
@@ -57,7 +71,7 @@ def __rubberband(y, sr, **kwargs):
     return y_out
 
 
-def time_stretch(y, sr, rate, rbargs=None):
+def time_stretch(y, sr, rate, rbargs=None, cancel_token=None):
     if rate <= 0:
         raise ValueError("rate must be strictly positive")
 
@@ -69,10 +83,10 @@ def time_stretch(y, sr, rate, rbargs=None):
 
     rbargs.setdefault("--tempo", rate)
 
-    return __rubberband(y, sr, **rbargs)
+    return __rubberband(y, sr, cancel_token, **rbargs)
 
 
-def pitch_shift(y, sr, n_steps, rbargs=None):
+def pitch_shift(y, sr, n_steps, rbargs=None, cancel_token=None):
     if n_steps == 0:
         return y
 
@@ -81,4 +95,4 @@ def pitch_shift(y, sr, n_steps, rbargs=None):
 
     rbargs.setdefault("--pitch", n_steps)
 
-    return __rubberband(y, sr, **rbargs)
+    return __rubberband(y, sr, cancel_token, **rbargs)
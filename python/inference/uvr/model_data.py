@@ -1,9 +1,9 @@
-import hashlib
 import os
 
 import psutil
 import torch
 
+from inference.hashing import file_hashes
 from inference.uvr.constants import (
     ALL_STEMS,
     BATCH_MODE,
@@ -630,12 +630,8 @@ class ModelData:
                         break
 
             if not self.model_hash:
-                try:
-                    with open(self.model_path, "rb") as f:
-                        f.seek(-10000 * 1024, 2)
-                        self.model_hash = hashlib.md5(f.read()).hexdigest()
-                except:
-                    self.model_hash = hashlib.md5(open(self.model_path, "rb").read()).hexdigest()
+                # md5 of the last 10MB, which is what the known model hash tables are keyed by
+                self.model_hash = file_hashes.digest(self.model_path, "md5", tail_bytes=10000 * 1024)
 
                 table_entry = {self.model_path: self.model_hash}
                 model_hash_table.update(table_entry)
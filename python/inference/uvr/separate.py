@@ -8,13 +8,12 @@ import warnings
 
 # from lib_v5.vr_network.model_param_init import ModelParameters
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 
 import audioread
 import librosa
 import numpy as np
 import onnxruntime as ort
-import pydub
 import soundfile as sf
 import torch
 
@@ -24,7 +23,10 @@ from demucs.hdemucs import HDemucs
 from demucs.model_v2 import auto_load_demucs_model_v2
 from demucs.pretrained import get_model as _gm
 from demucs.utils import apply_model_v1, apply_model_v2
+from inference.audio_cache import AudioCache
+from inference.cancel import CancelToken, raise_if_cancelled
 from inference.config import config
+from inference.model_pool import model_pool
 from inference.uvr.constants import (
     ALL_STEMS,
     ARM,
@@ -49,6 +51,7 @@ from inference.uvr.constants import (
     VR_ARCH_TYPE,
     WAV,
 )
+from inference.utils import ENCODER_OPTIONS, encode_audio, transcode
 from inference.uvr.error_handling import ERROR_MAPPER, WINDOW_SIZE_ERROR
 from inference.uvr.lib_v5 import spec_utils
 from inference.uvr.lib_v5.vr_network import nets, nets_new
@@ -73,6 +76,11 @@ class SeparateAttributes:
         self.audio_file = process_data["audio_file"]
         self.audio_file_base = process_data["audio_file_base"]
         self.export_path = process_data["export_path"]
+        self.cancel_token: Optional[CancelToken] = process_data.get("cancel_token")
+        # the job's decoded audio, so the mix isn't decoded again here
+        self.audio_cache: Optional[AudioCache] = process_data.get("audio_cache")
+        # queues the preview of a stem from its samples, instead of encoding it here
+        self.write_preview = process_data.get("write_preview")
         self.mixer_path = model_data.mixer_path
         self.model_samplerate = model_data.model_samplerate
         self.model_capacity = model_data.model_capacity
@@ -171,7 +179,9 @@ class SeparateAttributes:
 
     def write_audio(self, stem_path, stem_source, samplerate):
         sf.write(stem_path, stem_source, samplerate, subtype=self.wav_type_set)
-        save_format(stem_path, self.save_format, self.mp3_bit_set) if not self.is_ensemble_mode else None
+        if not self.is_ensemble_mode:
+            audio = np.asarray(stem_source).T
+            save_format(stem_path, self.save_format, self.mp3_bit_set, audio, samplerate, self.write_preview)
         self.set_progress_bar(0.95)
 
     def run_mixer(self, mix, sources):
@@ -205,17 +215,33 @@ class SeparateMDX(SeparateAttributes):
     n_bins = None
     model_run = None
 
-    def separate(self):
+    def load_model(self):
         if self.is_mdx_ckpt:
             print("Loading MDXNet Model")
             model_params = torch.load(self.model_path, map_location=lambda storage, loc: storage)["hyper_parameters"]
-            self.dim_c, self.hop = model_params["dim_c"], model_params["hop_length"]
             separator = MdxnetSet.ConvTDFNet(**model_params)
-            self.model_run = separator.load_from_checkpoint(self.model_path, map_location=self.device).eval()
+            return separator.load_from_checkpoint(self.model_path, map_location=self.device).eval()
+        print(f"Loading ONNX Model - device {ort.get_device()} with providers {config.ort_providers}")
+        inference_session = ort.InferenceSession(self.model_path, providers=config.ort_providers)
+        print(f"Using ORT device: {ort.get_device()}")
+        return inference_session
+
+    def use_model(self):
+        """The pooled model for this separator, held for the duration of the block."""
+        kind = "mdx-ckpt" if self.is_mdx_ckpt else "mdx-onnx"
+        return model_pool.use(kind, self.model_path, self.load_model, device=str(self.device))
+
+    def separate(self):
+        with self.use_model() as model:
+            self.separate_with_model(model)
+        self.model_run = None
+
+    def separate_with_model(self, model):
+        if self.is_mdx_ckpt:
+            self.dim_c, self.hop = model.hparams["dim_c"], model.hparams["hop_length"]
+            self.model_run = model
         else:
-            print(f"Loading ONNX Model - device {ort.get_device()} with providers {config.ort_providers}")
-            inference_session = ort.InferenceSession(self.model_path, providers=config.ort_providers)
-            print(f"Using ORT device: {ort.get_device()}")
+            inference_session = model
 
             def model_run(spek):
                 start = timer()
@@ -239,7 +265,9 @@ class SeparateMDX(SeparateAttributes):
         self.initialize_model_settings()
         self.running_inference_console_write()
         mdx_net_cut = True if self.primary_stem in MDX_NET_FREQ_CUT else False
-        mix, raw_mix, samplerate = prepare_mix(self.audio_file, self.chunks, self.margin, mdx_net_cut=mdx_net_cut)
+        mix, raw_mix, samplerate = prepare_mix(
+            self.audio_file, self.chunks, self.margin, mdx_net_cut=mdx_net_cut, audio_cache=self.audio_cache
+        )
         source = self.demix_base(mix, is_ckpt=self.is_mdx_ckpt)[0]
         self.write_to_console(f"{SAVING_STEM[0]}{self.primary_stem}{SAVING_STEM[1]}")
 
@@ -311,6 +339,7 @@ class SeparateMDX(SeparateAttributes):
             pad = mix_p.shape[-1] if is_ckpt else -pad
             with torch.no_grad():
                 for mix_wave in mix_waves:
+                    raise_if_cancelled(self.cancel_token)
                     self.running_inference_progress_bar(len(mix) * len(mix_waves), is_match_mix=is_match_mix)
                     tar_waves = self.run_model(mix_wave, is_ckpt=is_ckpt, is_match_mix=is_match_mix)
                     tar_waves_.append(tar_waves)
@@ -377,6 +406,32 @@ class SeparateMDX(SeparateAttributes):
 class SeparateDemucs(SeparateAttributes):
     demucs = None
 
+    def load_model(self):
+        if self.demucs_version == DEMUCS_V1:
+            klass, args, kwargs, state = torch.load(self.model_path)
+            demucs = klass(*args, **kwargs)
+            demucs.to(self.device)
+            demucs.load_state_dict(state)
+        elif self.demucs_version == DEMUCS_V2:
+            demucs = auto_load_demucs_model_v2(self.demucs_source_list, self.model_path)
+            demucs.to(self.device)
+            demucs.load_state_dict(torch.load(self.model_path))
+            demucs.eval()
+        else:
+            demucs = _gm(
+                name=os.path.splitext(os.path.basename(self.model_path))[0],
+                repo=Path(os.path.dirname(self.model_path)),
+            )
+            demucs.to(self.device)
+            demucs.eval()
+        return demucs
+
+    def use_model(self):
+        """The pooled model for this separator, held for the duration of the block."""
+        self.device = torch.device(config.device)
+        kind = f"demucs-{self.demucs_version}"
+        return model_pool.use(kind, self.model_path, self.load_model, device=str(self.device))
+
     def separate(self):
         samplerate = 44100
         model_scale = None
@@ -385,34 +440,19 @@ class SeparateDemucs(SeparateAttributes):
 
         self.device = torch.device(config.device)
 
-        if self.demucs_version == DEMUCS_V1:
-            klass, args, kwargs, state = torch.load(self.model_path)
-            self.demucs = klass(*args, **kwargs)
-            self.demucs.to(self.device)
-            self.demucs.load_state_dict(state)
-        elif self.demucs_version == DEMUCS_V2:
-            self.demucs = auto_load_demucs_model_v2(self.demucs_source_list, self.model_path)
-            self.demucs.to(self.device)
-            self.demucs.load_state_dict(torch.load(self.model_path))
-            self.demucs.eval()
-        else:
-            self.demucs = HDemucs(sources=self.demucs_source_list)
-            self.demucs = _gm(
-                name=os.path.splitext(os.path.basename(self.model_path))[0],
-                repo=Path(os.path.dirname(self.model_path)),
-            )
-            self.demucs.to(self.device)
-            self.demucs.eval()
         primary_stem_path = os.path.join(self.export_path, f"vocals.wav")
         secondary_stem_path = os.path.join(self.export_path, f"no_vocals.wav")
 
         self.running_inference_console_write(is_no_write=is_no_write)
-        mix, raw_mix, samplerate = prepare_mix(self.audio_file, self.chunks_demucs, self.margin_demucs)
+        mix, raw_mix, samplerate = prepare_mix(
+            self.audio_file, self.chunks_demucs, self.margin_demucs, audio_cache=self.audio_cache
+        )
 
-        source = self.demix_demucs(mix)
+        with self.use_model() as self.demucs:
+            source = self.demix_demucs(mix)
         source: np.array = self.run_mixer(raw_mix, source)
 
-        del self.demucs
+        self.demucs = None
         torch.cuda.empty_cache()
 
         if isinstance(source, np.ndarray):
@@ -468,6 +508,7 @@ class SeparateDemucs(SeparateAttributes):
         set_progress_bar = None if self.is_chunk_demucs else self.set_progress_bar
 
         for nmix in mix:
+            raise_if_cancelled(self.cancel_token)
             self.progress_value += 1
             self.set_progress_bar(0.1, (0.8 / len(mix) * self.progress_value)) if self.is_chunk_demucs else None
             cmix = mix[nmix]
@@ -484,6 +525,7 @@ class SeparateDemucs(SeparateAttributes):
                         self.shifts,
                         self.is_split_mode,
                         set_progress_bar=set_progress_bar,
+                        cancel_token=self.cancel_token,
                     )
                 elif self.demucs_version == DEMUCS_V2:
                     sources = apply_model_v2(
@@ -493,6 +535,7 @@ class SeparateDemucs(SeparateAttributes):
                         self.is_split_mode,
                         self.overlap,
                         set_progress_bar=set_progress_bar,
+                        cancel_token=self.cancel_token,
                     )
                 else:
                     sources = apply_model(
@@ -504,6 +547,7 @@ class SeparateDemucs(SeparateAttributes):
                         static_shifts=1 if self.shifts == 0 else self.shifts,
                         set_progress_bar=set_progress_bar,
                         device=self.device,
+                        cancel_token=self.cancel_token,
                     )[0]
 
             sources = (sources * ref.std() + ref.mean()).cpu().numpy()
@@ -523,30 +567,39 @@ class SeparateVR(SeparateAttributes):
     model_run = None
     input_high_end = None
 
-    def separate(self):
-        device = torch.device(config.device)
-
+    def load_model(self, device):
         nn_arch_sizes = [31191, 33966, 56817, 123821, 123812, 129605, 218409, 537238, 537227]  # default
         vr_5_1_models = [56817, 218409]
         model_size = math.ceil(os.stat(self.model_path).st_size / 1024)
         nn_arch_size = min(nn_arch_sizes, key=lambda x: abs(x - model_size))
 
         if nn_arch_size in vr_5_1_models:
-            self.model_run = nets_new.CascadedNet(
+            model_run = nets_new.CascadedNet(
                 self.mp.param["bins"] * 2,
                 nn_arch_size,
                 nout=self.model_capacity[0],
                 nout_lstm=self.model_capacity[1],
             )
         else:
-            self.model_run = nets.determine_model_capacity(self.mp.param["bins"] * 2, nn_arch_size)
+            model_run = nets.determine_model_capacity(self.mp.param["bins"] * 2, nn_arch_size)
+
+        model_run.load_state_dict(torch.load(self.model_path, map_location=device))
+        model_run.to(device)
+        return model_run
+
+    def use_model(self):
+        """The pooled model for this separator, held for the duration of the block."""
+        device = torch.device(config.device)
+        return model_pool.use("vr", self.model_path, lambda: self.load_model(device), device=str(device))
 
-        self.model_run.load_state_dict(torch.load(self.model_path, map_location=device))
-        self.model_run.to(device)
+    def separate(self):
+        device = torch.device(config.device)
 
         self.running_inference_console_write()
 
-        y_spec, v_spec = self.inference_vr(self.loading_mix(), device, self.aggressiveness)
+        with self.use_model() as self.model_run:
+            y_spec, v_spec = self.inference_vr(self.loading_mix(), device, self.aggressiveness)
+        self.model_run = None
 
         primary_stem_path = os.path.join(self.export_path, f"vocals.wav")
         secondary_stem_path = os.path.join(self.export_path, f"no_vocals.wav")
@@ -591,10 +644,18 @@ class SeparateVR(SeparateAttributes):
                 wav_resolution = bp["res_type"]
 
             if d == bands_n:  # high-end band
-                X_wave[d], _ = librosa.load(self.audio_file, bp["sr"], False, dtype=np.float32, res_type=wav_resolution)
-
-                if not np.any(X_wave[d]) and self.audio_file.endswith(".mp3"):
-                    X_wave[d] = rerun_mp3(self.audio_file, bp["sr"])
+                if self.audio_cache is not None:
+                    # the cache serves read-only maps and views; the bands are processed in place
+                    X_wave[d] = np.array(
+                        self.audio_cache.get(self.audio_file, bp["sr"], res_type=wav_resolution), order="C"
+                    )
+                else:
+                    X_wave[d], _ = librosa.load(
+                        self.audio_file, bp["sr"], False, dtype=np.float32, res_type=wav_resolution
+                    )
+                    # ffmpeg decodes the cache's mp3s, only librosa needs this retry
+                    if not np.any(X_wave[d]) and self.audio_file.endswith(".mp3"):
+                        X_wave[d] = rerun_mp3(self.audio_file, bp["sr"])
 
                 if X_wave[d].ndim == 1:
                     X_wave[d] = np.asarray([X_wave[d], X_wave[d]])
@@ -639,6 +700,7 @@ class SeparateVR(SeparateAttributes):
             with torch.no_grad():
                 mask = []
                 for i in range(0, patches, self.batch_size):
+                    raise_if_cancelled(self.cancel_token)
                     self.progress_value += 1
                     if self.progress_value >= total_iterations:
                         self.progress_value = total_iterations
@@ -718,11 +780,13 @@ def gather_sources(primary_stem_name, secondary_stem_name, secondary_sources: di
     return source_primary, source_secondary
 
 
-def prepare_mix(mix, chunk_set, margin_set, mdx_net_cut=False, is_missing_mix=False):
+def prepare_mix(mix, chunk_set, margin_set, mdx_net_cut=False, is_missing_mix=False, audio_cache=None):
     audio_path = mix
     samplerate = 44100
 
-    if not isinstance(mix, np.ndarray):
+    if not isinstance(mix, np.ndarray) and audio_cache is not None:
+        mix = audio_cache.get(mix, samplerate)
+    elif not isinstance(mix, np.ndarray):
         mix, samplerate = librosa.load(mix, mono=False, sr=44100)
     else:
         mix = mix.T
@@ -773,16 +837,27 @@ def rerun_mp3(audio_file, sample_rate=44100):
     return librosa.load(audio_file, duration=track_length, mono=False, sr=sample_rate)[0]
 
 
-def save_format(audio_path, output_format, mp3_bit_set):
-    file = pydub.AudioSegment.from_wav(audio_path)
-
+def save_format(audio_path, output_format, mp3_bit_set, audio=None, samplerate=None, write_preview=None):
+    """Write the other formats of a stem just written to audio_path, from its (channels, samples) audio if given,
+    in one ffmpeg run rather than reading the wav back."""
+    outputs = {}
     if output_format == FLAC:
-        audio_path_flac = audio_path.replace(".wav", ".flac")
-        file.export(audio_path_flac, format="flac")
+        outputs[audio_path.replace(".wav", ".flac")] = {"format": "flac"}
 
     if output_format == MP3:
-        audio_path_mp3 = audio_path.replace(".wav", ".mp3")
-        file.export(audio_path_mp3, format="mp3", bitrate=mp3_bit_set)
+        outputs[audio_path.replace(".wav", ".mp3")] = {
+            "format": "mp3",
+            "acodec": "libmp3lame",
+            "audio_bitrate": mp3_bit_set,
+        }
     # we want to always write a preview mp3 file for the user
-    audio_path_mp3 = audio_path.replace(".wav", "_preview.mp3")
-    file.export(audio_path_mp3, format="mp3", bitrate="192k")
+    if write_preview is not None and audio is not None:
+        write_preview(audio_path, audio, samplerate)
+    else:
+        outputs[audio_path.replace(".wav", "_preview.mp3")] = ENCODER_OPTIONS["mp3_192k"]
+    if not outputs:
+        return
+    if audio is not None:
+        encode_audio(audio, samplerate, outputs)
+    else:
+        transcode(audio_path, outputs)
@@ -1,10 +1,11 @@
 import logging
 import os
 import traceback
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from functools import lru_cache
 from threading import Lock
 from time import time as ttime
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import faiss
 import librosa
@@ -18,8 +19,11 @@ from faiss import IndexIVFFlat
 from scipy import signal
 from torch import Tensor
 
+from inference.cancel import PROCESS_POLL_SECONDS, CancelToken, raise_if_cancelled
 from inference.config import Config
+from inference.retrieval import DEFAULT_BACKEND, DEFAULT_NPROBE, INDEX_BACKEND, FeatureRetriever
 from inference.rmvpe import model_rmvpe
+from inference.segmenter import split_points
 
 bh, ah = signal.butter(N=5, Wn=48, btype="high", fs=16000)
 
@@ -52,6 +56,70 @@ def cache_harvest_f0(input_audio_path: str, fs: int, f0max: float, f0min: float,
     return f0
 
 
+# (audio, pitch, pitchf) of a part of the vocals, pitch and pitchf are None for models without f0
+Segment = Tuple[np.ndarray, Optional[Tensor], Optional[Tensor]]
+
+# a batch only takes segments up to this much longer than its shortest, so little attention is spent on padding
+BUCKET_SLACK = 1.35
+
+
+def bucket_segments(lengths: List[int], batch_size: int, slack: float = BUCKET_SLACK) -> List[List[int]]:
+    """Group segment indices into batches of at most batch_size segments of about the same length."""
+    batches: List[List[int]] = []
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        if batches and len(batches[-1]) < batch_size and lengths[i] <= lengths[batches[-1][0]] * slack:
+            batches[-1].append(i)
+        else:
+            batches.append([i])
+    return batches
+
+
+def index_vectors_path(file_index: str) -> str:
+    """The sidecar the vectors of the index are saved in, so later loads map them instead of reconstructing them."""
+    return f"{file_index}.vectors.npy"
+
+
+def load_index_vectors(index: IndexIVFFlat, file_index: str) -> np.ndarray:
+    """The vectors of the index, memory-mapped from their sidecar, which is written on first use."""
+    vectors_path = index_vectors_path(file_index)
+    try:
+        if os.path.getmtime(vectors_path) >= os.path.getmtime(file_index):
+            big_npy = np.load(vectors_path, mmap_mode="r")
+            if big_npy.shape == (index.ntotal, index.d):
+                return big_npy
+    except (OSError, ValueError):
+        pass
+    big_npy = index.reconstruct_n(0, index.ntotal)
+    partial_path = f"{vectors_path}.partial"
+    try:
+        with open(partial_path, "wb") as f:
+            np.save(f, big_npy)
+        os.replace(partial_path, vectors_path)
+    except OSError as e:
+        # a read-only models directory only costs the reconstruction on every load
+        logger.info(f"Could not save the vectors of {file_index}: {e}")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        return big_npy
+    return np.load(vectors_path, mmap_mode="r")
+
+
+def load_index(file_index: str):
+    """Read a faiss index and its vectors. Returns (None, None) if it can't be used."""
+    try:
+        index: Optional[IndexIVFFlat] = faiss.read_index(file_index)
+        if index.ntotal == 0:
+            return None, None
+        big_npy = load_index_vectors(index, file_index)
+        if big_npy is None or big_npy.size == 0:
+            return None, None
+        return index, big_npy
+    except Exception as e:
+        logger.error(e)
+        traceback.print_exc()
+        return None, None
+
+
 def change_rms(data1, sr1, data2, sr2, rate):  # 1是输入音频，2是输出音频,rate是2的占比
     rms1 = librosa.feature.rms(y=data1, frame_length=sr1 // 2 * 2, hop_length=sr1 // 2)  # 每半秒一个点
     rms2 = librosa.feature.rms(y=data2, frame_length=sr2 // 2 * 2, hop_length=sr2 // 2)
@@ -90,6 +158,8 @@ class VC:
 
         # Device configuration
         self.device = config.device
+        # Segments converted together
+        self.batch_size = config.vc_batch_size
 
     def get_optimal_torch_device(self, index: int = 0) -> torch.device:
         return torch.device(self.device)
@@ -183,6 +253,7 @@ class VC:
         filter_radius,
         crepe_hop_length,
         inp_f0=None,
+        rmvpe_model=None,
     ):
         # Construct cache file name
         cache_suffix = f"_{f0_method}_{filter_radius}_{crepe_hop_length}_{f0_up_key}.npy"
@@ -210,6 +281,7 @@ class VC:
             filter_radius,
             crepe_hop_length,
             inp_f0,
+            rmvpe_model,
         )
         np.save(cache_path, f0)
         return f0
@@ -224,7 +296,10 @@ class VC:
         filter_radius,
         crepe_hop_length,
         inp_f0=None,
+        rmvpe_model=None,
     ):
+        """rmvpe_model is the pinned model the job holds, rather than whatever model_rmvpe points at by the time
+        this runs."""
         global input_audio_path2wav
         time_step = self.window / self.sr * 1000
         f0_min = 50
@@ -259,9 +334,9 @@ class VC:
         elif f0_method == "mangio-crepe-tiny":
             f0 = self.get_f0_crepe_computation(x, f0_min, f0_max, p_len, crepe_hop_length, "tiny")
         elif f0_method == "rmvpe":
-            f0 = model_rmvpe.infer_from_audio(input_audio_path, x, thred=0.03)
+            f0 = model_rmvpe.infer_from_audio(input_audio_path, x, thred=0.03, model=rmvpe_model)
         else:  # fallback to using rmvpe
-            f0 = model_rmvpe.infer_from_audio(input_audio_path, x, thred=0.03)
+            f0 = model_rmvpe.infer_from_audio(input_audio_path, x, thred=0.03, model=rmvpe_model)
         f0 *= pow(2, f0_up_key / 12)
         tf0 = self.sr // self.window
         if inp_f0 is not None:
@@ -282,74 +357,146 @@ class VC:
 
         return f0_coarse, f0bak  # 1-0
 
-    def vc(
+    def extract_pitch(
+        self,
+        input_audio_path,
+        audio_pad,
+        p_len,
+        f0_up_key,
+        f0_method,
+        filter_radius,
+        crepe_hop_length,
+        times=None,
+        cancel_token: Optional[CancelToken] = None,
+        rmvpe_model=None,
+    ) -> Tuple[Tensor, Tensor]:
+        """Coarse and fine pitch of the padded track, as (1, frames) tensors."""
+        raise_if_cancelled(cancel_token)
+        t0 = ttime()
+        pitch, pitchf = self.get_f0_cached(
+            input_audio_path,
+            audio_pad,
+            p_len,
+            f0_up_key,
+            f0_method,
+            filter_radius,
+            crepe_hop_length,
+            rmvpe_model=rmvpe_model,
+        )
+        raise_if_cancelled(cancel_token)
+        pitch = pitch[:p_len]
+        pitchf = pitchf[:p_len]
+        if self.device == "mps":
+            pitchf = pitchf.astype(np.float32)
+            pitch = pitch.astype(np.float32)
+        pitch = torch.tensor(pitch, device=self.device).unsqueeze(0).long()
+        pitchf = torch.tensor(pitchf, device=self.device).unsqueeze(0).float()
+        if times is not None:
+            times[1] += ttime() - t0
+        return pitch, pitchf
+
+    def extract_features(self, hubert, segments: List[Segment], version) -> List[Tensor]:
+        """Hubert features, (frames, channels), of each segment's audio.
+
+        The convolutional front end normalizes over the whole input, so it runs on each segment alone; only the
+        transformer, which masks padding out of attention, runs on the batch. The features are the ones each segment
+        would get on its own.
+        """
+        with PIPELINE_LOCK, torch.no_grad():
+            frames = []
+            for audio, _, _ in segments:
+                audio = torch.from_numpy(audio).to(self.device, dtype=torch.float32)
+                if audio.dim() == 2:  # double channels
+                    audio = audio.mean(-1)
+                assert audio.dim() == 1, audio.dim()
+                features = hubert.feature_extractor(audio.view(1, -1)).transpose(1, 2)
+                features = hubert.layer_norm(features)
+                if hubert.post_extract_proj is not None:
+                    features = hubert.post_extract_proj(features)
+                frames.append(features[0])
+            lengths = [f.shape[0] for f in frames]
+            x = frames[0].new_zeros((len(frames), max(lengths), frames[0].shape[1]))
+            padding_mask = torch.ones(x.shape[:2], dtype=torch.bool, device=x.device)
+            for i, f in enumerate(frames):
+                x[i, : lengths[i]] = f
+                padding_mask[i, : lengths[i]] = False
+            output_layer = 9 if version == "v1" else 12
+            feats, _ = hubert.encoder(x, padding_mask=padding_mask, layer=output_layer - 1)
+            if version == "v1":
+                feats = hubert.final_proj(feats)
+            del x, padding_mask, frames
+            return [feats[i, :n] for i, n in enumerate(lengths)]
+
+    @staticmethod
+    def retrieve_features(
+        feats: List[Tensor],
+        retriever: FeatureRetriever,
+        index_rate: float,
+        backend: INDEX_BACKEND = DEFAULT_BACKEND,
+        nprobe: int = DEFAULT_NPROBE,
+    ) -> List[Tensor]:
+        """Blend every frame of the segments' features with its nearest vectors in the index, in one search."""
+        npy = torch.cat(feats).cpu().numpy()
+        retrieved = torch.from_numpy(retriever.retrieve(npy, backend, nprobe))
+        blended = []
+        for segment_feats, segment_retrieved in zip(feats, retrieved.split([len(f) for f in feats])):
+            segment_retrieved = segment_retrieved.to(segment_feats.device, dtype=segment_feats.dtype)
+            blended.append(segment_retrieved * index_rate + (1 - index_rate) * segment_feats)
+        return blended
+
+    def synthesize(
         self,
-        hubert,
         net_g,
         sid,
-        audio0,
-        pitch,
-        pitchf,
-        index,
-        big_npy,
-        index_rate,
-        version,
+        segments: List[Segment],
+        feats: List[Tensor],
+        feats0: Optional[List[Tensor]],
         protect,
-    ):
+    ) -> List[np.ndarray]:
+        """Audio of each segment from its features, in one synthesizer pass. feats0, the features before retrieval,
+        are blended back into unvoiced frames to protect consonants."""
         with PIPELINE_LOCK:
-            feats: Tensor = torch.from_numpy(audio0).to(self.device, dtype=torch.float32)
-            if feats.dim() == 2:  # double channels
-                feats = feats.mean(-1)
-            assert feats.dim() == 1, feats.dim()
-            feats = feats.view(1, -1)
-            padding_mask = torch.BoolTensor(feats.shape).to(self.device).fill_(False)
-
-            inputs = {
-                "source": feats,
-                "padding_mask": padding_mask,
-                "output_layer": 9 if version == "v1" else 12,
-            }
-            with torch.no_grad():
-                logits = hubert.extract_features(**inputs)
-                feats = hubert.final_proj(logits[0]) if version == "v1" else logits[0]
-            if protect < 0.5 and pitch is not None and pitchf is not None:
-                feats0 = feats.clone()
-            if not isinstance(index, type(None)) and not isinstance(big_npy, type(None)) and index_rate != 0:
-                npy = feats[0].cpu().numpy()
-
-                score, ix = index.search(npy, k=8)
-                weight = np.square(1 / score)
-                weight /= weight.sum(axis=1, keepdims=True)
-                if ix != -1:
-                    npy = np.sum(big_npy[ix] * np.expand_dims(weight, axis=2), axis=1)
-                    feats = torch.from_numpy(npy).unsqueeze(0).to(self.device) * index_rate + (1 - index_rate) * feats
-
-            feats = F.interpolate(feats.permute(0, 2, 1), scale_factor=2).permute(0, 2, 1)
-            if protect < 0.5 and pitch is not None and pitchf is not None:
-                feats0 = F.interpolate(feats0.permute(0, 2, 1), scale_factor=2).permute(0, 2, 1)
-            p_len = audio0.shape[0] // self.window
-            if feats.shape[1] < p_len:
-                p_len = feats.shape[1]
-                if pitch is not None and pitchf is not None:
-                    pitch = pitch[:, :p_len]
-                    pitchf = pitchf[:, :p_len]
-
-            if protect < 0.5 and pitch is not None and pitchf is not None:
+            has_pitch = segments[0][1] is not None and segments[0][2] is not None
+            # features are upsampled to the 10ms frames of the pitch
+            p_lens = [min(audio.shape[0] // self.window, 2 * f.shape[0]) for (audio, _, _), f in zip(segments, feats)]
+            if has_pitch:
+                p_lens = [min(p_len, p.shape[1]) for p_len, (_, p, _) in zip(p_lens, segments)]
+            max_len = max(p_lens)
+
+            def padded(frames: List[Tensor]) -> Tensor:
+                batch = frames[0].new_zeros((len(frames), max_len, frames[0].shape[1]))
+                for i, (f, p_len) in enumerate(zip(frames, p_lens)):
+                    batch[i, :p_len] = f.repeat_interleave(2, dim=0)[:p_len]
+                return batch
+
+            x = padded(feats)
+            pitch = pitchf = None
+            if has_pitch:
+                pitch = torch.zeros((len(segments), max_len), dtype=torch.long, device=self.device)
+                pitchf = torch.zeros((len(segments), max_len), dtype=torch.float32, device=self.device)
+                for i, (p_len, (_, p, pf)) in enumerate(zip(p_lens, segments)):
+                    pitch[i, :p_len] = p[0, :p_len]
+                    pitchf[i, :p_len] = pf[0, :p_len]
+
+            if protect < 0.5 and has_pitch and feats0 is not None:
                 pitchff = pitchf.clone()
                 pitchff[pitchf > 0] = 1
                 pitchff[pitchf < 1] = protect
                 pitchff = pitchff.unsqueeze(-1)
-                feats = feats * pitchff + feats0 * (1 - pitchff)
-                feats = feats.to(feats0.dtype)
-            p_len = torch.tensor([p_len], device=self.device).long()
+                x0 = padded(feats0)
+                x = (x * pitchff + x0 * (1 - pitchff)).to(x0.dtype)
+            p_len = torch.tensor(p_lens, device=self.device).long()
+            sids = sid.expand(len(segments))
             with torch.no_grad():
-                if pitch is not None and pitchf is not None:
-                    infer = net_g.infer(feats, p_len, pitch, pitchf, sid)
+                if has_pitch:
+                    infer = net_g.infer(x, p_len, pitch, pitchf, sids)
                 else:
-                    infer = net_g.infer(feats, p_len, sid)
-                infer_data = infer[0][0, 0]
-                audio1 = infer_data.data.cpu().float().numpy()
-            del feats, p_len, padding_mask
+                    infer = net_g.infer(x, p_len, sids)
+                infer_data = infer[0][:, 0]
+                # output samples per frame
+                upsample = infer_data.shape[-1] // max_len
+                audio1 = [infer_data[i, : n * upsample].data.cpu().float().numpy() for i, n in enumerate(p_lens)]
+            del x, p_len
             if torch.cuda.is_available():
                 torch.cuda.empty_cache()
             return audio1
@@ -375,52 +522,50 @@ class VC:
         protect,
         crepe_hop_length,
         status_report,
+        retriever: Optional[FeatureRetriever] = None,
+        cancel_token: Optional[CancelToken] = None,
+        index_backend: INDEX_BACKEND = DEFAULT_BACKEND,
+        index_nprobe: int = DEFAULT_NPROBE,
+        rmvpe_model=None,
     ):
-        index = big_npy = None
-        if file_index and os.path.exists(file_index) and index_rate > 0:
-            try:
-                status_report("Loading index...")
-                index: Optional[IndexIVFFlat] = faiss.read_index(file_index)
-                big_npy = index.reconstruct_n(0, index.ntotal)
-                if not big_npy or big_npy.size == 0:
-                    index = big_npy = None
-            except Exception as e:
-                logger.error(e)
-                traceback.print_exc()
-                index = big_npy = None
+        if retriever is None and file_index and os.path.exists(file_index) and index_rate > 0:
+            status_report("Loading index...")
+            index, big_npy = load_index(file_index)
+            if index is not None:
+                retriever = FeatureRetriever(index, big_npy, file_index)
 
         status_report("Loading audio...")
         audio = signal.filtfilt(bh, ah, audio)
-        audio_pad = np.pad(audio, (self.window // 2, self.window // 2), mode="reflect")
         opt_ts = []
         status_report("Processing audio...")
-        if audio_pad.shape[0] > self.t_max:
-            audio_sum = np.zeros_like(audio)
-            for i in range(self.window):
-                audio_sum += audio_pad[i : i - self.window]
-            for t in range(self.t_center, audio.shape[0], self.t_center):
-                opt_ts.append(
-                    t
-                    - self.t_query
-                    + np.where(
-                        np.abs(audio_sum[t - self.t_query : t + self.t_query])
-                        == np.abs(audio_sum[t - self.t_query : t + self.t_query]).min()
-                    )[0][0]
-                )
-        s = 0
-        audio_opt = []
-        audio_opt_parts = []
-        t = None
-        t1 = ttime()
+        t0 = ttime()
+        if audio.shape[0] + self.window // 2 * 2 > self.t_max:
+            opt_ts = split_points(audio, self.window, self.t_center, self.t_query)
+        times[3] += ttime() - t0
         audio_pad = np.pad(audio, (self.t_pad, self.t_pad), mode="reflect")
         p_len = audio_pad.shape[0] // self.window
+        # (first sample, end sample, first pitch frame, end pitch frame) of each segment, the last runs to the end
+        bounds = []
+        s = 0
+        for t in opt_ts:
+            t = t // self.window * self.window
+            bounds.append((s, t + self.t_pad2 + self.window, s // self.window, (t + self.t_pad2) // self.window))
+            s = t
+        bounds.append((s, None, s // self.window, None))
+        audios: List[Segment] = [(audio_pad[start:end], None, None) for start, end, _, _ in bounds]
+        batches = bucket_segments([audio0.shape[0] for audio0, _, _ in audios], self.batch_size)
 
         status_report("Getting speaker id...")
         sid = torch.tensor(sid, device=self.device).unsqueeze(0).long()
-        pitch, pitchf = None, None
+        # f0 and hubert features don't depend on each other: f0 runs on its own thread while hubert runs on this one.
+        # Both share torch's threads, whose count is process wide
+        f0_executor = ThreadPoolExecutor(1, thread_name_prefix="replay-f0")
+        f0_future: Optional[Future] = None
         if if_f0 == 1:
+            raise_if_cancelled(cancel_token)
             status_report("Getting f0...")
-            pitch, pitchf = self.get_f0_cached(
+            f0_future = f0_executor.submit(
+                self.extract_pitch,
                 input_audio_path,
                 audio_pad,
                 p_len,
@@ -428,60 +573,76 @@ class VC:
                 f0_method,
                 filter_radius,
                 crepe_hop_length,
+                times,
+                cancel_token,
+                rmvpe_model,
             )
-            pitch = pitch[:p_len]
-            pitchf = pitchf[:p_len]
-            if self.device == "mps":
-                pitchf = pitchf.astype(np.float32)
-                pitch = pitch.astype(np.float32)
-            status_report("Setting pitch...")
-            pitch = torch.tensor(pitch, device=self.device).unsqueeze(0).long()
-            pitchf = torch.tensor(pitchf, device=self.device).unsqueeze(0).float()
-        t2 = ttime()
-        times[1] += t2 - t1
-        status_report("Changing voice...")
-        for t in opt_ts:
-            t = t // self.window * self.window
-            p = None
-            pf = None
-            if if_f0 == 1:
-                p = pitch[:, s // self.window : (t + self.t_pad2) // self.window]
-                pf = pitchf[:, s // self.window : (t + self.t_pad2) // self.window]
-
-            audio_data = self.vc(
-                hubert_model,
-                net_g,
-                sid,
-                audio_pad[s : t + self.t_pad2 + self.window],
-                p,
-                pf,
-                index,
-                big_npy,
-                index_rate,
-                version,
-                protect,
-            )
-            audio_opt.append(audio_data[self.t_pad_tgt : -self.t_pad_tgt])
-            s = t
-        p = None
-        pf = None
-        if if_f0 == 1:
-            p = pitch[:, t // self.window :] if t is not None else pitch
-            pf = pitchf[:, t // self.window :] if t is not None else pitchf
-        audio_data = self.vc(
-            hubert_model,
-            net_g,
-            sid,
-            audio_pad[t:],
-            p,
-            pf,
-            index,
-            big_npy,
-            index_rate,
-            version,
-            protect,
-        )
-        audio_opt.append(audio_data[self.t_pad_tgt : -self.t_pad_tgt])
+        pitch, pitchf = None, None
+        retrieving = retriever is not None and index_rate != 0
+        feats: List[Optional[Tensor]] = [None] * len(bounds)
+        feats0 = None
+        audio_opt = [None] * len(bounds)
+        synthesized = 0
+
+        def synthesize_ready(count: int):
+            """Synthesize the batches up to count, whose features are ready, once the pitch is."""
+            nonlocal pitch, pitchf, synthesized
+            if synthesized >= count:
+                return
+            if f0_future is not None and pitch is None:
+                while not wait([f0_future], timeout=PROCESS_POLL_SECONDS).done:
+                    raise_if_cancelled(cancel_token)
+                pitch, pitchf = f0_future.result()
+            for batch in batches[synthesized:count]:
+                raise_if_cancelled(cancel_token)
+                t0 = ttime()
+                segments = []
+                for i in batch:
+                    first, last = bounds[i][2:]
+                    p = pitch[:, first:last] if pitch is not None else None
+                    pf = pitchf[:, first:last] if pitchf is not None else None
+                    segments.append((audios[i][0], p, pf))
+                converted = self.synthesize(
+                    net_g,
+                    sid,
+                    segments,
+                    [feats[i] for i in batch],
+                    [feats0[i] for i in batch] if feats0 is not None else None,
+                    protect,
+                )
+                for i, audio_data in zip(batch, converted):
+                    audio_opt[i] = audio_data[self.t_pad_tgt : -self.t_pad_tgt]
+                    # done with, the features of the rest of the track may still be coming
+                    feats[i] = None
+                times[2] += ttime() - t0
+                synthesized += 1
+
+        try:
+            status_report("Changing voice...")
+            for done, batch in enumerate(batches, 1):
+                raise_if_cancelled(cancel_token)
+                t0 = ttime()
+                extracted = self.extract_features(hubert_model, [audios[i] for i in batch], version)
+                for i, segment_feats in zip(batch, extracted):
+                    feats[i] = segment_feats
+                times[0] += ttime() - t0
+                if not retrieving and (f0_future is None or f0_future.done()):
+                    # with the pitch in, the synthesizer takes batches as hubert finishes them
+                    synthesize_ready(done)
+            if retrieving:
+                raise_if_cancelled(cancel_token)
+                t0 = ttime()
+                # the whole track in one search, and consonants are protected with the features from before it
+                feats0 = list(feats) if protect < 0.5 and if_f0 == 1 else None
+                feats = self.retrieve_features(feats, retriever, index_rate, index_backend, index_nprobe)
+                # hubert features and index retrieval
+                times[0] += ttime() - t0
+            synthesize_ready(len(batches))
+        finally:
+            # the caller unpins the f0 model once we return, so f0 must be done with it by then. A stopped job
+            # waits for the f0 method running, if any: the token is set, and the thread stops as it returns
+            f0_executor.shutdown(wait=True, cancel_futures=True)
+        feats = feats0 = None
         audio_opt = np.concatenate(audio_opt)
         if rms_mix_rate != 1:
             audio_opt = change_rms(audio, 16000, audio_opt, tgt_sr, rms_mix_rate)
@@ -493,7 +654,8 @@ class VC:
         if audio_max > 1:
             max_int16 /= audio_max
         audio_opt = (audio_opt * max_int16).astype(np.int16)
-        del pitch, pitchf, sid
+        # the batch closure still refers to them, drop the tensors rather than the names
+        pitch = pitchf = sid = None
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
         return audio_opt
@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from inference.api_models import WarmupModelStatus, WarmupResp
+
+logger = logging.getLogger(__name__)
+
+HUBERT = "hubert"
+RMVPE = "rmvpe"
+DEFAULT_PRELOAD_MODELS = [HUBERT, RMVPE, "UVR-MDX-NET Voc FT"]
+
+
+def load_hubert(weights_path: str):
+    from inference.hubert import hubert_model
+
+    with hubert_model.use(weights_path):
+        pass
+
+
+def load_rmvpe(weights_path: str):
+    from inference.rmvpe import model_rmvpe
+
+    with model_rmvpe.use(weights_path):
+        pass
+
+
+def load_stemming_model(weights_path: str, model_name: str):
+    from inference.stemmer import Stemmer
+
+    Stemmer.preload(weights_path, model_name)
+
+
+def get_loader(model_name: str) -> Callable[[str], None]:
+    """Anything that isn't hubert or rmvpe is taken to be the name of a stemming model."""
+    if model_name == HUBERT:
+        return load_hubert
+    if model_name == RMVPE:
+        return load_rmvpe
+    return lambda weights_path: load_stemming_model(weights_path, model_name)
+
+
+def preload(model_name: str, weights_path: str):
+    get_loader(model_name)(weights_path)
+
+
+class Warmup:
+    """Preloads models into the model pool on a background thread and records how long each one took."""
+
+    def __init__(self, load: Callable[[str, str], None] = preload):
+        # swapped for the worker pool's preload when jobs run in worker processes
+        self.load = load
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.weights_path: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.models: Dict[str, WarmupModelStatus] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, weights_path: str, models: List[str]) -> bool:
+        """Start warming up the given models. Returns False if a warm-up is already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self.weights_path = weights_path
+            self.started_at = time.time()
+            self.finished_at = None
+            self.models = {name: WarmupModelStatus(name=name) for name in models}
+            self._thread = threading.Thread(target=self._run, name="replay-warmup", daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self):
+        for name, model_status in list(self.models.items()):
+            model_status.status = "loading"
+            start = time.time()
+            try:
+                self.load(name, self.weights_path)
+                model_status.status = "ready"
+            except Exception as e:
+                logger.error(f"Warm-up: failed to load {name}: {e}")
+                model_status.status = "errored"
+                model_status.error = str(e)
+            model_status.loadSeconds = time.time() - start
+            logger.info(f"Warm-up: {name} {model_status.status} in {model_status.loadSeconds:.2f}s")
+        self.finished_at = time.time()
+
+    def status(self) -> WarmupResp:
+        with self._lock:
+            models = [model.model_copy() for model in self.models.values()]
+            if self.started_at is None:
+                status = "idle"
+            elif self.running:
+                status = "warming"
+            elif any(model.status == "errored" for model in models):
+                status = "errored"
+            else:
+                status = "ready"
+            elapsed = None
+            if self.started_at is not None:
+                elapsed = (self.finished_at or time.time()) - self.started_at
+        return WarmupResp(status=status, weightsPath=self.weights_path, elapsedSeconds=elapsed, models=models)
+
+    @property
+    def ready(self) -> bool:
+        """No warm-up is loading models: none was asked for, or it is over. A model it failed to load is loaded by
+        the first job that needs it, so waiting longer wouldn't help."""
+        return self.status().status != "warming"
+
+
+warmup = Warmup()
@@ -0,0 +1,343 @@
+import logging
+import multiprocessing
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from inference import metrics
+from inference.api_models import CreateSongReq, JobProgressResp
+from inference.config import config
+from inference.cancel import CancelToken, JobCancelled
+from inference.scheduler import JobScheduler
+
+logger = logging.getLogger(__name__)
+
+# seconds to wait for a worker to exit on its own before killing it
+WORKER_EXIT_TIMEOUT = 5
+# seconds a stopped job gets to give up at the next chunk before its worker (and its warm models) is killed
+CANCEL_GRACE_SECONDS = 10
+
+
+class RemoteScheduler:
+    """The worker side of the server's JobScheduler: stage slots are asked for over the pipe, so one scheduler
+    orders the stages of every job, whichever process it runs in."""
+
+    def __init__(self, conn, send: Callable[[tuple], None]):
+        self.conn = conn
+        self.send = send
+
+    @contextmanager
+    def stage(self, name: str, priority: Optional[float] = None, cancel_token: Optional[CancelToken] = None):
+        self.send(("acquire", name, priority))
+        # the job runs on the thread that reads the pipe, and nothing else is sent to us while a job runs
+        if self.conn.recv() != "granted":
+            raise JobCancelled()
+        try:
+            yield
+        finally:
+            self.send(("release", name, None))
+
+    @contextmanager
+    def exclusive(self, key: str, cancel_token: Optional[CancelToken] = None):
+        self.send(("lock", key, None))
+        if self.conn.recv() != "granted":
+            raise JobCancelled()
+        try:
+            yield
+        finally:
+            self.send(("unlock", key, None))
+
+
+class WorkerExited(Exception):
+    """The worker process running a job went away, either because the job was cancelled or because it crashed."""
+
+    def __init__(self, exitcode: Optional[int], cancelled: bool):
+        super().__init__(f"Worker process exited with code {exitcode}")
+        self.exitcode = exitcode
+        self.cancelled = cancelled
+
+
+def worker_main(
+    conn,
+    cancel_event,
+    ram_budget_bytes: int,
+    vram_budget_bytes: int,
+    budget_share: float,
+    throughput_db_path: str,
+    artifact_quota_bytes: int,
+    hashes_db_path: str,
+):
+    """Entry point of a worker process: runs one job at a time and reports progress back over the pipe.
+
+    Messages from the server are ("song", body, job_id, device), ("preload", model_name, weights_path, device) or
+    None to exit; the device follows the server's /set_device, or is detected here if it was never set. While a job
+    runs, replies are ("progress", job_id, JobProgressResp), ("metric", None, observation) and ("acquire", stage,
+    priority), answered with "granted" or "cancelled", then ("release", stage, None); ("lock", key, None) and
+    ("unlock", key, None) work the same way for JobScheduler.exclusive. The last reply is ("done", None, error or
+    None).
+    """
+    import monkey_patch_init  # noqa: F401 logging and subprocess patches, as in the server process
+    from inference.artifact_store import artifact_stores
+    from inference.hashing import file_hashes
+    from inference.inference_manager import InferenceManager
+    from inference.job_timing import throughput_history
+    from inference.model_pool import model_pool
+    from inference.warmup import preload
+
+    model_pool.configure(
+        ram_budget_bytes=ram_budget_bytes, vram_budget_bytes=vram_budget_bytes, budget_share=budget_share
+    )
+    throughput_history.configure(throughput_db_path)
+    artifact_stores.configure(artifact_quota_bytes)
+    file_hashes.configure(hashes_db_path)
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    scheduler = RemoteScheduler(conn, send)
+
+    # metrics are served by the server process, so observations made here are sent to it
+    metrics.registry.forward = lambda observation: send(("metric", None, observation))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        kind, arg, extra, config.requested_device = message
+        error = None
+        try:
+            if kind == "song":
+                body: CreateSongReq = arg
+                job_id: str = extra
+
+                def set_status(progress: JobProgressResp):
+                    send(("progress", job_id, progress))
+
+                InferenceManager(
+                    body.modelId,
+                    body.modelPath,
+                    body.weightsPath,
+                    body.songUrlOrFilePath,
+                    body.outputDirectory,
+                    options=body.options,
+                    job_id=job_id,
+                    set_status=set_status,
+                    check_stop_job=cancel_event.is_set,
+                    scheduler=scheduler,
+                ).infer()
+            elif kind == "preload":
+                preload(arg, extra)
+        except Exception as e:
+            logger.error(f"Worker: {kind} failed: {e}")
+            error = str(e)
+        send(("done", None, error))
+
+
+class Worker:
+    def __init__(self, ctx, index: int, args: tuple, scheduler: JobScheduler):
+        self.ctx = ctx
+        self.index = index
+        self.args = args
+        self.scheduler = scheduler
+        self.lock = threading.Lock()
+        self.cancel_event = ctx.Event()
+        self.job_id: Optional[str] = None
+        self.cancelled = False
+        self.process = None
+        self.conn = None
+        # stage slots and exclusive keys held on behalf of the current process, released if it dies holding them
+        self.held_stages: List[str] = []
+        self.held_keys: List[str] = []
+        self.start()
+
+    def start(self):
+        parent_conn, child_conn = self.ctx.Pipe()
+        self.process = self.ctx.Process(
+            target=worker_main,
+            args=(child_conn, self.cancel_event, *self.args),
+            name=f"replay-worker-{self.index}",
+            daemon=True,
+        )
+        self.process.start()
+        # only the child holds its end now, so we see EOF as soon as the process dies
+        child_conn.close()
+        self.conn = parent_conn
+        logger.info(f"Started worker {self.index} (pid {self.process.pid})")
+
+    def restart(self):
+        self.conn.close()
+        self.process.join(WORKER_EXIT_TIMEOUT)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.cancelled = False
+        self.start()
+
+    def call(self, kind: str, arg, extra, on_progress: Callable[[str, JobProgressResp], None] = None) -> Optional[str]:
+        """Send a message and block until the worker is done with it. Returns the worker's error, if any."""
+        if not self.process.is_alive():
+            logger.info(f"Worker {self.index} died while idle (exit code {self.process.exitcode}), restarting")
+            self.restart()
+        try:
+            # None unless /set_device was called, so the server never has to import torch to detect the device
+            self.conn.send((kind, arg, extra, config.requested_device))
+            while True:
+                kind, key, payload = self.conn.recv()
+                if kind == "done":
+                    return payload
+                if kind == "metric":
+                    metrics.registry.apply(payload)
+                elif kind == "acquire":
+                    self.acquire_stage(key, payload)
+                elif kind == "release":
+                    self.held_stages.remove(key)
+                    self.scheduler.release(key)
+                elif kind == "lock":
+                    self.lock_key(key)
+                elif kind == "unlock":
+                    self.held_keys.remove(key)
+                    self.scheduler.unlock(key)
+                elif on_progress:
+                    on_progress(key, payload)
+        except (EOFError, OSError):
+            self.process.join(WORKER_EXIT_TIMEOUT)
+            exitcode, cancelled = self.process.exitcode, self.cancelled
+            self.release_stages()
+            logger.info(f"Worker {self.index} exited with code {exitcode}, restarting")
+            self.restart()
+            raise WorkerExited(exitcode, cancelled)
+
+    def acquire_stage(self, name: str, priority: Optional[float]):
+        # a job stopped while it waits for a slot gives up the wait instead of the worker
+        if self.scheduler.acquire(name, priority, should_stop=self.cancel_event.is_set):
+            self.held_stages.append(name)
+            self.conn.send("granted")
+        else:
+            self.conn.send("cancelled")
+
+    def lock_key(self, key: str):
+        if self.scheduler.lock(key, should_stop=self.cancel_event.is_set):
+            self.held_keys.append(key)
+            self.conn.send("granted")
+        else:
+            self.conn.send("cancelled")
+
+    def release_stages(self):
+        for name in self.held_stages:
+            logger.info(f"Worker {self.index} died in the {name} stage, releasing its slot")
+            self.scheduler.release(name)
+        for key in self.held_keys:
+            self.scheduler.unlock(key)
+        self.held_stages = []
+        self.held_keys = []
+
+    def run_song(self, body: CreateSongReq, job_id: str, on_progress: Callable[[str, JobProgressResp], None]):
+        self.cancelled = False
+        self.cancel_event.clear()
+        self.job_id = job_id
+        try:
+            self.call("song", body, job_id, on_progress)
+        finally:
+            self.job_id = None
+
+    def cancel(self, job_id: str):
+        """Ask the job to stop at its next chunk, and kill the worker if it hasn't within the grace period."""
+        self.cancel_event.set()
+
+        def kill_if_still_running():
+            if self.job_id == job_id:
+                logger.info(f"Job {job_id} did not stop in {CANCEL_GRACE_SECONDS}s, killing worker {self.index}")
+                self.kill()
+
+        timer = threading.Timer(CANCEL_GRACE_SECONDS, kill_if_still_running)
+        timer.daemon = True
+        timer.start()
+
+    def kill(self):
+        self.cancelled = True
+        self.process.kill()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(WORKER_EXIT_TIMEOUT)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class WorkerPool:
+    """Long-lived worker processes that run jobs (and keep their models warm) outside the server process.
+
+    A stopped job gives up at its next chunk, or has its worker killed after a grace period, and a worker that
+    crashes only takes its own job down with it; a killed worker is respawned. Workers ask the server's scheduler
+    for stage slots, so its caps and ordering hold across processes.
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        scheduler: JobScheduler,
+        ram_budget_bytes: int,
+        vram_budget_bytes: int,
+        throughput_db_path: str = ":memory:",
+        artifact_quota_bytes: int = 0,
+        hashes_db_path: str = ":memory:",
+    ):
+        # spawn, not fork: torch/cuda and onnxruntime are not fork safe, and it is the only option when frozen
+        ctx = multiprocessing.get_context("spawn")
+        num_workers = max(1, num_workers)
+        # each worker keeps its own warm models, so they split the memory budget between them
+        args = (
+            ram_budget_bytes,
+            vram_budget_bytes,
+            1 / num_workers,
+            throughput_db_path,
+            artifact_quota_bytes,
+            hashes_db_path,
+        )
+        self.workers: List[Worker] = [Worker(ctx, index, args, scheduler) for index in range(num_workers)]
+        self._idle: "queue.Queue[Worker]" = queue.Queue()
+        for worker in self.workers:
+            self._idle.put(worker)
+
+    @contextmanager
+    def reserve(self):
+        """Hold a free worker for the duration of the block, e.g. to run every track of a batch on it."""
+        worker = self._idle.get()
+        try:
+            with worker.lock:
+                yield worker
+        finally:
+            self._idle.put(worker)
+
+    def cancel(self, job_id: str) -> bool:
+        """Stop the job running in a worker. A worker that has to be killed is respawned by the thread waiting on it."""
+        for worker in self.workers:
+            if worker.job_id == job_id:
+                logger.info(f"Stopping job {job_id} in worker {worker.index}")
+                worker.cancel(job_id)
+                return True
+        return False
+
+    def preload(self, model_name: str, weights_path: str):
+        """Load a model into every worker's model pool."""
+        errors: Dict[int, str] = {}
+        for worker in self.workers:
+            with worker.lock:
+                error = worker.call("preload", model_name, weights_path)
+            if error:
+                errors[worker.index] = error
+        if errors:
+            raise RuntimeError(next(iter(errors.values())))
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
@@ -0,0 +1,92 @@
+"""Report what importing a module costs, per imported module, using python's -X importtime.
+
+Run from the python directory, e.g.
+
+    python scripts/import_report.py                  # the server's app module
+    python scripts/import_report.py inference.inference_manager --top 40
+    python scripts/import_report.py --max-ms 1500    # exit 1 if importing app takes longer
+
+Heavy packages that the server process should not import at startup are flagged, so a stray top-level
+`import torch` in the API layer shows up here before it shows up as a slow /health.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# loaded lazily by the job workers, never by the API layer
+HEAVY_PACKAGES = ["torch", "torchaudio", "librosa", "numba", "fairseq", "onnxruntime", "demucs", "scipy", "faiss"]
+
+PYTHON_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def measure(module: str) -> Tuple[List[Tuple[str, int, int, int]], bool]:
+    """(module, self us, cumulative us, nesting depth) for everything the import pulls in, in import order, and
+    whether the import succeeded."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PYTHON_DIR,
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    if result.returncode:
+        print(result.stderr.splitlines()[-1] if result.stderr else f"import {module} failed", file=sys.stderr)
+    return rows, result.returncode == 0
+
+
+def top_level_costs(rows: List[Tuple[str, int, int, int]]) -> Dict[str, int]:
+    """Self time summed per top level package, e.g. all of torch.* under torch."""
+    costs: Dict[str, int] = {}
+    for name, self_us, _, _ in rows:
+        package = name.split(".")[0]
+        costs[package] = costs.get(package, 0) + self_us
+    return costs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("module", nargs="?", default="app", help="Module to import (default: app)")
+    parser.add_argument("--top", type=int, default=25, help="How many modules and packages to list")
+    parser.add_argument("--max-ms", type=float, default=None, help="Exit with 1 if the import takes longer")
+    args = parser.parse_args()
+
+    rows, ok = measure(args.module)
+    if not rows:
+        sys.exit(1)
+    if not ok:
+        print(f"import {args.module} failed part way, the numbers below only cover what was imported\n")
+    total_us = max(cumulative for _, _, cumulative, depth in rows if depth == 0)
+    print(f"import {args.module}: {total_us / 1000:.0f}ms, {len(rows)} modules\n")
+
+    print(f"{'cumulative ms':>13} {'self ms':>8}  module")
+    for name, self_us, cumulative_us, _ in sorted(rows, key=lambda row: row[2], reverse=True)[: args.top]:
+        print(f"{cumulative_us / 1000:13.1f} {self_us / 1000:8.1f}  {name}")
+
+    print(f"\n{'self ms':>13}  package")
+    costs = sorted(top_level_costs(rows).items(), key=lambda item: item[1], reverse=True)
+    for package, self_us in costs[: args.top]:
+        print(f"{self_us / 1000:13.1f}  {package}")
+
+    imported = {name.split(".")[0] for name, _, _, _ in rows}
+    heavy = [package for package in HEAVY_PACKAGES if package in imported]
+    if heavy:
+        print(f"\nHeavy packages imported: {', '.join(heavy)}")
+
+    if args.max_ms is not None and total_us / 1000 > args.max_ms:
+        print(f"\nimport {args.module} took longer than {args.max_ms:.0f}ms", file=sys.stderr)
+        sys.exit(1)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Compare the index search backends of voice conversion on a model's .index: recall against exact search and time.
+
+Run from the python directory, e.g.
+
+    python scripts/retrieval_benchmark.py path/to/added_IVF1024_Flat_nprobe_1_model_v2.index
+    python scripts/retrieval_benchmark.py model.index --features hubert_frames.npy --nprobe 1 4 16
+
+Queries are the rows of --features, a (frames, dims) .npy of hubert features, or else vectors of the index with
+noise added. Recall is the share of the exact k nearest neighbours a backend finds; the blend error is how far the
+retrieved features end up from the exactly retrieved ones, relative to their norm. Pick a backend and nprobe per
+model with the indexBackend and indexNprobe song options.
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+PYTHON_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, PYTHON_DIR)
+
+from inference.retrieval import SEARCH_K, FeatureRetriever  # noqa: E402
+from inference.vc_infer_pipeline import load_index  # noqa: E402
+
+
+def make_queries(big_npy: np.ndarray, count: int, noise: float, seed: int = 0) -> np.ndarray:
+    """Random vectors of the index moved by noise times the spread of the vectors, standing in for features."""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, big_npy.shape[0], count)
+    queries = np.asarray(big_npy[rows], dtype=np.float32)
+    return queries + rng.normal(0, noise * float(big_npy.std()), queries.shape).astype(np.float32)
+
+
+def recall(found: np.ndarray, expected: np.ndarray) -> float:
+    hits = sum(len(np.intersect1d(row, reference[reference >= 0])) for row, reference in zip(found, expected))
+    return hits / max(int((expected >= 0).sum()), 1)
+
+
+def timed(function, repeat: int) -> Tuple[object, float]:
+    """The result of function and its best wall time out of repeat calls."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("index", help="A model's .index file")
+    parser.add_argument("--features", default=None, help="(frames, dims) .npy of hubert features to search for")
+    parser.add_argument("--queries", type=int, default=15000, help="Frames to search for without --features")
+    parser.add_argument("--noise", type=float, default=0.5, help="Noise added to the generated queries")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64], help="ivf probes to try")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per backend, the best is reported")
+    args = parser.parse_args()
+
+    index, big_npy = load_index(args.index)
+    if index is None:
+        sys.exit(f"Could not load {args.index}")
+    retriever = FeatureRetriever(index, big_npy, args.index)
+    if args.features:
+        queries = np.ascontiguousarray(np.load(args.features), dtype=np.float32)
+    else:
+        queries = make_queries(big_npy, args.queries, args.noise)
+    print(f"{args.index}: {big_npy.shape[0]} vectors of {big_npy.shape[1]}, {queries.shape[0]} queries\n")
+
+    (_, exact_ids), exact_seconds = timed(lambda: retriever.search(queries, SEARCH_K, "exact"), args.repeat)
+    exact_features = retriever.retrieve(queries, "exact")
+    norm = float(np.linalg.norm(exact_features, axis=1).mean()) or 1.0
+
+    # the hnsw graph is built (or read from its sidecar) on first use, outside of the timing
+    build_start = time.perf_counter()
+    retriever.search(queries[:1], SEARCH_K, "hnsw")
+    hnsw_setup = time.perf_counter() - build_start
+
+    runs: List[Tuple[str, str, int]] = [("exact", "exact", 1)]
+    runs += [(f"ivf nprobe={nprobe}", "ivf", nprobe) for nprobe in args.nprobe]
+    runs.append(("hnsw", "hnsw", 1))
+    print(f"{'backend':<18} {'recall@' + str(SEARCH_K):>9} {'blend err':>10} {'search ms':>10} {'frames/s':>10}")
+    for name, backend, nprobe in runs:
+        if backend == "exact":
+            ids, seconds = exact_ids, exact_seconds
+        else:
+            (_, ids), seconds = timed(lambda: retriever.search(queries, SEARCH_K, backend, nprobe), args.repeat)
+        features = retriever.retrieve(queries, backend, nprobe)
+        error = float(np.linalg.norm(features - exact_features, axis=1).mean()) / norm
+        rate = queries.shape[0] / seconds if seconds else float("inf")
+        print(f"{name:<18} {recall(ids, exact_ids):9.3f} {error:10.4f} {seconds * 1000:10.1f} {rate:10.0f}")
+    print(f"\nhnsw index ready in {hnsw_setup:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,4 +7,73 @@ def get_server_arg_parser():
     parser = argparse.ArgumentParser("server", description="Python server for replay")
     parser.add_argument("-l", "--log-dir", default=tempfile.gettempdir(), help="Directory to store logs in")
     parser.add_argument("-p", "--parent-pid", default=os.getppid(), help="Parent process id to monitor")
+    parser.add_argument("--max-jobs", type=int, default=4, help="Maximum number of jobs running at once")
+    parser.add_argument(
+        "--cpu-slots", type=int, default=0, help="Concurrent cpu-bound stages (decode, download, encode). 0 = auto"
+    )
+    parser.add_argument(
+        "--device-slots",
+        type=int,
+        default=2,
+        help="Concurrent device-heavy stages (separation, rvc). 2 lets one job separate while another converts",
+    )
+    parser.add_argument(
+        "--stage-slots",
+        default="",
+        help="Per-stage caps on concurrent jobs, e.g. rvc=2, applied on top of the cpu/device slots. They override "
+        "the scheduler's default caps of the stages named, the others keep theirs. "
+        "Stages: download, decode, separation, rvc, encode",
+    )
+    parser.add_argument(
+        "--progress-updates-per-second",
+        type=float,
+        default=4,
+        help="Maximum rate at which /job_events pushes coalesced progress updates to a client",
+    )
+    parser.add_argument("--data-dir", default=None, help="Directory for the job database. Defaults to --log-dir")
+    parser.add_argument(
+        "--job-retention-hours", type=float, default=24, help="How long finished jobs are kept before eviction"
+    )
+    parser.add_argument(
+        "--model-ram-budget-mb",
+        type=int,
+        default=4096,
+        help="Memory that warm models on the cpu/mps may hold before the least recently used are unloaded",
+    )
+    parser.add_argument(
+        "--model-vram-budget-mb",
+        type=int,
+        default=0,
+        help="VRAM that warm models on cuda may hold before the least recently used are unloaded. 0 = 60%% of the card",
+    )
+    parser.add_argument(
+        "--artifact-quota-mb",
+        type=int,
+        default=20480,
+        help="Disk that cached stems, copies of originals and youtube downloads may take in each output directory "
+        "before the least recently used are deleted. 0 = unlimited",
+    )
+    parser.add_argument(
+        "--job-workers",
+        type=int,
+        default=0,
+        help="Worker processes that run jobs. 0 runs jobs in the server process with one set of warm models. Workers "
+        "run the stages of different jobs side by side, but each loads its own models, so only use them with the "
+        "ram/vram for that",
+    )
+    parser.add_argument(
+        "--weights-dir", default=None, help="Directory of the hubert/rmvpe/stemming weights to preload at startup"
+    )
+    parser.add_argument(
+        "--preload-models",
+        default="hubert,rmvpe,UVR-MDX-NET Voc FT",
+        help="Comma separated models to warm up after startup when --weights-dir is set: hubert, rmvpe and/or "
+        "stemming model names. Empty to disable",
+    )
     return parser
+
+
+def get_server_args():
+    # uvicorn imports the app in the same process, so unknown args (and multiprocessing's) are ignored
+    args, _ = get_server_arg_parser().parse_known_args()
+    return args
@@ -0,0 +1,106 @@
+import os
+
+from inference.api_models import CreateSongOptions, CreateSongReq, JobProgressResp
+from inference.coalescing import JobCoalescer, follower_progress, job_key, normalized_options
+
+
+def request(song, output_directory="outputs", **options):
+    return CreateSongReq(
+        outputDirectory=output_directory,
+        modelPath="model.pth",
+        weightsPath="weights",
+        songUrlOrFilePath=song,
+        options=CreateSongOptions(**options) if options else None,
+    )
+
+
+def write(path, content=b"song"):
+    with open(path, "wb") as f:
+        f.write(content)
+    return str(path)
+
+
+def test_unset_options_match_their_defaults():
+    assert normalized_options(None) == normalized_options(CreateSongOptions())
+    assert normalized_options(CreateSongOptions(pitch=None)) == normalized_options(CreateSongOptions(pitch=0))
+    assert normalized_options(CreateSongOptions(f0Method=None)) == normalized_options(CreateSongOptions())
+    # the start time only matters when sampling
+    assert normalized_options(CreateSongOptions(sampleModeStartTime=30)) == normalized_options(None)
+    assert normalized_options(CreateSongOptions(sampleMode=True, sampleModeStartTime=30)) != normalized_options(
+        CreateSongOptions(sampleMode=True)
+    )
+
+
+def test_key_ignores_where_the_output_goes(tmp_path, monkeypatch):
+    song = write(tmp_path / "song.mp3")
+    monkeypatch.chdir(tmp_path)
+    assert job_key(request(song, "a")) == job_key(request(song, "b"))
+    assert job_key(request(song)) == job_key(request("song.mp3"))
+    assert job_key(request(song)) == job_key(request(f"  {song} "))
+
+
+def test_key_follows_the_song_content(tmp_path):
+    song = write(tmp_path / "song.mp3")
+    copy = write(tmp_path / "copy.mp3")
+    other = write(tmp_path / "other.mp3", b"other song")
+    assert job_key(request(song)) == job_key(request(copy))
+    assert job_key(request(song)) != job_key(request(other))
+
+
+def test_key_follows_the_options(tmp_path):
+    song = write(tmp_path / "song.mp3")
+    assert job_key(request(song)) == job_key(request(song, pitch=0))
+    assert job_key(request(song)) != job_key(request(song, pitch=2))
+    assert job_key(request(song)) != job_key(request(song, outputFormat="wav"))
+
+
+def test_urls_are_their_own_identity():
+    url = "https://www.youtube.com/watch?v=abc"
+    assert job_key(request(url)) == job_key(request(url))
+    assert job_key(request(url)) != job_key(request("https://www.youtube.com/watch?v=def"))
+
+
+def test_followers_share_the_work_until_the_last_one_leaves():
+    coalescer = JobCoalescer()
+    assert coalescer.join("key", "primary", "outputs/primary") is None
+    assert coalescer.join("key", "follower", "elsewhere/follower") == "primary"
+    assert sorted(coalescer.subscribers("primary")) == ["follower", "primary"]
+    assert coalescer.directory("follower") == "elsewhere/follower"
+
+    # stopping the primary keeps its work running for the follower
+    assert coalescer.leave("primary") is None
+    assert coalescer.subscribers("primary") == ["follower"]
+    assert coalescer.leave("follower") == "primary"
+    # the stopped work takes no new followers
+    assert coalescer.join("key", "late") is None
+
+
+def test_finished_work_is_not_joined():
+    coalescer = JobCoalescer()
+    coalescer.join("key", "primary")
+    coalescer.join("key", "follower")
+    coalescer.finish("primary")
+    assert coalescer.subscribers("primary") == ["primary"]
+    assert coalescer.directory("follower") is None
+    assert coalescer.join("key", "again") is None
+
+
+def test_followers_get_their_own_copy_of_the_outputs(tmp_path):
+    source = os.path.join(tmp_path, "outputs", "primary")
+    target = os.path.join(tmp_path, "elsewhere", "follower")
+    os.makedirs(source)
+    output = write(os.path.join(source, "song.mp3"), b"converted")
+    stem = os.path.join(tmp_path, "outputs", "stems", "vocals.wav")
+
+    running = JobProgressResp(status="processing", jobId="primary", outputFilepath=output)
+    progress = follower_progress(running, "follower", source, target)
+    assert progress.jobId == "follower"
+    assert progress.outputFilepath == os.path.join(target, "song.mp3")
+    assert not os.path.exists(target)
+
+    done = JobProgressResp(status="completed", jobId="primary", outputFilepath=output, originalVocalsPath=stem)
+    progress = follower_progress(done, "follower", source, target)
+    assert progress.status == "completed"
+    assert progress.originalVocalsPath == stem
+    with open(progress.outputFilepath, "rb") as f:
+        assert f.read() == b"converted"
@@ -0,0 +1,89 @@
+import os
+
+from inference.api_models import CreateSongReq, JobProgressResp
+from inference.job_store import JobStore
+
+
+def request(song="song.mp3"):
+    return CreateSongReq(
+        outputDirectory="outputs", modelPath="model.pth", weightsPath="weights", songUrlOrFilePath=song
+    )
+
+
+def progress(status):
+    return JobProgressResp(status=status)
+
+
+def test_finished_jobs_are_evicted_after_the_retention_window(tmp_path):
+    store = JobStore(os.path.join(tmp_path, "jobs.sqlite3"), retention_seconds=60 * 60)
+    removed = []
+    store.add_listener(lambda job_id, _: None, removed.append)
+    for job_id in ("done", "running"):
+        store.add(job_id, request(), progress("queued"))
+    store.set("done", progress("completed"))
+    store.set("running", progress("processing"))
+
+    assert store.evict_finished() == 0
+    store.retention_seconds = -1
+    assert store.evict_finished() == 1
+    assert removed == ["done"]
+    assert "done" not in store
+    assert store.get("running").status == "processing"
+
+
+def test_interrupted_jobs_are_queued_again(tmp_path):
+    path = os.path.join(tmp_path, "jobs.sqlite3")
+    store = JobStore(path)
+    for job_id, status in (("first", "processing"), ("second", "queued"), ("done", "completed")):
+        store.add(job_id, request(f"{job_id}.mp3"), progress("queued"))
+        store.set(job_id, progress(status))
+
+    # the server died, a new one opens the same database
+    restarted = JobStore(path)
+    interrupted = restarted.take_interrupted()
+    assert [(job_id, body.songUrlOrFilePath) for job_id, body in interrupted] == [
+        ("first", "first.mp3"),
+        ("second", "second.mp3"),
+    ]
+    assert restarted.get("first").status == "queued"
+    assert restarted.get("done").status == "completed"
+    assert JobStore(path).get("first").status == "queued"
+
+
+def test_updates_never_create_jobs():
+    store = JobStore()
+    store.set("unknown", progress("processing"))
+    assert "unknown" not in store
+
+    store.add("cleared", request(), progress("queued"))
+    store.remove("cleared")
+    store.set("cleared", progress("completed"))
+    assert "cleared" not in store
+    assert store.count() == 0
+
+
+def test_list_filters_and_pages():
+    store = JobStore()
+    for index in range(5):
+        store.add(f"job{index}", request(), progress("queued"))
+    store.set("job1", progress("completed"))
+    store.set("job3", progress("completed"))
+
+    assert [job.jobId for job in store.list(offset=1, limit=2)] == ["job1", "job2"]
+    assert [job.jobId for job in store.list(["completed"])] == ["job1", "job3"]
+    assert store.count(["queued"]) == 3
+
+
+def test_batches_outlive_the_server_and_go_with_their_jobs(tmp_path):
+    path = os.path.join(tmp_path, "jobs.sqlite3")
+    store = JobStore(path)
+    for job_id in ("a", "b"):
+        store.add(job_id, request(), progress("queued"), batch_id="batch")
+    store.add("alone", request(), progress("queued"))
+    store.set("a", progress("completed"))
+
+    restarted = JobStore(path)
+    assert [(job.jobId, job.status) for job in restarted.batch("batch")] == [("a", "completed"), ("b", "queued")]
+    restarted.remove("a")
+    restarted.remove("b")
+    assert restarted.batch("batch") == []
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from inference import retrieval  # noqa: E402
+from inference.retrieval import FeatureRetriever  # noqa: E402
+
+DIMS = 32
+VECTORS = 1000
+LISTS = 16
+K = retrieval.SEARCH_K
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((VECTORS, DIMS), dtype=np.float32)
+    queries = rng.standard_normal((300, DIMS), dtype=np.float32)
+    return vectors, queries
+
+
+@pytest.fixture(scope="module")
+def retriever(data):
+    vectors, _ = data
+    # the model's index, as training builds it
+    index = faiss.index_factory(DIMS, f"IVF{LISTS},Flat")
+    index.train(vectors)
+    index.add(vectors)
+    return FeatureRetriever(index, index.reconstruct_n(0, index.ntotal))
+
+
+def assert_same_neighbours(expected, actual):
+    expected_distances, expected_ids = expected
+    distances, ids = actual
+    np.testing.assert_allclose(distances, expected_distances, rtol=1e-4, atol=1e-3)
+    np.testing.assert_array_equal(ids, expected_ids)
+
+
+def test_exact_agrees_with_faiss_brute_force(data, retriever):
+    vectors, queries = data
+    flat = faiss.IndexFlatL2(DIMS)
+    flat.add(retriever.big_npy)
+    assert_same_neighbours(flat.search(queries, K), retriever.search(queries, K, backend="exact"))
+
+
+def test_exact_agrees_with_ivf_probing_every_list(data, retriever):
+    _, queries = data
+    assert_same_neighbours(
+        retriever.search(queries, K, backend="ivf", nprobe=LISTS), retriever.search(queries, K, backend="exact")
+    )
+
+
+def test_exact_search_tiles_the_vectors(data, retriever, monkeypatch):
+    _, queries = data
+    expected = retriever.search(queries, K, backend="exact")
+    # tiles smaller than k, and a last tile smaller than the others
+    for tile in (5, 64, 333):
+        monkeypatch.setattr(retrieval, "CHUNK_VECTORS", tile)
+        monkeypatch.setattr(retrieval, "CHUNK_FRAMES", 128)
+        assert_same_neighbours(expected, retriever.search(queries, K, backend="exact"))
+
+
+def test_exact_search_pads_like_faiss(data):
+    vectors, queries = data
+    few = FeatureRetriever(faiss.IndexFlatL2(DIMS), vectors[:3])
+    distances, ids = few.search(queries, K, backend="exact")
+    assert (ids[:, 3:] == -1).all()
+    assert (ids[:, :3] >= 0).all()
+    assert (np.diff(distances[:, :3], axis=1) >= 0).all()
+
+
+def test_exact_matches_take_all_the_weight(data, retriever):
+    vectors, _ = data
+    frames = vectors[[3, 500, 999]]
+    for backend in ("exact", "ivf"):
+        np.testing.assert_allclose(retriever.retrieve(frames, backend=backend, nprobe=LISTS), frames, atol=1e-5)
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from inference.cancel import CancelToken, JobCancelled
+from inference.scheduler import DEFAULT_STAGE_SLOTS, JobScheduler, parse_stage_slots
+
+
+def stop_after(seconds):
+    deadline = time.time() + seconds
+    return lambda: time.time() > deadline
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_stage_cap():
+    scheduler = JobScheduler(cpu_slots=4, device_slots=4, stage_slots={"rvc": 1})
+    assert scheduler.acquire("rvc")
+    assert not scheduler.acquire("rvc", should_stop=stop_after(0.3))
+    scheduler.release("rvc")
+    assert scheduler.acquire("rvc", should_stop=stop_after(0.3))
+
+
+def test_class_cap_is_shared_by_its_stages():
+    scheduler = JobScheduler(cpu_slots=4, device_slots=1)
+    assert scheduler.acquire("separation")
+    assert not scheduler.acquire("rvc", should_stop=stop_after(0.3))
+    # cpu stages have slots of their own
+    assert scheduler.acquire("encode", should_stop=stop_after(0.3))
+    scheduler.release("separation")
+    assert scheduler.acquire("rvc", should_stop=stop_after(0.3))
+
+
+def test_earlier_jobs_go_first():
+    scheduler = JobScheduler(cpu_slots=4, device_slots=4, stage_slots={"rvc": 1})
+    assert scheduler.acquire("rvc")
+    entered = []
+
+    def job(priority):
+        scheduler.acquire("rvc", priority=priority)
+        entered.append(priority)
+        scheduler.release("rvc")
+
+    # the later job asks first
+    threads = [threading.Thread(target=job, args=(priority,)) for priority in (2.0, 1.0)]
+    for thread in threads:
+        thread.start()
+        wait_until(lambda: len(scheduler._waiting["rvc"]) == threads.index(thread) + 1)
+    scheduler.release("rvc")
+    for thread in threads:
+        thread.join(5)
+    assert entered == [1.0, 2.0]
+
+
+def test_a_stopped_wait_gives_up_its_place():
+    scheduler = JobScheduler(cpu_slots=4, device_slots=4, stage_slots={"rvc": 1})
+    assert scheduler.acquire("rvc")
+    assert not scheduler.acquire("rvc", priority=0, should_stop=stop_after(0.1))
+    assert scheduler._waiting["rvc"] == []
+    scheduler.release("rvc")
+    assert scheduler.acquire("rvc", should_stop=stop_after(0.3))
+
+
+def test_stage_raises_when_cancelled_while_waiting():
+    scheduler = JobScheduler(cpu_slots=4, device_slots=4, stage_slots={"rvc": 1})
+    token = CancelToken()
+    with scheduler.stage("rvc"):
+        threading.Timer(0.1, token.cancel).start()
+        with pytest.raises(JobCancelled):
+            with scheduler.stage("rvc", cancel_token=token):
+                pass
+    with scheduler.stage("rvc", cancel_token=CancelToken()):
+        assert scheduler._active["rvc"] == 1
+    assert scheduler._active["rvc"] == 0
+
+
+def test_stage_slots_override_the_defaults():
+    scheduler = JobScheduler(cpu_slots=4, device_slots=4, stage_slots=parse_stage_slots("rvc=2"))
+    assert scheduler.stage_slots["rvc"] == 2
+    for name, slots in DEFAULT_STAGE_SLOTS.items():
+        if name != "rvc":
+            assert scheduler.stage_slots[name] == slots
+    # stages without a cap of their own are capped by their class
+    assert scheduler.stage_slots["encode"] == 4
+
+
+def test_unknown_stages_are_rejected():
+    with pytest.raises(ValueError):
+        parse_stage_slots("mixing=1")
+    with pytest.raises(ValueError):
+        parse_stage_slots("rvc=0")
+    with pytest.raises(ValueError):
+        JobScheduler(stage_slots={"mixing": 1})
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from inference.segmenter import moving_sum, split_points
+
+WINDOW = 160
+CENTER = 6000
+QUERY = 1600
+
+
+def split_points_loop(audio, window, center, query):
+    """The loop split_points replaced in VC.pipeline."""
+    audio_pad = np.pad(audio, (window // 2, window // 2), mode="reflect")
+    audio_sum = np.zeros_like(audio)
+    for i in range(window):
+        audio_sum += audio_pad[i : i - window]
+    points = []
+    for t in range(center, audio.shape[0], center):
+        near = np.abs(audio_sum[t - query : t + query])
+        points.append(t - query + np.where(near == near.min())[0][0])
+    return points
+
+
+@pytest.mark.parametrize("length", [CENTER, CENTER + 1, 4 * CENTER + 17, 10 * CENTER - QUERY // 2, 10 * CENTER])
+def test_split_points_match_the_loop(length):
+    audio = np.random.default_rng(length).normal(size=length)
+    assert split_points(audio, WINDOW, CENTER, QUERY) == split_points_loop(audio, WINDOW, CENTER, QUERY)
+
+
+def test_split_points_prefer_the_first_of_equally_quiet_points():
+    audio = np.ones(3 * CENTER)
+    audio[CENTER - 500 : CENTER + 500] = 0
+    audio[2 * CENTER - 500 : 2 * CENTER + 500] = 0
+    assert split_points(audio, WINDOW, CENTER, QUERY) == split_points_loop(audio, WINDOW, CENTER, QUERY)
+
+
+def test_short_audio_is_not_split():
+    assert split_points(np.ones(CENTER), WINDOW, CENTER, QUERY) == []
+
+
+def test_moving_sum_centres_the_window():
+    audio = np.random.default_rng(0).normal(size=1000)
+    padded = np.pad(audio, (WINDOW // 2, WINDOW // 2), mode="reflect")
+    expected = [padded[i : i + WINDOW].sum() for i in range(audio.shape[0])]
+    np.testing.assert_allclose(moving_sum(audio, WINDOW), expected, atol=1e-9)
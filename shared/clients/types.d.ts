@@ -8,6 +8,40 @@ import type {
 
 declare namespace Components {
   namespace Schemas {
+    /**
+     * BatchProgressReq
+     */
+    export interface BatchProgressReq {
+      /**
+       * Batchid
+       */
+      batchId: string;
+    }
+    /**
+     * BatchProgressResp
+     */
+    export interface BatchProgressResp {
+      /**
+       * Status
+       */
+      status: "queued" | "processing" | "errored" | "completed" | "unknown_job" | "unknown" | "stopped";
+      /**
+       * Batchid
+       */
+      batchId: /* Batchid */ string | null;
+      /**
+       * Completedtracks
+       */
+      completedTracks: number;
+      /**
+       * Totaltracks
+       */
+      totalTracks: number;
+      /**
+       * Jobs
+       */
+      jobs: /* JobProgressResp */ JobProgressResp[];
+    }
     /**
      * ClearJobReq
      */
@@ -17,6 +51,45 @@ declare namespace Components {
        */
       jobId: string;
     }
+    /**
+     * CreateBatchReq
+     */
+    export interface CreateBatchReq {
+      /**
+       * Outputdirectory
+       */
+      outputDirectory: string;
+      /**
+       * Modelpath
+       */
+      modelPath: string;
+      /**
+       * Weightspath
+       */
+      weightsPath: string;
+      /**
+       * Modelid
+       */
+      modelId?: /* Modelid */ string | null;
+      /**
+       * Songurlorfilepaths
+       */
+      songUrlOrFilePaths: string[];
+      options?: /* CreateSongOptions */ CreateSongOptionsInput | null;
+    }
+    /**
+     * CreateBatchResp
+     */
+    export interface CreateBatchResp {
+      /**
+       * Batchid
+       */
+      batchId: string;
+      /**
+       * Jobids
+       */
+      jobIds: string[];
+    }
     /**
      * CreateSongOptions
      */
@@ -62,6 +135,14 @@ declare namespace Components {
        * Indexratio
        */
       indexRatio?: /* Indexratio */ number | null;
+      /**
+       * Indexbackend
+       */
+      indexBackend?: /* Indexbackend */ ("auto" | "ivf" | "hnsw" | "exact") | null;
+      /**
+       * Indexnprobe
+       */
+      indexNprobe?: /* Indexnprobe */ number | null;
       /**
        * Consonantprotection
        */
@@ -120,6 +201,14 @@ declare namespace Components {
        * Indexratio
        */
       indexRatio: /* Indexratio */ number | null;
+      /**
+       * Indexbackend
+       */
+      indexBackend: /* Indexbackend */ ("auto" | "ivf" | "hnsw" | "exact") | null;
+      /**
+       * Indexnprobe
+       */
+      indexNprobe: /* Indexnprobe */ number | null;
       /**
        * Consonantprotection
        */
@@ -194,6 +283,10 @@ declare namespace Components {
        * Ok
        */
       ok: boolean;
+      /**
+       * Ready
+       */
+      ready: /* Ready */ boolean | null;
     }
     /**
      * JobProgressReq
@@ -232,6 +325,12 @@ declare namespace Components {
        * Remainingseconds
        */
       remainingSeconds: /* Remainingseconds */ number | null;
+      /**
+       * Stageseconds
+       */
+      stageSeconds: /* Stageseconds */ {
+        [name: string]: number;
+      } | null;
       /**
        * Outputfilepath
        */
@@ -265,6 +364,10 @@ declare namespace Components {
        * Songhash
        */
       songHash: /* Songhash */ string | null;
+      /**
+       * Contenthash
+       */
+      contentHash: /* Contenthash */ string | null;
       /**
        * Trackname
        */
@@ -278,6 +381,10 @@ declare namespace Components {
        * Jobs
        */
       jobs: /* JobProgressResp */ JobProgressResp[];
+      /**
+       * Total
+       */
+      total: /* Total */ number | null;
     }
     /**
      * SetDeviceReq
@@ -358,9 +465,71 @@ declare namespace Components {
        */
       type: string;
     }
+    /**
+     * WarmupModelStatus
+     */
+    export interface WarmupModelStatus {
+      /**
+       * Name
+       */
+      name: string;
+      /**
+       * Status
+       */
+      status: "pending" | "loading" | "ready" | "errored";
+      /**
+       * Loadseconds
+       */
+      loadSeconds: /* Loadseconds */ number | null;
+      /**
+       * Error
+       */
+      error: /* Error */ string | null;
+    }
+    /**
+     * WarmupReq
+     */
+    export interface WarmupReq {
+      /**
+       * Weightspath
+       */
+      weightsPath: string;
+      /**
+       * Models
+       */
+      models?: /* Models */ string[] | null;
+    }
+    /**
+     * WarmupResp
+     */
+    export interface WarmupResp {
+      /**
+       * Status
+       */
+      status: "idle" | "warming" | "ready" | "errored";
+      /**
+       * Weightspath
+       */
+      weightsPath: /* Weightspath */ string | null;
+      /**
+       * Elapsedseconds
+       */
+      elapsedSeconds: /* Elapsedseconds */ number | null;
+      /**
+       * Models
+       */
+      models: /* WarmupModelStatus */ WarmupModelStatus[];
+    }
   }
 }
 declare namespace Paths {
+  namespace BatchProgress {
+    export type RequestBody = /* BatchProgressReq */ Components.Schemas.BatchProgressReq;
+    namespace Responses {
+      export type $200 = /* BatchProgressResp */ Components.Schemas.BatchProgressResp;
+      export type $422 = /* HTTPValidationError */ Components.Schemas.HTTPValidationError;
+    }
+  }
   namespace ClearJob {
     export type RequestBody = /* ClearJobReq */ Components.Schemas.ClearJobReq;
     namespace Responses {
@@ -368,6 +537,13 @@ declare namespace Paths {
       export type $422 = /* HTTPValidationError */ Components.Schemas.HTTPValidationError;
     }
   }
+  namespace CreateBatch {
+    export type RequestBody = /* CreateBatchReq */ Components.Schemas.CreateBatchReq;
+    namespace Responses {
+      export type $200 = /* CreateBatchResp */ Components.Schemas.CreateBatchResp;
+      export type $422 = /* HTTPValidationError */ Components.Schemas.HTTPValidationError;
+    }
+  }
   namespace CreateSong {
     export type RequestBody = /* CreateSongReq */ Components.Schemas.CreateSongReq;
     namespace Responses {
@@ -380,6 +556,11 @@ declare namespace Paths {
       export type $200 = /* DeviceOptionsResp */ Components.Schemas.DeviceOptionsResp;
     }
   }
+  namespace GetMetrics {
+    namespace Responses {
+      export type $200 = string;
+    }
+  }
   namespace Health {
     namespace Responses {
       export type $200 = /* HealthResp */ Components.Schemas.HealthResp;
@@ -390,9 +571,35 @@ declare namespace Paths {
       export type $200 = /* HealthResp */ Components.Schemas.HealthResp;
     }
   }
+  namespace JobEvents {
+    namespace Parameters {
+      export type JobId = /* Jobid */ string | null;
+      export type MaxUpdatesPerSecond = /* Maxupdatespersecond */ number | null;
+    }
+    export interface QueryParameters {
+      jobId?: Parameters.JobId;
+      maxUpdatesPerSecond?: Parameters.MaxUpdatesPerSecond;
+    }
+    namespace Responses {
+      export type $200 = any;
+      export type $422 = /* HTTPValidationError */ Components.Schemas.HTTPValidationError;
+    }
+  }
   namespace Jobs {
+    namespace Parameters {
+      export type Status = /* Status */
+      ("queued" | "processing" | "errored" | "completed" | "unknown_job" | "unknown" | "stopped")[] | null;
+      export type Offset = number;
+      export type Limit = number;
+    }
+    export interface QueryParameters {
+      status?: Parameters.Status;
+      offset?: Parameters.Offset;
+      limit?: Parameters.Limit;
+    }
     namespace Responses {
       export type $200 = /* JobsResp */ Components.Schemas.JobsResp;
+      export type $422 = /* HTTPValidationError */ Components.Schemas.HTTPValidationError;
     }
   }
   namespace SetDevice {
@@ -414,6 +621,13 @@ declare namespace Paths {
       export type $422 = /* HTTPValidationError */ Components.Schemas.HTTPValidationError;
     }
   }
+  namespace StartWarmup {
+    export type RequestBody = /* WarmupReq */ Components.Schemas.WarmupReq;
+    namespace Responses {
+      export type $200 = /* WarmupResp */ Components.Schemas.WarmupResp;
+      export type $422 = /* HTTPValidationError */ Components.Schemas.HTTPValidationError;
+    }
+  }
   namespace StemmingModels {
     namespace Responses {
       export type $200 = /* StemmingModelsResp */ Components.Schemas.StemmingModelsResp;
@@ -431,6 +645,11 @@ declare namespace Paths {
       export type $200 = /* TorchDevice */ Components.Schemas.TorchDevice;
     }
   }
+  namespace WarmupStatus {
+    namespace Responses {
+      export type $200 = /* WarmupResp */ Components.Schemas.WarmupResp;
+    }
+  }
 }
 
 export interface OperationMethods {
@@ -466,6 +685,34 @@ export interface OperationMethods {
     data?: any,
     config?: AxiosRequestConfig,
   ): OperationResponse<Paths.Health.Responses.$200>;
+  /**
+   * getMetrics - Get Metrics
+   *
+   * Prometheus text format: queue and job gauges, per-stage duration histograms, model pool and disk counters.
+   */
+  "getMetrics"(
+    parameters?: Parameters<UnknownParamsObject> | null,
+    data?: any,
+    config?: AxiosRequestConfig,
+  ): OperationResponse<Paths.GetMetrics.Responses.$200>;
+  /**
+   * warmupStatus - Warmup Status
+   */
+  "warmupStatus"(
+    parameters?: Parameters<UnknownParamsObject> | null,
+    data?: any,
+    config?: AxiosRequestConfig,
+  ): OperationResponse<Paths.WarmupStatus.Responses.$200>;
+  /**
+   * startWarmup - Start Warmup
+   *
+   * Preload models in the background; poll GET /warmup for per-model timings.
+   */
+  "startWarmup"(
+    parameters?: Parameters<UnknownParamsObject> | null,
+    data?: Paths.StartWarmup.RequestBody,
+    config?: AxiosRequestConfig,
+  ): OperationResponse<Paths.StartWarmup.Responses.$200>;
   /**
    * songProgress - Song Progress
    *
@@ -476,6 +723,16 @@ export interface OperationMethods {
     data?: Paths.SongProgress.RequestBody,
     config?: AxiosRequestConfig,
   ): OperationResponse<Paths.SongProgress.Responses.$200>;
+  /**
+   * jobEvents - Job Events
+   *
+   * Stream job progress as server-sent events: a snapshot, then only the fields that changed.
+   */
+  "jobEvents"(
+    parameters?: Parameters<Paths.JobEvents.QueryParameters> | null,
+    data?: any,
+    config?: AxiosRequestConfig,
+  ): OperationResponse<Paths.JobEvents.Responses.$200>;
   /**
    * createSong - Create Song
    *
@@ -486,6 +743,24 @@ export interface OperationMethods {
     data?: Paths.CreateSong.RequestBody,
     config?: AxiosRequestConfig,
   ): OperationResponse<Paths.CreateSong.Responses.$200>;
+  /**
+   * createBatch - Create Batch
+   *
+   * Convert many songs with one voice model, loading the model once for the whole batch.
+   */
+  "createBatch"(
+    parameters?: Parameters<UnknownParamsObject> | null,
+    data?: Paths.CreateBatch.RequestBody,
+    config?: AxiosRequestConfig,
+  ): OperationResponse<Paths.CreateBatch.Responses.$200>;
+  /**
+   * batchProgress - Batch Progress
+   */
+  "batchProgress"(
+    parameters?: Parameters<UnknownParamsObject> | null,
+    data?: Paths.BatchProgress.RequestBody,
+    config?: AxiosRequestConfig,
+  ): OperationResponse<Paths.BatchProgress.Responses.$200>;
   /**
    * clearJob - Clear Job
    */
@@ -506,7 +781,7 @@ export interface OperationMethods {
    * jobs - Jobs
    */
   "jobs"(
-    parameters?: Parameters<UnknownParamsObject> | null,
+    parameters?: Parameters<Paths.Jobs.QueryParameters> | null,
     data?: any,
     config?: AxiosRequestConfig,
   ): OperationResponse<Paths.Jobs.Responses.$200>;
@@ -577,6 +852,38 @@ export interface PathsDictionary {
       config?: AxiosRequestConfig,
     ): OperationResponse<Paths.Health.Responses.$200>;
   };
+  ["/metrics"]: {
+    /**
+     * getMetrics - Get Metrics
+     *
+     * Prometheus text format: queue and job gauges, per-stage duration histograms, model pool and disk counters.
+     */
+    "get"(
+      parameters?: Parameters<UnknownParamsObject> | null,
+      data?: any,
+      config?: AxiosRequestConfig,
+    ): OperationResponse<Paths.GetMetrics.Responses.$200>;
+  };
+  ["/warmup"]: {
+    /**
+     * warmupStatus - Warmup Status
+     */
+    "get"(
+      parameters?: Parameters<UnknownParamsObject> | null,
+      data?: any,
+      config?: AxiosRequestConfig,
+    ): OperationResponse<Paths.WarmupStatus.Responses.$200>;
+    /**
+     * startWarmup - Start Warmup
+     *
+     * Preload models in the background; poll GET /warmup for per-model timings.
+     */
+    "post"(
+      parameters?: Parameters<UnknownParamsObject> | null,
+      data?: Paths.StartWarmup.RequestBody,
+      config?: AxiosRequestConfig,
+    ): OperationResponse<Paths.StartWarmup.Responses.$200>;
+  };
   ["/song_progress"]: {
     /**
      * songProgress - Song Progress
@@ -589,6 +896,18 @@ export interface PathsDictionary {
       config?: AxiosRequestConfig,
     ): OperationResponse<Paths.SongProgress.Responses.$200>;
   };
+  ["/job_events"]: {
+    /**
+     * jobEvents - Job Events
+     *
+     * Stream job progress as server-sent events: a snapshot, then only the fields that changed.
+     */
+    "get"(
+      parameters?: Parameters<Paths.JobEvents.QueryParameters> | null,
+      data?: any,
+      config?: AxiosRequestConfig,
+    ): OperationResponse<Paths.JobEvents.Responses.$200>;
+  };
   ["/create_song"]: {
     /**
      * createSong - Create Song
@@ -601,6 +920,28 @@ export interface PathsDictionary {
       config?: AxiosRequestConfig,
     ): OperationResponse<Paths.CreateSong.Responses.$200>;
   };
+  ["/create_batch"]: {
+    /**
+     * createBatch - Create Batch
+     *
+     * Convert many songs with one voice model, loading the model once for the whole batch.
+     */
+    "post"(
+      parameters?: Parameters<UnknownParamsObject> | null,
+      data?: Paths.CreateBatch.RequestBody,
+      config?: AxiosRequestConfig,
+    ): OperationResponse<Paths.CreateBatch.Responses.$200>;
+  };
+  ["/batch_progress"]: {
+    /**
+     * batchProgress - Batch Progress
+     */
+    "post"(
+      parameters?: Parameters<UnknownParamsObject> | null,
+      data?: Paths.BatchProgress.RequestBody,
+      config?: AxiosRequestConfig,
+    ): OperationResponse<Paths.BatchProgress.Responses.$200>;
+  };
   ["/clear_job"]: {
     /**
      * clearJob - Clear Job
@@ -626,7 +967,7 @@ export interface PathsDictionary {
      * jobs - Jobs
      */
     "get"(
-      parameters?: Parameters<UnknownParamsObject> | null,
+      parameters?: Parameters<Paths.Jobs.QueryParameters> | null,
       data?: any,
       config?: AxiosRequestConfig,
     ): OperationResponse<Paths.Jobs.Responses.$200>;